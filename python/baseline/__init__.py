@@ -3,6 +3,7 @@ try:
     from baseline.utils import *
     from baseline.vectorizers import *
     from baseline.w2v import *
+    from baseline.metrics import *
     from baseline.confusion import *
     from baseline.data import *
     from baseline.reader import *
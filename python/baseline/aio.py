@@ -0,0 +1,232 @@
+"""Asyncio versions of the `Service` and `RemoteModel` calls.
+
+This module needs Python 3, the methods that use it (`Service.apredict`, `RemoteModel.apredict`) only import it when
+they are called so the rest of `baseline` still works on Python 2.
+"""
+import asyncio
+from functools import partial
+import numpy as np
+from baseline.utils import export, import_user_module
+from baseline.remote import verify_example
+
+__all__ = []
+exporter = export(__all__)
+
+
+@exporter
+class AsyncHTTPConnectionPool(object):
+
+    def __init__(self, hostname, port, pool_size=4, timeout=None):
+        """A pool of keep-alive HTTP/1.1 connections to one server for asyncio
+
+        All of the requests on an event loop share the pool.  At most `pool_size` requests are in flight at once, the
+        rest wait for a connection to be free, which pushes back on the callers.
+
+        :param hostname: The server
+        :param port: The port
+        :param pool_size: The most connections to have open at once
+        :param timeout: How long to wait for a new connection in seconds (defaults to no timeout)
+        """
+        self.hostname = hostname
+        self.port = int(port)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = []
+        self._slots = None
+
+    async def _connect(self):
+        return await asyncio.wait_for(asyncio.open_connection(self.hostname, self.port), self.timeout)
+
+    async def _send(self, conn, method, path, body, headers):
+        reader, writer = conn
+        try:
+            head = ['{} {} HTTP/1.1'.format(method, path), 'Host: {}:{}'.format(self.hostname, self.port)]
+            head += ['{}: {}'.format(k, v) for k, v in headers.items()]
+            head.append('Content-Length: {}'.format(len(body)))
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError('The server closed the connection')
+            status = int(status_line.split()[1])
+            response_headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                k, _, v = line.decode('latin-1').partition(':')
+                response_headers[k.strip().lower()] = v.strip()
+            keep_alive = response_headers.get('connection', '').lower() != 'close'
+            if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+                chunks = []
+                while True:
+                    size = int((await reader.readline()).split(b';')[0], 16)
+                    chunk = await reader.readexactly(size + 2)
+                    if size == 0:
+                        break
+                    chunks.append(chunk[:-2])
+                data = b''.join(chunks)
+            elif 'content-length' in response_headers:
+                data = await reader.readexactly(int(response_headers['content-length']))
+            else:
+                data = await reader.read()
+                keep_alive = False
+        except BaseException:
+            # Including cancellation, after which the connection is in an unknown state
+            writer.close()
+            raise
+        if keep_alive:
+            self._idle.append(conn)
+        else:
+            writer.close()
+        return status, data
+
+    async def request(self, method, path, body=b'', headers=None):
+        """Send a request over an idle connection, or a new one if none are idle
+
+        :param method: The HTTP method
+        :param path: The path to request
+        :param body: (``bytes``) The body of the request
+        :param headers: A `dict` of headers
+        :return: The status and the body of the response
+        """
+        headers = {} if headers is None else headers
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        async with self._slots:
+            if self._idle:
+                try:
+                    return await self._send(self._idle.pop(), method, path, body, headers)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    # The server can close a connection while it is idle, so try once more on a new one
+                    pass
+            return await self._send(await self._connect(), method, path, body, headers)
+
+    def close(self):
+        """Close all of the idle connections"""
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+def _on_loop(remote, attr, create_fn):
+    """Get something that belongs to the current event loop, creating it the first time it is needed on a loop"""
+    loop = asyncio.get_event_loop()
+    owner, value = getattr(remote, attr, (None, None))
+    if owner is not loop:
+        value = create_fn()
+        setattr(remote, attr, (loop, value))
+    return value
+
+
+def _http_pool(remote):
+    return _on_loop(
+        remote, '_async_pool',
+        lambda: AsyncHTTPConnectionPool(remote.hostname, remote.port, remote.pool.pool_size, remote.pool.timeout)
+    )
+
+
+@exporter
+async def apredict_rest(remote, examples, timeout=None):
+    """The coroutine behind `RemoteModelREST.apredict`
+
+    :param remote: (``RemoteModelREST``) The remote model
+    :param examples: The input examples
+    :param timeout: A deadline for the request in seconds (defaults to None, no deadline)
+    :return: The outcomes
+    """
+    verify_example(examples, remote.input_keys)
+    post = _http_pool(remote).request('POST', remote.path, remote.serialize_request(examples), remote.headers)
+    _, response = await asyncio.wait_for(post, timeout)
+    return remote.deserialize_response(examples, remote.parse_response(response))
+
+
+@exporter
+async def apredict_rest_per_example(remote, examples, timeout=None):
+    """Send a request per example concurrently, for servers that only take a batch of one
+
+    The connection pool bounds how many are in flight at once.
+
+    :param remote: (``RemoteModelREST``) The remote model
+    :param examples: The input examples
+    :param timeout: A deadline for each request in seconds (defaults to None, no deadline)
+    :return: The outcomes, in the same order as the examples
+    """
+    batchsz = len(examples[remote.input_keys[0]])
+    requests = []
+    for i in range(batchsz):
+        example = {k: np.array([v[i]]) for k, v in examples.items()}
+        requests.append(apredict_rest(remote, example, timeout=timeout))
+    return [outcomes[0] for outcomes in await asyncio.gather(*requests)]
+
+
+def _grpc_stub(remote):
+    def create_stub():
+        grpc_aio = import_user_module('grpc.aio')
+        return remote.servicepb.PredictionServiceStub(grpc_aio.insecure_channel(remote.remote))
+    return _on_loop(remote, '_async_stub', create_stub)
+
+
+@exporter
+async def apredict_grpc(remote, examples, timeout=None):
+    """The coroutine behind `RemoteModelGRPC.apredict`, on a `grpc.aio` channel
+
+    :param remote: (``RemoteModelGRPC``) The remote model
+    :param examples: The input examples
+    :param timeout: A deadline for the request in seconds (defaults to None, no deadline)
+    :return: The outcomes
+    """
+    verify_example(examples, remote.input_keys)
+    request = remote.create_request(examples)
+    response = await _grpc_stub(remote).Predict(request, timeout=timeout)
+    return remote.deserialize_response(examples, response)
+
+
+@exporter
+async def apredict_model(model, examples, timeout=None, **kwargs):
+    """Run `model.predict` without blocking the event loop
+
+    Models with an `apredict` (the remote models) are awaited directly, anything else runs in the loop's executor.
+
+    :param model: The model
+    :param examples: The input examples
+    :param timeout: A deadline in seconds (defaults to None, no deadline)
+    :return: The outcomes
+    """
+    if hasattr(model, 'apredict'):
+        return await model.apredict(examples, timeout=timeout, **kwargs)
+    loop = asyncio.get_event_loop()
+    return await asyncio.wait_for(loop.run_in_executor(None, partial(model.predict, examples, **kwargs)), timeout)
+
+
+@exporter
+async def apredict(service, tokens, timeout=None, **kwargs):
+    """The coroutine behind `Service.apredict`
+
+    :param service: (``Service``) The service
+    :param tokens: The input
+    :param timeout: A deadline for the call to the model in seconds (defaults to None, no deadline)
+    :return: The output of `service.predict`
+    """
+    examples, inputs = service.prepare(tokens, **kwargs)
+    model_kwargs = service.model_kwargs(**kwargs)
+    if service.cache is None:
+        outcomes = await apredict_model(service.model, examples, timeout=timeout, **model_kwargs)
+    else:
+        lookup = service.cache.lookup(examples, sorted(model_kwargs.items()))
+        misses = None
+        if lookup.examples is not None:
+            misses = await apredict_model(service.model, lookup.examples, timeout=timeout, **model_kwargs)
+        outcomes = lookup.fill(misses)
+    return service.format_output(outcomes, inputs, **kwargs)
+
+
+@exporter
+async def await_future(future, timeout=None):
+    """Wait for a `concurrent.futures.Future` without blocking the event loop
+
+    :param future: (``concurrent.futures.Future``) The future
+    :param timeout: A deadline in seconds, the future is cancelled if it has not started by then (defaults to None, no
+        deadline)
+    :return: The result of the future
+    """
+    return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
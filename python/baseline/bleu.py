@@ -11,6 +11,7 @@ from six.moves import reduce, map, zip, range
 
 import sys
 import argparse
+import multiprocessing
 from operator import or_
 from itertools import chain
 from collections import Counter
@@ -193,6 +194,53 @@ def brevity_penalty(pred_len, gold_len):
     return bp, ratio
 
 
+def bleu_counts(preds, golds, n=4):
+    """Count the statistics BLEU is calculated from.
+
+    These can be summed across batches (or processes) and turned into a score
+    with `bleu_from_counts`.
+
+    :param preds: `List[List[str]]` A list of sentences generated by the model.
+    :param golds: `List[List[List[str]]]` A list of gold sentences, [B, R, T].
+    :param n: `int` The max size n-gram to use.
+
+    :returns:
+        4-tuple (
+            `np.array` The number of matches for each n_gram size,
+            `np.array` The number of possible matches for each n_gram size,
+            `int` The length of the predictions,
+            `int` The length of the references,
+        )
+    """
+    matches = np.zeros(n, dtype=np.int64)
+    total = np.zeros(n, dtype=np.int64)
+    pred_len, gold_len = corpora_lengths(preds, golds)
+    for pred, gold in zip(preds, golds):
+        max_gold_counts = max_gold_n_gram_counts(gold, n)
+        pred_counts = count_n_grams(pred, n)
+        matches = count_matches(pred_counts, max_gold_counts, matches)
+        total = count_possible(pred, total)
+    return matches, total, pred_len, gold_len
+
+
+def bleu_from_counts(matches, total, pred_len, gold_len):
+    """Calculate BLEU score from the statistics of `bleu_counts`.
+
+    :param matches: `np.array` The number of matches for each n_gram size.
+    :param total: `np.array` The number of possible matches for each n_gram size.
+    :param pred_len: `int` The length of the predictions.
+    :param gold_len: `int` The length of the references.
+
+    :returns: The same 6-tuple as `bleu`
+    """
+    n = len(matches)
+    precision = np.array([matches[i] / float(total[i]) if total[i] > 0 else 0.0 for i in range(n)])
+    geo_mean = geometric_mean(precision)
+    bp, len_ratio = brevity_penalty(pred_len, gold_len)
+    b = geo_mean * bp * 100
+    return (b, precision * 100, bp, len_ratio, pred_len, gold_len)
+
+
 def bleu(preds, golds, n=4):
     """Calculate BLEU score
 
@@ -213,24 +261,149 @@ def bleu(preds, golds, n=4):
             `float` The Bleu score,
             `np.array` The precision for each n_gram,
             `float` The brevity penalty,
+            `float` The ratio of the prediction length to the reference length,
             `int` The length of the predictions,
             `int` The length of the references,
         )
     """
-    matches = np.zeros(n)
-    total = np.zeros(n)
-    pred_len, gold_len = corpora_lengths(preds, golds)
-    for pred, gold in zip(preds, golds):
-        max_gold_counts = max_gold_n_gram_counts(gold, n)
-        pred_counts = count_n_grams(pred, n)
-        matches = count_matches(pred_counts, max_gold_counts, matches)
-        total = count_possible(pred, total)
+    return bleu_from_counts(*bleu_counts(preds, golds, n))
 
-    precision = np.array([matches[i] / float(total[i]) if total[i] > 0 else 0.0 for i in range(n)])
-    geo_mean = geometric_mean(precision)
-    bp, len_ratio = brevity_penalty(pred_len, gold_len)
-    b = geo_mean * bp * 100
-    return (b, precision * 100, bp, len_ratio, pred_len, gold_len)
+
+def _n_gram_keys(flat, starts, lengths, n, vsz):
+    """Give every n-gram of size `n` an integer key.
+
+    The key is the n-gram read as a number in base `vsz`, built up one token
+    at a time like a rolling hash, so two n-grams only share a key when they
+    are the same. When that could overflow an int64 the n-grams are numbered
+    by sorting them instead.
+
+    :param flat: `np.ndarray` The token ids of all the sentences, one after
+        the other.
+    :param starts: `np.ndarray` Where each sentence starts in `flat`.
+    :param lengths: `np.ndarray` The length of each sentence.
+    :param n: `int` The size of the n-grams.
+    :param vsz: `int` One more than the largest token id.
+
+    :returns: `(np.ndarray, np.ndarray)` The key of each n-gram and the
+        sentence it is from.
+    """
+    counts = np.maximum(lengths - n + 1, 0)
+    sentence = np.repeat(np.arange(len(lengths)), counts)
+    first = np.cumsum(counts) - counts
+    pos = starts[sentence] + np.arange(len(sentence)) - first[sentence]
+    if len(pos) == 0:
+        return np.zeros(0, dtype=np.int64), sentence
+    if vsz ** n <= np.iinfo(np.int64).max:
+        keys = np.zeros(len(pos), dtype=np.int64)
+        for i in range(n):
+            keys = keys * vsz + flat[pos + i]
+    else:
+        windows = np.stack([flat[pos + i] for i in range(n)], axis=1)
+        _, keys = np.unique(windows, axis=0, return_inverse=True)
+        keys = keys.reshape(-1)
+    return keys, sentence
+
+
+def bleu_counts_from_ids(preds, golds, n=4):
+    """Count the statistics BLEU is calculated from on token ids.
+
+    The counts are the same as `bleu_counts` would give for the tokens the ids
+    stand for. Each n-gram is an integer key and the clipping against the
+    references is done with sorted arrays for the whole corpus at once.
+
+    :param preds: `List[np.ndarray]` The token ids of each prediction, with
+        anything that is not a token (padding, `<GO>`, `<EOS>`) removed.
+    :param golds: `List[List[np.ndarray]]` The token ids of one or more
+        references for each prediction.
+    :param n: `int` The max size n-gram to use.
+
+    :returns: The same 4-tuple as `bleu_counts`
+    """
+    nrefs = np.array([len(gold) for gold in golds], dtype=np.int64)
+    sentences = [np.asarray(p, dtype=np.int64).reshape(-1) for p in preds]
+    sentences.extend(np.asarray(g, dtype=np.int64).reshape(-1) for gold in golds for g in gold)
+    lengths = np.array([len(x) for x in sentences], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    flat = np.concatenate(sentences) if lengths.sum() > 0 else np.zeros(0, dtype=np.int64)
+    vsz = int(flat.max()) + 1 if len(flat) > 0 else 1
+    npreds = len(preds)
+    pred_lens = lengths[:npreds]
+    gold_lens = lengths[npreds:]
+    # The example each sentence belongs to
+    example = np.concatenate([np.arange(npreds), np.repeat(np.arange(len(golds)), nrefs)]).astype(np.int64)
+
+    # Like `find_closest`, use the reference closest in length to the
+    # prediction, the shorter one on a tie
+    gold_example = example[npreds:]
+    diff = np.abs(pred_lens[gold_example] - gold_lens)
+    order = np.lexsort((gold_lens, diff, gold_example))
+    _, closest = np.unique(gold_example[order], return_index=True)
+    pred_len = int(pred_lens.sum())
+    gold_len = int(gold_lens[order][closest].sum())
+
+    matches = np.zeros(n, dtype=np.int64)
+    total = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        total[i] = np.maximum(pred_lens - i, 0).sum()
+        keys, sentence = _n_gram_keys(flat, starts, lengths, i + 1, vsz)
+        if len(keys) == 0:
+            continue
+        nkeys = int(keys.max()) + 1
+        if len(lengths) * nkeys > np.iinfo(np.int64).max:
+            # Number the n-grams densely so they fit in one int64 with the sentence
+            unique_keys, keys = np.unique(keys, return_inverse=True)
+            nkeys = len(unique_keys)
+        is_pred = sentence < npreds
+        pred_keys, pred_counts = np.unique(sentence[is_pred] * nkeys + keys[is_pred], return_counts=True)
+        gold_keys, gold_counts = np.unique(sentence[~is_pred] * nkeys + keys[~is_pred], return_counts=True)
+        if len(pred_keys) == 0 or len(gold_keys) == 0:
+            continue
+        gold_keys = example[gold_keys // nkeys] * nkeys + gold_keys % nkeys
+        if nrefs.max() > 1:
+            # Find the most times each n-gram appears in any one reference for the example
+            order = np.lexsort((gold_counts, gold_keys))
+            gold_keys, gold_counts = gold_keys[order], gold_counts[order]
+            last = np.append(gold_keys[1:] != gold_keys[:-1], True)
+            gold_keys, gold_counts = gold_keys[last], gold_counts[last]
+        # Clip the prediction counts with them
+        idx = np.minimum(np.searchsorted(gold_keys, pred_keys), len(gold_keys) - 1)
+        found = gold_keys[idx] == pred_keys
+        matches[i] = np.minimum(pred_counts[found], gold_counts[idx[found]]).sum()
+    return matches, total, pred_len, gold_len
+
+
+def _bleu_counts_shard(args):
+    return bleu_counts_from_ids(*args)
+
+
+def bleu_from_ids(preds, golds, n=4, workers=1):
+    """Calculate BLEU score on token ids
+
+    This gives the same results as `bleu` (and so `multi-bleu.pl`) does on the
+    tokens that the ids stand for.
+
+    :param preds: `List[np.ndarray]` The token ids of each prediction, see
+        `bleu_counts_from_ids`.
+    :param golds: `List[List[np.ndarray]]` The token ids of one or more
+        references for each prediction.
+    :param n: `int` The max size n-gram to use.
+    :param workers: `int` If more than 1 the corpus is split into this many
+        shards and they are counted in separate processes.
+
+    :returns: The same 6-tuple as `bleu`
+    """
+    if workers > 1 and len(preds) > 1:
+        bounds = np.linspace(0, len(preds), min(workers, len(preds)) + 1).astype(int)
+        shards = [(preds[s:e], golds[s:e], n) for s, e in zip(bounds[:-1], bounds[1:])]
+        pool = multiprocessing.Pool(len(shards))
+        try:
+            results = pool.map(_bleu_counts_shard, shards)
+        finally:
+            pool.terminate()
+        matches, total, pred_len, gold_len = map(sum, zip(*results))
+    else:
+        matches, total, pred_len, gold_len = bleu_counts_from_ids(preds, golds, n)
+    return bleu_from_counts(matches, total, int(pred_len), int(gold_len))
 
 
 # Slightly strange file readers that read from pre opened files to facilitate
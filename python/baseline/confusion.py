@@ -1,22 +1,39 @@
 import numpy as np
 from baseline.utils import export as export
+from baseline.metrics import MetricAccumulator
 from collections import OrderedDict
 import csv
 
 __all__ = []
 exporter = export(__all__)
 
+
+def _flat_labels(x):
+    """Get a batch of label ids as a flat numpy array, moving tensors off their device in one copy
+
+    :param x: A list, `np.ndarray`, `torch.Tensor` or eager `tf.Tensor` of label ids
+    :return: (``np.ndarray``) The ids as a flat int64 array
+    """
+    if hasattr(x, 'detach'):
+        x = x.detach().cpu().numpy()
+    elif hasattr(x, 'numpy'):
+        x = x.numpy()
+    return np.asarray(x, dtype=np.int64).ravel()
+
+
 @exporter
-class ConfusionMatrix(object):
+class ConfusionMatrix(MetricAccumulator):
     """Confusion matrix with metrics
 
     This class accumulates classification output, and tracks it in a confusion matrix.
-    Metrics are available that use the confusion matrix
+    Metrics are available that use the confusion matrix.  Matrices over the same labels can be merged
     """
-    def __init__(self, labels):
+    def __init__(self, labels, on_device=False):
         """Constructor with input labels
 
         :param labels: Either a dictionary (`k=int,v=str`) or an array of labels
+        :param on_device: If true, batches of `torch.Tensor` are counted on their own device and only copied to the
+            host when the matrix is read
         """
         if type(labels) is dict:
             self.labels = []
@@ -25,7 +42,20 @@ class ConfusionMatrix(object):
         else:
             self.labels = labels
         nc = len(self.labels)
-        self._cm = np.zeros((nc, nc), dtype=np.int)
+        self.on_device = on_device
+        self._host_cm = np.zeros((nc, nc), dtype=np.int64)
+        self._device_cm = None
+
+    @property
+    def _cm(self):
+        self._sync()
+        return self._host_cm
+
+    def _sync(self):
+        """Move any counts accumulated on a device into the host matrix"""
+        if self._device_cm is not None:
+            self._host_cm += self._device_cm.view(self._host_cm.shape).cpu().numpy()
+            self._device_cm = None
 
     def add(self, truth, guess):
         """Add a single value to the confusion matrix based off `truth` and `guess`
@@ -36,6 +66,10 @@ class ConfusionMatrix(object):
 
         self._cm[truth, guess] += 1
 
+    @property
+    def stats(self):
+        return self._cm
+
     def __str__(self):
         values = []
         width = max(8, max(len(x) for x in self.labels) + 1)
@@ -63,7 +97,8 @@ class ConfusionMatrix(object):
     def reset(self):
         """Reset the matrix
         """
-        self._cm *= 0
+        self._device_cm = None
+        self._host_cm[...] = 0
 
     def get_correct(self):
         """Get the diagonals of the confusion matrix
@@ -188,9 +223,35 @@ class ConfusionMatrix(object):
     def add_batch(self, truth, guess):
         """Add a batch of data to the confusion matrix
 
+        The batch is counted with a single vectorized update over the flattened matrix.  With `on_device`, batches of
+        `torch.Tensor` are counted where they are, otherwise each tensor is copied to the host once.
+
         :param truth: The truth tensor
         :param guess: The guess tensor
         :return:
         """
-        for truth_i, guess_i in zip(truth, guess):
-            self.add(truth_i, guess_i)
+        if self.on_device and hasattr(truth, 'index_add_'):
+            self._add_on_device(truth, guess)
+            return
+        nc = len(self.labels)
+        flat = _flat_labels(truth) * nc + _flat_labels(guess)
+        cm = self._host_cm.reshape(-1)
+        # A bincount is fastest unless the label set is large compared to the batch, then its cost is the size of the
+        # matrix, so only count the cells that were hit
+        if nc * nc <= 32 * len(flat) + 65536:
+            cm += np.bincount(flat, minlength=nc * nc)
+        else:
+            cells, counts = np.unique(flat, return_counts=True)
+            cm[cells] += counts
+
+    def _add_on_device(self, truth, guess):
+        nc = len(self.labels)
+        flat = truth.detach().reshape(-1).long() * nc + guess.detach().reshape(-1).long().to(truth.device)
+        if self._device_cm is not None and self._device_cm.device != flat.device:
+            self._sync()
+        if self._device_cm is None:
+            self._device_cm = flat.new_zeros(nc * nc)
+        self._device_cm.index_add_(0, flat, flat.new_ones(flat.shape))
+
+    def update(self, truth, guess):
+        self.add_batch(truth, guess)
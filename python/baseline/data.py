@@ -1,8 +1,14 @@
+import os
+import time
 import random
+import shutil
 import logging
+from collections import deque
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import math
-from baseline.utils import export
+from baseline.utils import export, read_json, write_json
 
 __all__ = []
 exporter = export(__all__)
@@ -16,10 +22,24 @@ class DataFeed(object):
     This class manages producing a dataset to the trainer, by iterating an epoch and producing
     a single step at a time.  The data can be shuffled per epoch, if requested, otherwise it is
     returned in the order of the dateset
+
+    Batches can optionally be built ahead of time on background threads.  The order of the epoch is
+    always decided up front on the calling thread, so prefetching does not change which batches are
+    produced or their order for a given random seed
     """
-    def __init__(self):
+    def __init__(self, **kwargs):
+        """Constructor
+
+        :Keyword Arguments:
+            * *prefetch* -- Build up to this many batches ahead of the trainer on background threads,
+                defaults to `0` (off)
+            * *prefetch_workers* -- The number of threads building batches (defaults to `1`)
+        """
         self.steps = 0
         self.shuffle = False
+        self.prefetch = int(kwargs.get('prefetch', 0))
+        self.prefetch_workers = int(kwargs.get('prefetch_workers', 1))
+        self.prefetch_stats = {}
 
     def _batch(self, i):
         pass
@@ -27,11 +47,49 @@ class DataFeed(object):
     def __getitem__(self, i):
         return self._batch(i)
 
+    def _epoch(self):
+        """Get what each batch in an epoch is made from, in order.  `_make_batch` turns one of these into a batch"""
+        return np.random.permutation(np.arange(self.steps)) if self.shuffle else np.arange(self.steps)
+
+    def _make_batch(self, spec):
+        return self._batch(spec)
+
+    def _prefetched(self, specs):
+        """Build batches on a thread pool, keeping up to `prefetch` batches in flight and yielding them in order
+
+        We record how often the trainer had to wait on a batch that wasn't ready yet and how long it waited,
+        if that happens a lot then input, not the model, is the bottleneck.
+        """
+        pool = ThreadPool(self.prefetch_workers)
+        specs = iter(specs)
+        pending = deque(pool.apply_async(self._make_batch, (spec,)) for spec in islice(specs, self.prefetch))
+        stats = {'batches': 0, 'starved': 0, 'wait_time': 0.0}
+        try:
+            while pending:
+                result = pending.popleft()
+                if not result.ready():
+                    stats['starved'] += 1
+                    start = time.time()
+                    result.wait()
+                    stats['wait_time'] += time.time() - start
+                batch = result.get()
+                for spec in islice(specs, 1):
+                    pending.append(pool.apply_async(self._make_batch, (spec,)))
+                stats['batches'] += 1
+                yield batch
+        finally:
+            pool.terminate()
+            self.prefetch_stats = stats
+            logger.info('Prefetch: waited on %d/%d batches for %.2fs total', stats['starved'], stats['batches'], stats['wait_time'])
+
     def __iter__(self):
-        shuffle = np.random.permutation(np.arange(self.steps)) if self.shuffle else np.arange(self.steps)
-        for i in range(self.steps):
-            si = shuffle[i]
-            yield self._batch(si)
+        specs = self._epoch()
+        if self.prefetch > 0:
+            for batch in self._prefetched(specs):
+                yield batch
+        else:
+            for spec in specs:
+                yield self._make_batch(spec)
 
     def __len__(self):
         return self.steps
@@ -64,8 +122,18 @@ class ExampleDataFeed(DataFeed):
             * *truncate* -- bool, If true the datastream will be cut short when
                 a full batch cannot be made, otherwise the final batch is smaller
                 than normal batches.
+            * *buckets* -- Group the examples by length before batching (defaults to `None`, no bucketing).
+                Either an ``int`` number of buckets, whose boundaries are picked from the length distribution,
+                or a ``list`` of bucket upper bounds.  Each epoch the examples are shuffled within their bucket
+                and the batches are shuffled across buckets, so with `trim` a batch is only padded to its bucket.
+                This requires the examples to support `gather` (`ColumnarExamples` does)
+            * *max_tokens* -- When bucketing, size each batch to hold at most this many (padded) tokens instead of
+                using a fixed `batchsz`
+            * *bucket_key* -- The lengths feature to bucket on, defaults to the `sort_key` of the examples
+            * *prefetch* -- Build this many batches ahead on background threads (see `DataFeed`)
+            * *prefetch_workers* -- The number of threads used to prefetch
         """
-        super(ExampleDataFeed, self).__init__()
+        super(ExampleDataFeed, self).__init__(**kwargs)
 
         self.examples = examples
         self.batchsz = batchsz
@@ -76,6 +144,66 @@ class ExampleDataFeed(DataFeed):
         else:
             self.steps = (len(self.examples) + batchsz - 1) // batchsz
         self.trim = bool(kwargs.get('trim', False))
+        self.buckets = kwargs.get('buckets')
+        self.max_tokens = kwargs.get('max_tokens')
+        self.bucket_batches = None
+        if self.buckets is not None:
+            bucket_key = kwargs.get('bucket_key', getattr(examples, 'sort_key', None))
+            if bucket_key is None or not hasattr(examples, 'gather'):
+                raise Exception('Bucketing requires a `bucket_key` and examples that support `gather`')
+            self.bucket_sizes = self._bucketize(examples.column(bucket_key))
+            self.bucket_batches = self._bucket_batches(shuffle=False)
+            self.steps = len(self.bucket_batches)
+
+    def _bucketize(self, lengths):
+        """Assign each example to a bucket and decide how many examples go in a batch for each bucket
+
+        :param lengths: The length of each example
+        :return: A ``list`` of (example indices, batch size) for each non-empty bucket
+        """
+        if len(lengths) == 0:
+            return []
+        if isinstance(self.buckets, int):
+            # Equal sized buckets: the bounds are the lengths found at each quantile
+            sorted_lengths = np.sort(lengths)
+            bounds = sorted_lengths[(np.arange(1, self.buckets + 1) * len(lengths)) // self.buckets - 1]
+        else:
+            bounds = np.array(sorted(self.buckets))
+        bounds = np.unique(bounds).astype(int)
+        # Anything longer than the last bound goes in an overflow bucket
+        if len(bounds) == 0 or bounds[-1] < lengths.max():
+            bounds = np.append(bounds, lengths.max())
+        assignment = np.searchsorted(bounds, lengths, side='left')
+        buckets = []
+        for b, width in enumerate(bounds):
+            indices = np.where(assignment == b)[0]
+            if len(indices) == 0:
+                continue
+            batchsz = self.batchsz if self.max_tokens is None else max(1, self.max_tokens // max(int(width), 1))
+            buckets.append((indices, batchsz))
+        return buckets
+
+    def _bucket_batches(self, shuffle):
+        batches = []
+        for indices, batchsz in self.bucket_sizes:
+            if shuffle:
+                indices = np.random.permutation(indices)
+            steps = len(indices) // batchsz if self.truncate else (len(indices) + batchsz - 1) // batchsz
+            for i in range(steps):
+                batches.append(indices[i * batchsz:(i + 1) * batchsz])
+        return batches
+
+    def _epoch(self):
+        if self.bucket_batches is None:
+            return super(ExampleDataFeed, self)._epoch()
+        batches = self._bucket_batches(self.shuffle)
+        order = np.random.permutation(len(batches)) if self.shuffle else np.arange(len(batches))
+        return [batches[i] for i in order]
+
+    def _make_batch(self, spec):
+        if self.bucket_batches is None:
+            return self._batch(spec)
+        return self.examples.gather(spec, trim=self.trim)
 
     def _batch(self, i):
         """
@@ -83,6 +211,8 @@ class ExampleDataFeed(DataFeed):
         :param i: (``int``) step index
         :return: A batch tensor x, batch tensor y
         """
+        if self.bucket_batches is not None:
+            return self.examples.gather(self.bucket_batches[i], trim=self.trim)
         batch = self.examples.batch(i, self.batchsz, trim=self.trim)
         return batch
 
@@ -258,21 +388,196 @@ class Seq2SeqExamples(object):
         return self._trim_batch(batch, max_src_len, max_tgt_len) if trim else batch
 
 
+@exporter
+def trim_batch(batch, sort_key):
+    """Trim a batch to the longest example in it
+
+    The `tgt` feature (if present) is trimmed using `tgt_lengths`, all other features use the `sort_key`
+
+    :param batch: (``dict``) A batch of `[B, ...]` arrays
+    :param sort_key: (``str``) The lengths key used to trim the features, if `None` only `tgt` is trimmed
+    :return: The trimmed batch
+    """
+    max_src_len = int(batch[sort_key].max()) if sort_key is not None else 0
+    for k in batch.keys():
+        max_len = max_src_len
+        if k == 'tgt' and 'tgt_lengths' in batch:
+            max_len = int(batch['tgt_lengths'].max())
+        if max_len == 0:
+            continue
+        if len(batch[k].shape) == 3:
+            batch[k] = batch[k][:, 0:max_len, :]
+        elif len(batch[k].shape) == 2:
+            batch[k] = batch[k][:, :max_len]
+    return batch
+
+
+@exporter
+class ColumnarExamples(object):
+    """Examples stored column-wise, one array per feature with the examples along the first axis
+
+    Instead of a list of dictionaries, each feature is a single `[N, ...]` array, so a batch is a slice of
+    each column and no per-example Python work is done.  The examples are shuffled and sorted once,
+    using an index array, when the object is constructed.  When trimming, the `tgt` feature (if present)
+    is trimmed using `tgt_lengths` and all other features use the `sort_key`, which makes this a drop-in for
+    both `DictExamples` and `Seq2SeqExamples`
+    """
+    def __init__(self, arrays, do_shuffle=True, sort_key=None):
+        """Constructor
+
+        :param arrays: (``dict``) A dictionary of `[N, ...]` arrays keyed by feature name
+        :param do_shuffle: (``bool``) Shuffle the data? Defaults to `True`
+        :param sort_key: (``str``) An optional key to sort the examples by
+        """
+        self.arrays = arrays
+        self.size = len(next(iter(arrays.values()))) if arrays else 0
+        self.sort_key = sort_key
+        self.indices = None
+        if do_shuffle:
+            self.indices = np.random.permutation(self.size)
+        if sort_key is not None and self.size > 0:
+            indices = np.arange(self.size) if self.indices is None else self.indices
+            self.indices = indices[np.argsort(self.arrays[sort_key][indices], kind='stable')]
+        self._reorder()
+
+    @classmethod
+    def from_examples(cls, example_list, do_shuffle=True, sort_key=None):
+        """Build the columns from a list of example dictionaries
+
+        :param example_list: A list of examples
+        :param do_shuffle: (``bool``) Shuffle the data? Defaults to `True`
+        :param sort_key: (``str``) An optional key to sort the examples by
+        :return: A `ColumnarExamples`
+        """
+        keys = example_list[0].keys() if example_list else []
+        return cls({k: np.stack([ex[k] for ex in example_list]) for k in keys}, do_shuffle=do_shuffle, sort_key=sort_key)
+
+    def _reorder(self):
+        """Apply the shuffle/sort to the columns once so that each batch is a slice"""
+        if self.indices is not None:
+            self.arrays = {k: v[self.indices] for k, v in self.arrays.items()}
+            self.indices = None
+
+    def _index(self, idx):
+        return idx if self.indices is None else self.indices[idx]
+
+    def __getitem__(self, i):
+        """Get a single example
+
+        :param i: (``int``) simple index
+        :return: an example
+        """
+        i = self._index(i)
+        return {k: np.array(v[i]) for k, v in self.arrays.items()}
+
+    def __len__(self):
+        """Number of examples
+
+        :return: (``int``) length of data
+        """
+        return self.size
+
+    def column(self, key):
+        """Get a whole feature in example order
+
+        :param key: (``str``) The feature name
+        :return: An `[N, ...]` array
+        """
+        return self.arrays[key] if self.indices is None else self.arrays[key][self.indices]
+
+    def gather(self, indices, trim=False):
+        """Get a batch made of arbitrary examples
+
+        :param indices: An array of example indices, or a `slice`
+        :param trim: (``bool``) Trim to maximum length in a batch
+        :return batched dictionary
+        """
+        idx = self._index(indices)
+        batch = {k: np.asarray(v[idx]) for k, v in self.arrays.items()}
+        return trim_batch(batch, self.sort_key) if trim else batch
+
+    def batch(self, start, batchsz, trim=False):
+        """Get a batch of data
+
+        :param start: (``int``) The step index
+        :param batchsz: (``int``) The batch size
+        :param trim: (``bool``) Trim to maximum length in a batch
+        :return batched dictionary
+        """
+        return self.gather(slice(start * batchsz, min((start + 1) * batchsz, self.size)), trim=trim)
+
+
+@exporter
+class MMapExamples(ColumnarExamples):
+    """Examples served from a directory of memory-mapped `.npy` arrays, one array per feature
+
+    The directory is written once with `MMapExamples.save` and then opened with `mmap_mode='r'` so only
+    the rows that go into a batch are ever paged in.  Unlike the in-memory `ColumnarExamples`, the shuffle and
+    sort order is kept as an index array rather than applied to the columns, since that would read the whole
+    dataset into memory
+    """
+    META_FILE = 'meta.json'
+
+    def __init__(self, directory, do_shuffle=True, sort_key=None):
+        """Constructor
+
+        :param directory: (``str``) A directory written by `MMapExamples.save`
+        :param do_shuffle: (``bool``) Shuffle the data? Defaults to `True`
+        :param sort_key: (``str``) An optional key to sort the examples by
+        """
+        self.meta = read_json(os.path.join(directory, MMapExamples.META_FILE), strict=True)
+        arrays = {k: np.load(os.path.join(directory, '{}.npy'.format(k)), mmap_mode='r') for k in self.meta['keys']}
+        super(MMapExamples, self).__init__(arrays, do_shuffle=do_shuffle, sort_key=sort_key)
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, MMapExamples.META_FILE))
+
+    @staticmethod
+    def save(directory, arrays, **kwargs):
+        """Write columns of examples as one `.npy` file per key
+
+        The files are written to a temporary directory first and moved into place so that a killed job
+        never leaves a partial cache behind.
+
+        :param directory: (``str``) The output directory
+        :param arrays: (``dict``) A dictionary of `[N, ...]` arrays keyed by feature name
+        :param kwargs: Any extra metadata to store alongside the arrays
+        """
+        tmp_dir = '{}.tmp-{}'.format(directory, os.getpid())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for k, v in arrays.items():
+            np.save(os.path.join(tmp_dir, '{}.npy'.format(k)), v)
+        meta = dict(kwargs)
+        meta['keys'] = list(arrays.keys())
+        meta['size'] = len(next(iter(arrays.values()))) if arrays else 0
+        write_json(meta, os.path.join(tmp_dir, MMapExamples.META_FILE))
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(tmp_dir, directory)
+
+    def _reorder(self):
+        pass
+
+
 # This one is a little different at the moment
 @exporter
 class SeqWordCharDataFeed(DataFeed):
     """Data feed to return language modeling training data
     """
 
-    def __init__(self, examples, nctx, batchsz, tgt_key=None):
+    def __init__(self, examples, nctx, batchsz, tgt_key=None, **kwargs):
         """Constructor
 
         :param examples: word tensor
         :param nctx: Number of steps of BPTT
         :param batchsz: Batch size
         :param tgt_key: Which field to treat as the target key (this will share an embedding vocab with the source)
+        :param kwargs: Prefetching options (see `DataFeed`)
         """
-        super(SeqWordCharDataFeed, self).__init__()
+        super(SeqWordCharDataFeed, self).__init__(**kwargs)
         self.examples = dict()
         # This identifies which vector to use for targets
         self.tgt_key = 'x' if tgt_key is None else tgt_key
@@ -333,3 +638,142 @@ class SeqWordCharDataFeed(DataFeed):
         #    'xch': self.xch[:, i*self.stride_ch:(i+1)*self.stride_ch].reshape((self.batchsz, self.nbptt, self.wsz)),
         #    'y': self.x[:, i*self.nbptt+1:(i+1)*self.nbptt+1].reshape((self.batchsz, self.nbptt))
         #}
+
+
+@exporter
+class StreamingDataFeed(DataFeed):
+    """Data feed that reads and vectorizes examples lazily, for datasets that don't fit in memory
+
+    Raw examples are pulled from a stream, randomized with a bounded shuffle buffer, and only vectorized
+    when their batch is built, so memory is bounded by the shuffle buffer and the batches in flight.
+    With `prefetch` the vectorization happens on the background threads
+    """
+    def __init__(self, stream_fn, vectorize_fn, batchsz, **kwargs):
+        """Constructor
+
+        :param stream_fn: A function that takes a ``bool`` `shuffle` and returns an iterator over raw examples
+            for one epoch.  It is called once per epoch, and once up front to count the examples
+        :param vectorize_fn: A function that turns a list of raw examples into a batch dictionary of `[B, ...]` arrays
+        :param batchsz: Batch size per step
+        :param kwargs: See below
+
+        :Keyword Arguments:
+            * *shuffle* -- Shuffle the data per epoch? Defaults to `False`
+            * *shuffle_buffer* -- The number of raw examples to shuffle across (defaults to `10000`)
+            * *trim* -- Trim batches to the maximum length seen in the batch (defaults to `False`)
+            * *sort_key* -- The lengths key to trim on
+            * *truncate* -- bool, If true the datastream will be cut short when a full batch cannot be made
+            * *num_examples* -- The number of examples in the stream, if not given the stream is counted
+            * *prefetch* -- Build this many batches ahead on background threads (see `DataFeed`)
+        """
+        super(StreamingDataFeed, self).__init__(**kwargs)
+        self.stream_fn = stream_fn
+        self.vectorize_fn = vectorize_fn
+        self.batchsz = batchsz
+        self.shuffle = bool(kwargs.get('shuffle', False))
+        self.shuffle_buffer = int(kwargs.get('shuffle_buffer', 10000))
+        self.trim = bool(kwargs.get('trim', False))
+        self.sort_key = kwargs.get('sort_key')
+        self.truncate = bool(kwargs.get('truncate', False))
+        num_examples = kwargs.get('num_examples')
+        if num_examples is None:
+            num_examples = sum(1 for _ in stream_fn(False))
+        if self.truncate:
+            self.steps = num_examples // batchsz
+        else:
+            self.steps = (num_examples + batchsz - 1) // batchsz
+
+    def _shuffled(self, stream):
+        buf = []
+        for ex in stream:
+            if len(buf) < self.shuffle_buffer:
+                buf.append(ex)
+                continue
+            i = np.random.randint(len(buf))
+            yield buf[i]
+            buf[i] = ex
+        for i in np.random.permutation(len(buf)):
+            yield buf[i]
+
+    def _raw_batches(self, shuffle):
+        stream = self.stream_fn(shuffle)
+        if shuffle:
+            stream = self._shuffled(stream)
+        raw = []
+        steps = 0
+        for ex in stream:
+            raw.append(ex)
+            if len(raw) == self.batchsz:
+                yield raw
+                raw = []
+                steps += 1
+                if steps == self.steps:
+                    return
+        if raw and not self.truncate:
+            yield raw
+
+    def _epoch(self):
+        return self._raw_batches(self.shuffle)
+
+    def _make_batch(self, raw):
+        batch = self.vectorize_fn(raw)
+        return trim_batch(batch, self.sort_key) if self.trim else batch
+
+    def _batch(self, i):
+        """Random access has to read the stream up to step `i`, it is only meant for peeking at a batch"""
+        return self._make_batch(next(islice(self._raw_batches(False), i, None)))
+
+
+@exporter
+class StreamingSeqWordCharDataFeed(DataFeed):
+    """Streaming equivalent of `SeqWordCharDataFeed` that produces the same BPTT batches without loading the corpus
+
+    `SeqWordCharDataFeed` reshapes the corpus to `[batchsz, rest]`, so row `b` of every batch is the contiguous
+    span of the corpus starting at token `b * rest`.  Here each row gets its own cursor into the token stream
+    that reads `nctx` new tokens a step (keeping one token of lookahead for the target), so only
+    `batchsz * (nctx + 1)` tokens are held at a time.  Vectorizers must produce one row per token
+    """
+    def __init__(self, token_fn, vectorize_fn, num_tokens, nctx, batchsz, tgt_key=None, **kwargs):
+        """Constructor
+
+        :param token_fn: A function that takes a token offset and returns an iterator over the tokens from there
+        :param vectorize_fn: A function that takes `batchsz` lists of `nctx + 1` tokens and returns a ``dict`` of
+            `[batchsz, nctx + 1, ...]` arrays, keyed by feature
+        :param num_tokens: The number of tokens in the corpus
+        :param nctx: Number of steps of BPTT
+        :param batchsz: Batch size
+        :param tgt_key: Which field to treat as the target key (this will share an embedding vocab with the source)
+        :param kwargs: Prefetching options (see `DataFeed`)
+        """
+        super(StreamingSeqWordCharDataFeed, self).__init__(**kwargs)
+        self.token_fn = token_fn
+        self.vectorize_fn = vectorize_fn
+        self.tgt_key = 'x' if tgt_key is None else tgt_key
+        self.nctx = nctx
+        self.batchsz = batchsz
+        rest = num_tokens // batchsz
+        if rest % nctx == 0:
+            rest = rest - 1
+        self.rest = rest
+        # Each step needs one token past its context for the target
+        self.steps = (rest - 1) // nctx
+
+    def _epoch(self):
+        cursors = [self.token_fn(b * self.rest) for b in range(self.batchsz)]
+        rows = [list(islice(cursor, self.nctx + 1)) for cursor in cursors]
+        for i in range(self.steps):
+            yield rows
+            rows = [row[-1:] + list(islice(cursor, self.nctx)) for row, cursor in zip(rows, cursors)]
+
+    def _make_batch(self, rows):
+        example = {}
+        for k, x in self.vectorize_fn(rows).items():
+            example[k] = x[:, :self.nctx]
+            if self.tgt_key == k:
+                example['y'] = x[:, 1:self.nctx + 1]
+        return example
+
+    def _batch(self, i):
+        start = i * self.nctx
+        rows = [list(islice(self.token_fn(b * self.rest + start), self.nctx + 1)) for b in range(self.batchsz)]
+        return self._make_batch(rows)
@@ -1,6 +1,6 @@
 import time
 import logging
-from baseline.bleu import bleu
+from baseline.metrics import BleuAccumulator
 from baseline.progress import create_progress_bar
 from baseline.utils import (
     listify,
@@ -97,8 +97,7 @@ class Seq2SeqTrainerDynet(Trainer):
         steps = len(vs)
         self.valid_epochs += 1
 
-        preds = []
-        golds = []
+        bleu = BleuAccumulator()
 
         start = time.time()
         pg = create_progress_bar(steps)
@@ -115,11 +114,13 @@ class Seq2SeqTrainerDynet(Trainer):
             total_toks += toks
 
             pred = [p[0] for p in self.model.predict(batch_dict, beam=1)]
-            preds.extend(convert_seq2seq_preds(pred, self.tgt_rlut))
-            golds.extend(convert_seq2seq_golds(tgt.T, tgt_lens, self.tgt_rlut))
+            bleu.update(
+                convert_seq2seq_preds(pred, self.tgt_rlut),
+                convert_seq2seq_golds(tgt.T, tgt_lens, self.tgt_rlut)
+            )
 
         metrics = self.calc_metrics(total_loss, total_toks)
-        metrics['bleu'] = bleu(preds, golds)[0]
+        metrics.update(bleu.get_all_metrics())
         self.report(
             self.valid_epochs, metrics, start,
             phase, 'EPOCH', reporting_fns
@@ -129,16 +130,17 @@ class Seq2SeqTrainerDynet(Trainer):
     def _evaluate(self, es, reporting_fns):
         self.model.train = False
         pg = create_progress_bar(len(es))
-        preds = []
-        golds = []
+        bleu = BleuAccumulator()
         start = time.time()
         for batch_dict in pg(es):
             tgt = batch_dict['tgt']
             tgt_lens = batch_dict['tgt_lengths']
             pred = [p[0] for p in self.model.predict(batch_dict)]
-            preds.extend(convert_seq2seq_preds(pred, self.tgt_rlut))
-            golds.extend(convert_seq2seq_golds(tgt, tgt_lens, self.tgt_rlut))
-        metrics = {'bleu': bleu(preds, golds)[0]}
+            bleu.update(
+                convert_seq2seq_preds(pred, self.tgt_rlut),
+                convert_seq2seq_golds(tgt, tgt_lens, self.tgt_rlut)
+            )
+        metrics = bleu.get_all_metrics()
         self.report(
             0, metrics, start, 'Test', 'EPOCH', reporting_fns
         )
@@ -6,7 +6,9 @@ import numpy as np
 from baseline.dy.optz import *
 from baseline.progress import create_progress_bar
 from baseline.train import EpochReportingTrainer, create_trainer, register_trainer, register_training_func
-from baseline.utils import listify, get_model_file, revlut, to_spans, f_score, write_sentence_conll, get_metric_cmp, span_f1, per_entity_f1, conlleval_output
+from baseline.utils import listify, get_model_file, revlut, SpanExtractor, f_score, write_sentence_conll, get_metric_cmp
+from baseline.utils import conlleval_output
+from baseline.metrics import SpanF1Accumulator
 
 logger = logging.getLogger('baseline')
 
@@ -23,6 +25,7 @@ class TaggerTrainerDyNet(EpochReportingTrainer):
         self.gpu = not bool(kwargs.get('nogpu', False))
         self.model = model
         self.idx2label = revlut(self.model.labels)
+        self.spans = SpanExtractor(self.idx2label, self.span_type)
         self.autobatchsz = kwargs.get('autobatchsz')
         self.labels = model.labels
         self.optimizer = OptimizerManager(model, **kwargs)
@@ -32,30 +35,25 @@ class TaggerTrainerDyNet(EpochReportingTrainer):
     # Guess is a list over time
     def process_output(self, guess, truth, sentence_lengths, ids, handle=None, txts=None):
 
-        correct_labels = 0
-        total_labels = 0
         truth_n = truth
+        sentence_lengths = np.asarray(sentence_lengths)
+        guess_n = np.zeros_like(truth_n)
+        for b, sentence in enumerate(guess):
+            sentence = sentence[:sentence_lengths[b]]
+            guess_n[b, :len(sentence)] = sentence
+
+        mask = np.arange(truth_n.shape[1]) < sentence_lengths[:, np.newaxis]
+        correct_labels = np.sum((guess_n == truth_n) & mask)
+        total_labels = np.sum(sentence_lengths)
         # For fscore
-        gold_chunks = []
-        pred_chunks = []
-        # For each sentence
-        for b in range(len(guess)):
-
-            sentence_length = sentence_lengths[b]
-            gold = truth_n[b, :sentence_length]
-            sentence = guess[b]
-            sentence = sentence[:sentence_length]
-            correct_labels += np.sum(np.equal(sentence, gold))
-            total_labels += sentence_length
-            gold_chunks.append(set(to_spans(gold, self.idx2label, self.span_type)))
-            pred_chunks.append(set(to_spans(sentence, self.idx2label, self.span_type)))
-            # Should we write a file out?  If so, we have to have txts
-            if handle is not None:
-                id = ids[b]
-                txt = txts[id]
-                write_sentence_conll(handle, sentence, gold, txt, self.idx2label)
-
-        return correct_labels, total_labels, gold_chunks, pred_chunks
+        span_counts = self.spans.count(truth_n, guess_n, sentence_lengths)
+        # Should we write a file out?  If so, we have to have txts
+        if handle is not None:
+            for b, sentence_length in enumerate(sentence_lengths):
+                txt = txts[ids[b]]
+                write_sentence_conll(handle, guess_n[b, :sentence_length], truth_n[b, :sentence_length], txt, self.idx2label)
+
+        return correct_labels, total_labels, span_counts
 
 
     def _test(self, ts, **kwargs):
@@ -64,8 +62,7 @@ class TaggerTrainerDyNet(EpochReportingTrainer):
         total_correct = 0
         total_sum = 0
 
-        gold_spans = []
-        pred_spans = []
+        span_metrics = SpanF1Accumulator(self.idx2label, self.span_type)
 
         metrics = {}
         steps = len(ts)
@@ -81,18 +78,17 @@ class TaggerTrainerDyNet(EpochReportingTrainer):
             ids = batch_dict['ids']
             y = batch_dict['y']
             pred = self.model.predict(batch_dict)
-            correct, count, golds, guesses = self.process_output(pred, y, lengths, ids, handle, txts)
+            correct, count, counts = self.process_output(pred, y, lengths, ids, handle, txts)
             total_correct += correct
             total_sum += count
-            gold_spans.extend(golds)
-            pred_spans.extend(guesses)
+            span_metrics.merge(counts)
 
         total_acc = total_correct / float(total_sum)
         metrics['acc'] = total_acc
         # Only show the fscore if requested
-        metrics['f1'] = span_f1(gold_spans, pred_spans)
+        metrics.update(span_metrics.get_all_metrics())
         if self.verbose:
-            conll_metrics = per_entity_f1(gold_spans, pred_spans)
+            conll_metrics = span_metrics.get_per_entity_metrics()
             conll_metrics['acc'] = total_acc * 100
             conll_metrics['tokens'] = total_sum
             logger.info(conlleval_output(conll_metrics))
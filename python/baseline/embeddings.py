@@ -1,11 +1,14 @@
+import logging
 import numpy as np
+from functools import partial
 from baseline.utils import (
     export, optional_params
 )
-from baseline.w2v import PretrainedEmbeddingsModel, RandomInitVecModel
+from baseline.w2v import PretrainedEmbeddingsModel, RandomInitVecModel, share_embeddings, file_key
 
 __all__ = []
 exporter = export(__all__)
+logger = logging.getLogger('baseline')
 
 
 BASELINE_EMBEDDINGS = {}
@@ -71,18 +74,30 @@ def load_embeddings(name, **kwargs):
         known_vocab = kwargs.pop('known_vocab', None)
         keep_unused = kwargs.pop('keep_unused', False)
         normalize = kwargs.pop('normalized', False)
+        shared = kwargs.pop('shared', False)
         # if there is no filename, use random-init model
         if filename is None:
             dsz = kwargs.pop('dsz')
-            model = RandomInitVecModel(dsz, known_vocab=known_vocab, unif_weight=unif)
+            build_fn = partial(RandomInitVecModel, dsz, known_vocab=known_vocab, unif_weight=unif)
+            key = None
+            if shared:
+                # Sharing would hand every later run the first run's vectors, whatever its seed
+                logger.warning('Not sharing the randomly initialized embeddings %s', name)
         # If there, is use hte pretrain loader
         else:
-            model = PretrainedEmbeddingsModel(filename,
-                                              known_vocab=known_vocab,
-                                              unif_weight=unif,
-                                              keep_unused=keep_unused,
-                                              normalize=normalize,
-                                              **kwargs)
+            build_fn = partial(PretrainedEmbeddingsModel, filename,
+                               known_vocab=known_vocab,
+                               unif_weight=unif,
+                               keep_unused=keep_unused,
+                               normalize=normalize,
+                               **kwargs)
+            key = {'file': file_key(filename), 'keep_unused': keep_unused, 'normalize': normalize}
+        if shared and key is not None:
+            # Processes building the same embeddings map one copy of the weights instead of each holding their own
+            key.update(unif=unif, known_vocab=sorted((k, v > 0) for k, v in (known_vocab or {}).items()))
+            model = share_embeddings(build_fn, kwargs.get('cache_dir', '~/.bl-data/embeddings'), key)
+        else:
+            model = build_fn()
 
         # Then call create(model, name, **kwargs)
         return {'embeddings': embeddings_cls.create(model, name, **kwargs), 'vocab': model.get_vocab()}
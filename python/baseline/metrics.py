@@ -0,0 +1,175 @@
+"""Evaluation metrics that are accumulated a batch at a time
+
+Each accumulator keeps only the sufficient statistics of its metric in a single fixed shape array, `stats`, so the
+memory used doesn't grow with the size of the dataset.  Evaluation can be sharded by giving each worker its own
+accumulator and merging them at the end, either directly or by summing their `stats` arrays (for example with an
+all-reduce).  The final metrics are the same as computing them over the whole dataset at once.
+"""
+import copy
+import numpy as np
+from baseline.utils import export, SpanExtractor, span_f1_from_counts, per_entity_f1_from_counts
+from baseline.bleu import bleu_counts, bleu_counts_from_ids, bleu_from_counts
+
+__all__ = []
+exporter = export(__all__)
+
+
+@exporter
+class MetricAccumulator(object):
+    """Base class for the accumulators, subclasses define `stats`, `update` and `get_all_metrics`"""
+
+    stats = None
+
+    def update(self, *args, **kwargs):
+        """Add the statistics from a batch"""
+        raise NotImplementedError
+
+    def get_all_metrics(self):
+        """Make a map of metrics suitable for reporting, keyed by metric name
+
+        :return: (``dict``) Map of metrics keyed by metric names
+        """
+        raise NotImplementedError
+
+    def merge(self, other):
+        """Add the statistics from another accumulator into this one
+
+        :param other: Either an accumulator of the same type and shape or its `stats` array
+        :return: This accumulator
+        """
+        stats = other.stats if isinstance(other, MetricAccumulator) else np.asarray(other)
+        if stats.shape != self.stats.shape:
+            raise ValueError("Can't merge statistics of shape {} into {}".format(stats.shape, self.stats.shape))
+        np.add(self.stats, stats, out=self.stats)
+        return self
+
+    def reset(self):
+        """Zero the statistics"""
+        self.stats[...] = 0
+
+    def __add__(self, other):
+        return copy.deepcopy(self).merge(other)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+
+@exporter
+def merge_metrics(accumulators):
+    """Merge a sequence of accumulators of the same type into a new one
+
+    :param accumulators: The accumulators, these are not changed
+    :return: An accumulator with the statistics of all of them
+    """
+    accumulators = iter(accumulators)
+    merged = copy.deepcopy(next(accumulators))
+    for acc in accumulators:
+        merged.merge(acc)
+    return merged
+
+
+@exporter
+class SpanF1Accumulator(MetricAccumulator):
+    """Count chunk overlaps per entity type for span F1
+
+    :param idx2label: `dict` A mapping from label ids to label strings
+    :param span_type: `str` The span labeling scheme, `iob`, `iob2`, `bio` or `iobes`
+    """
+
+    def __init__(self, idx2label, span_type='iob'):
+        self.extractor = SpanExtractor(idx2label, span_type)
+        self.stats = np.zeros((3, len(self.extractor.types)), dtype=np.int64)
+
+    @property
+    def types(self):
+        return self.extractor.types
+
+    def update(self, golds, preds, lengths):
+        """Count the chunks in a batch of label ids
+
+        :param golds: `np.ndarray` or `List[np.ndarray]` The gold label ids, [B, T]
+        :param preds: `np.ndarray` or `List[np.ndarray]` The predicted label ids, [B, T]
+        :param lengths: `np.ndarray` The length of each example, [B]
+        :return: `np.ndarray` The counts for this batch, see `SpanExtractor.count`
+        """
+        counts = self.extractor.count(golds, preds, lengths)
+        self.stats += counts
+        return counts
+
+    def get_all_metrics(self):
+        return {'f1': span_f1_from_counts(*self.stats)}
+
+    def get_per_entity_metrics(self):
+        """Get the overall and per entity type metrics, the same as `per_entity_f1`
+
+        :return: (``dict``) The metrics
+        """
+        return per_entity_f1_from_counts(*self.stats, types=self.types)
+
+
+@exporter
+class BleuAccumulator(MetricAccumulator):
+    """Count the n-gram matches, possible matches and corpus lengths for BLEU
+
+    :param n: `int` The max size n-gram to use
+    """
+
+    def __init__(self, n=4):
+        self.n = n
+        # The matches and possible matches for each n-gram size, then the prediction and reference lengths
+        self.stats = np.zeros(2 * n + 2, dtype=np.int64)
+
+    def update(self, preds, golds):
+        """Count the statistics for a batch
+
+        :param preds: `List[List[str]]` The predicted sentences
+        :param golds: `List[List[List[str]]]` The gold sentences, one or more for each prediction
+        """
+        self._add(*bleu_counts(preds, golds, self.n))
+
+    def update_ids(self, preds, golds):
+        """Count the statistics for a batch of token ids, see `baseline.bleu.bleu_counts_from_ids`
+
+        :param preds: `List[np.ndarray]` The token ids of the predicted sentences
+        :param golds: `List[List[np.ndarray]]` The token ids of the gold sentences, one or more for each prediction
+        """
+        self._add(*bleu_counts_from_ids(preds, golds, self.n))
+
+    def _add(self, matches, total, pred_len, gold_len):
+        self.stats[:self.n] += matches
+        self.stats[self.n:2 * self.n] += total
+        self.stats[-2] += pred_len
+        self.stats[-1] += gold_len
+
+    def bleu(self):
+        """Calculate BLEU over everything seen so far
+
+        :return: The same 6-tuple as `baseline.bleu.bleu`
+        """
+        n = self.n
+        return bleu_from_counts(self.stats[:n], self.stats[n:2 * n], int(self.stats[-2]), int(self.stats[-1]))
+
+    def get_all_metrics(self):
+        return {'bleu': self.bleu()[0]}
+
+
+@exporter
+class PerplexityAccumulator(MetricAccumulator):
+    """Sum a token weighted loss to get the average loss and perplexity"""
+
+    def __init__(self):
+        # The total loss and the number of tokens it is over
+        self.stats = np.zeros(2, dtype=np.float64)
+
+    def update(self, loss, toks):
+        """Add a batch
+
+        :param loss: `float` The mean loss over the tokens of the batch
+        :param toks: `int` The number of tokens in the batch
+        """
+        self.stats[0] += loss * toks
+        self.stats[1] += toks
+
+    def get_all_metrics(self):
+        avg_loss = self.stats[0] / float(self.stats[1])
+        return {'avg_loss': avg_loss, 'perplexity': np.exp(avg_loss)}
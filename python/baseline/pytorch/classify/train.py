@@ -15,9 +15,7 @@ logger = logging.getLogger('baseline')
 
 def _add_to_cm(cm, y, pred):
     _, best = pred.max(1)
-    yt = y.cpu().int()
-    yp = best.cpu().int()
-    cm.add_batch(yt.data.numpy(), yp.data.numpy())
+    cm.add_batch(y, best)
 
 
 @register_trainer(task='classify', name='default')
@@ -60,7 +58,7 @@ class ClassifyTrainerPyTorch(EpochReportingTrainer):
         total_norm = 0
         steps = len(loader)
         pg = create_progress_bar(steps)
-        cm = ConfusionMatrix(self.labels)
+        cm = ConfusionMatrix(self.labels, on_device=True)
         verbose = kwargs.get("verbose", None)
         output = kwargs.get('output')
         txts = kwargs.get('txts')
@@ -96,7 +94,7 @@ class ClassifyTrainerPyTorch(EpochReportingTrainer):
         reporting_fns = kwargs.get('reporting_fns', [])
         steps = len(loader)
         pg = create_progress_bar(steps)
-        cm = ConfusionMatrix(self.labels)
+        cm = ConfusionMatrix(self.labels, on_device=True)
         epoch_loss = 0
         epoch_div = 0
         for batch_dict in pg(loader):
@@ -1,7 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from baseline.pytorch.torchy import vec_log_sum_exp, sequence_mask
+from baseline.pytorch.torchy import sequence_mask
 from baseline.utils import transition_mask as transition_mask_np, Offsets
 
 
@@ -108,35 +108,11 @@ class CRF(nn.Module):
 
         :return: torch.FloatTensor: [B]
         """
-        min_length = torch.min(lengths)
-        # alphas: [B, 1, N]
-        alphas = torch.Tensor(batch_size, 1, self.n_tags).fill_(-1e4).to(unary.device)
-        alphas[:, 0, self.start_idx] = 0.
-        alphas.requires_grad = True
-
-        trans = self.transitions  # [1, N, N]
-
-        for i, unary_t in enumerate(unary):
-            # unary_t: [B, N]
-            unary_t = unary_t.unsqueeze(2)  # [B, N, 1]
-            # Broadcast alphas along the rows of trans
-            # Broadcast trans along the batch of alphas
-            # [B, 1, N] + [1, N, N] -> [B, N, N]
-            # Broadcast unary_t along the cols of result
-            # [B, N, N] + [B, N, 1] -> [B, N, N]
-            scores = alphas + trans + unary_t
-            new_alphas = vec_log_sum_exp(scores, 2).transpose(1, 2)
-            # If we haven't reached your length zero out old alpha and take new one.
-            # If we are past your length, zero out new_alpha and keep old one.
-            if i >= min_length:
-                mask = (i < lengths).view(-1, 1, 1)
-                alphas = alphas.masked_fill(mask, 0) + new_alphas.masked_fill(mask == 0, 0)
-            else:
-                alphas = new_alphas
-
-        terminal_vars = alphas + trans[:, self.end_idx]
-        alphas = vec_log_sum_exp(terminal_vars, 2)
-        return alphas.view(batch_size)
+        trans = self.transitions.squeeze(0)  # [N, N]
+        perm, inv, batch_sizes = pack_order(lengths)
+        unary = unary.index_select(1, perm.to(unary.device))
+        alphas = script_crf_forward(unary, trans, batch_sizes, self.start_idx, self.end_idx)
+        return alphas.index_select(0, inv.to(alphas.device))
 
     def decode(self, unary, lengths):
         """Do Viterbi decode on a batch.
@@ -168,48 +144,99 @@ def viterbi(unary, trans, lengths, start_idx, end_idx, norm=lambda x, y: x):
     :return: torch.FloatTensor: [B] the path scores
     """
     seq_len, batch_size, tag_size = unary.size()
-    min_length = torch.min(lengths)
-    backpointers = []
 
     # Alphas: [B, 1, N]
-    alphas = torch.Tensor(batch_size, 1, tag_size).fill_(-1e4).to(unary.device)
+    alphas = torch.full((batch_size, 1, tag_size), -1e4, dtype=unary.dtype, device=unary.device)
     alphas[:, 0, start_idx] = 0
-    alphas = norm(alphas, -1)
-
-    for i, unary_t in enumerate(unary):
-        next_tag_var = alphas + trans
-        viterbi, best_tag_ids = torch.max(next_tag_var, 2)
-        backpointers.append(best_tag_ids.data)
-        new_alphas = viterbi + unary_t
-        new_alphas.unsqueeze_(1)
-        if i >= min_length:
-            mask = (i < lengths).view(-1, 1, 1)
-            alphas = alphas.masked_fill(mask, 0) + new_alphas.masked_fill(mask == 0, 0)
-        else:
-            alphas = new_alphas
+    alphas = norm(alphas, -1).view(batch_size, tag_size)
+
+    perm, inv, batch_sizes = pack_order(lengths)
+    perm = perm.to(unary.device)
+    inv = inv.to(unary.device)
+    best_path, path_score = script_crf_viterbi(
+        unary.index_select(1, perm), trans.view(tag_size, tag_size), alphas.index_select(0, perm), batch_sizes, end_idx
+    )
+    return best_path.index_select(1, inv), path_score.index_select(0, inv)
+
+
+def pack_order(lengths):
+    """Sort a batch longest first so the sequences still going at each step are the first rows.
+
+    This is the layout of a `PackedSequence`, the recurrences only run on the first `batch_sizes[t]` rows at step `t`
+    so no work is done on padding.
+
+    :param lengths: torch.LongTensor: [B]
+
+    :return: torch.LongTensor: [B] the order that sorts the batch
+    :return: torch.LongTensor: [B] the order that puts the sorted batch back
+    :return: List[int]: the number of sequences that are still going at each step
+    """
+    lengths = lengths.cpu()
+    sorted_lengths, perm = torch.sort(lengths, descending=True)
+    inv = torch.empty_like(perm)
+    inv[perm] = torch.arange(len(perm))
+    max_length = int(sorted_lengths[0]) if len(lengths) > 0 else 0
+    batch_sizes = (sorted_lengths.unsqueeze(0) > torch.arange(max_length).unsqueeze(1)).sum(1)
+    return perm, inv, batch_sizes.tolist()
+
+
+@torch.jit.script
+def script_crf_forward(unary, trans, batch_sizes, start_idx, end_idx):
+    # type: (Tensor, Tensor, List[int], int, int) -> Tensor
+    """The CRF forward algorithm on a batch sorted longest first, see `pack_order`.
+
+    :param unary: torch.FloatTensor: [T, B, N]
+    :param trans: torch.FloatTensor: [N, N]
+    :param batch_sizes: List[int]: The number of sequences still going at each step
+    :param start_idx: int: The index of the go token
+    :param end_idx: int: The index of the eos token
+
+    :return: torch.FloatTensor: [B]
+    """
+    alphas = torch.full((unary.size(1), unary.size(2)), -1e4, dtype=unary.dtype, device=unary.device)
+    alphas[:, start_idx] = 0.
+    trans_ = trans.unsqueeze(0)
+    for t in range(len(batch_sizes)):
+        bt = batch_sizes[t]
+        # [bt, 1, N] + [1, N, N] + [bt, N, 1] -> [bt, N, N], summed over the previous tag
+        scores = alphas[:bt].unsqueeze(1) + trans_ + unary[t, :bt].unsqueeze(2)
+        # The sequences that have finished keep their old alphas
+        alphas = torch.cat([torch.logsumexp(scores, 2), alphas[bt:]], 0)
+    return torch.logsumexp(alphas + trans[end_idx].unsqueeze(0), 1)
+
+
+@torch.jit.script
+def script_crf_viterbi(unary, trans, alphas, batch_sizes, end_idx):
+    # type: (Tensor, Tensor, Tensor, List[int], int) -> Tuple[Tensor, Tensor]
+    """Viterbi decode on a batch sorted longest first, see `pack_order`.
+
+    :param unary: torch.FloatTensor: [T, B, N]
+    :param trans: torch.FloatTensor: [N, N]
+    :param alphas: torch.FloatTensor: [B, N] The initial scores
+    :param batch_sizes: List[int]: The number of sequences still going at each step
+    :param end_idx: int: The index of the eos token
+
+    :return: torch.LongTensor: [T, B] the padded paths
+    :return: torch.FloatTensor: [B] the path scores
+    """
+    seq_len, batch_size, tag_size = unary.size()
+    steps = len(batch_sizes)
+    backpointers = torch.zeros((steps, batch_size, tag_size), dtype=torch.long, device=unary.device)
+    trans_ = trans.unsqueeze(0)
+    for t in range(steps):
+        bt = batch_sizes[t]
+        viterbi, best_tag_ids = torch.max(alphas[:bt].unsqueeze(1) + trans_, 2)
+        backpointers[t, :bt] = best_tag_ids
+        alphas = torch.cat([viterbi + unary[t, :bt], alphas[bt:]], 0)
 
     # Add end tag
-    terminal_var = alphas.squeeze(1) + trans[:, end_idx, :]
-    path_score, best_tag_id = torch.max(terminal_var, 1)
-
-    # Flip lengths
-    rev_len = seq_len - lengths - 1
-
-    best_path = [best_tag_id]
-    for i, backpointer_t in enumerate(reversed(backpointers)):
-        # Get new best tag candidate
-        new_best_tag_id = backpointer_t.gather(1, best_tag_id.unsqueeze(1)).squeeze(1)
-        # We are going backwards now, if you haven't passed your flipped length
-        # then you aren't in your real results yet so we propagate best tag
-        # from the argmax on the terminal_var
-        mask = (i > rev_len)
-        best_tag_id = best_tag_id.masked_fill(mask, 0) + new_best_tag_id.masked_fill(mask == 0, 0)
-        best_path.append(best_tag_id)
-    _ = best_path.pop()
-    best_path.reverse()
-    best_path = torch.stack(best_path)
-    # Mask out the extra tags (This might be pointless given that anything that
-    # will use this as a dense tensor downstream will mask it itself?)
-    seq_mask = sequence_mask(lengths).to(best_path.device).transpose(0, 1)
-    best_path = best_path.masked_fill(seq_mask == 0, 0)
+    path_score, best_tag_id = torch.max(alphas + trans[end_idx].unsqueeze(0), 1)
+
+    # A sequence joins the backtrace at its last step, starting from its best final tag
+    best_path = torch.zeros((seq_len, batch_size), dtype=torch.long, device=unary.device)
+    for t in range(steps - 1, -1, -1):
+        bt = batch_sizes[t]
+        best_path[t, :bt] = best_tag_id[:bt]
+        previous = backpointers[t, :bt].gather(1, best_tag_id[:bt].unsqueeze(1)).squeeze(1)
+        best_tag_id = torch.cat([previous, best_tag_id[bt:]], 0)
     return best_path, path_score
@@ -27,7 +27,13 @@ class PyTorchEmbeddings(nn.Module):
     def get_dsz(self):
         pass
 
-    def encode(self, x):
+    def encode(self, x, start=0):
+        """Embed `x`
+
+        :param x: The input
+        :param start: (``int``) The position of the first step of `x`, only embeddings with positions use it
+        :return: The embedded input
+        """
         return self(x)
 
     @classmethod
@@ -145,14 +151,18 @@ class PositionalCharConvEmbeddings(CharConvEmbeddings):
     def get_vsz(self):
         return self.vsz
 
-    def forward(self, xch):
+    def encode(self, xch, start=0):
+        return self(xch, start)
+
+    def forward(self, xch, start=0):
         """Add a positional encoding to the embedding, followed by dropout
 
         :param xch: The temporal signal in, to which the positional embeddings are applied
+        :param start: The position of the first step, when decoding continues from earlier steps
         :return: Embedded output
         """
         xch = super(PositionalCharConvEmbeddings, self).forward(xch) * math.sqrt(self.get_dsz())
-        xch = xch + self.pe[:, :xch.size(1)]
+        xch = xch + self.pe[:, start:start + xch.size(1)]
         return self.dropout(xch)
 
 
@@ -182,14 +192,18 @@ class PositionalLookupTableEmbeddings(LookupTableEmbeddings):
     def get_vsz(self):
         return self.vsz
 
-    def forward(self, x):
+    def encode(self, x, start=0):
+        return self(x, start)
+
+    def forward(self, x, start=0):
         """Add a positional encoding to the embedding, followed by dropout
 
         :param x: The temporal signal in, to which the positional embeddings are applied
+        :param start: The position of the first step, when decoding continues from earlier steps
         :return: Embedded output
         """
         x = super(PositionalLookupTableEmbeddings, self).forward(x) * math.sqrt(self.dsz)
-        x = x + self.pe[:, :x.size(1)]
+        x = x + self.pe[:, start:start + x.size(1)]
         return self.dropout(x)
 
 
@@ -201,10 +215,13 @@ class LearnedPositionalLookupTableEmbeddings(LookupTableEmbeddings):
         self.pos_embeddings = nn.Embedding(self.mxlen, self.dsz, padding_idx=0)
         self.dropout = nn.Dropout(kwargs.get('dropout', 0.1))
 
-    def forward(self, x):
+    def encode(self, x, start=0):
+        return self(x, start)
+
+    def forward(self, x, start=0):
         T = x.size(1)
         x = super(LearnedPositionalLookupTableEmbeddings, self).forward(x)
-        pos = self.pos_embeddings(torch.arange(T, dtype=torch.long, device=x.device)).unsqueeze(0)
+        pos = self.pos_embeddings(torch.arange(start, start + T, dtype=torch.long, device=x.device)).unsqueeze(0)
         return self.dropout(x + pos)
 
     def extra_repr(self):
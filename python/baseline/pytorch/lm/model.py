@@ -44,11 +44,11 @@ class LanguageModelBase(nn.Module, LanguageModel):
             example_dict['y'] = y
         return example_dict
 
-    def embed(self, input):
+    def embed(self, input, start=0):
         all_embeddings = []
         for k in self.src_keys:
             embedding = self.embeddings[k]
-            all_embeddings.append(embedding.encode(input[k]))
+            all_embeddings.append(embedding.encode(input[k], start) if start else embedding.encode(input[k]))
         embedded = torch.cat(all_embeddings, -1)
         embedded_dropout = self.embed_dropout(embedded)
         if self.embeddings_proj:
@@ -103,6 +103,45 @@ class LanguageModelBase(nn.Module, LanguageModel):
         decoded, hidden = self.decode(emb, hidden)
         return self.output(decoded), hidden
 
+    def predict(self, batch_dict, **kwargs):
+        """The distribution over the next token at every step of the input
+
+        :param batch_dict: The input, one `[B, T]` tensor per source key
+        :return: (``np.ndarray``) The `[B, T, V]` probabilities
+        """
+        self.eval()
+        with torch.no_grad():
+            example = self.make_input(batch_dict)
+            batchsz = example[next(iter(self.src_keys))].size(0)
+            output, _ = self(example, self.init_hidden(batchsz))
+            return F.softmax(output, -1).cpu().numpy()
+
+    def init_decode_state(self, batchsz):
+        """The state to carry from one call of `predict_next` to the next
+
+        :param batchsz: The number of sequences that will be decoded together
+        :return: (``dict``) The hidden state of the decoder and how many steps it has seen
+        """
+        return {'hidden': self.init_hidden(batchsz), 'length': 0}
+
+    def predict_next(self, batch_dict, state):
+        """The distribution over the next token, given only the steps that are new since the last call
+
+        The earlier steps are summarized in `state` (the RNN hidden state, or the attention keys and values of a
+        transformer), so each step costs the same however long the sequence gets.  `state` is updated in place.
+
+        :param batch_dict: The new steps, one `[B, T]` tensor per source key
+        :param state: (``dict``) The state from `init_decode_state`
+        :return: (``np.ndarray``) The `[B, V]` probabilities of the token after the last new step
+        """
+        self.eval()
+        with torch.no_grad():
+            example = self.make_input(batch_dict)
+            emb = self.embed(example, state['length'])
+            decoded, state['hidden'] = self.decode(emb, state['hidden'])
+            state['length'] += emb.size(1)
+            return F.softmax(self.output(decoded[:, -1]), -1).cpu().numpy()
+
     def init_output(self, vsz, **kwargs):
         unif = float(kwargs.get('unif', 0.0))
         do_weight_tying = bool(kwargs.get('tie_weights', False))
@@ -169,21 +208,27 @@ class TransformerLanguageModel(LanguageModelBase):
         self.transformer = TransformerEncoderStack(num_heads, d_model=d_model, pdrop=pdrop, scale=True, layers=layers, d_ff=d_ff)
         self.apply(self.init_layer_weights)
 
-    def create_mask(self, bth):
+    def create_mask(self, bth, past=0):
         T = bth.shape[1]
-        mask = subsequent_mask(T).type_as(bth)
+        mask = subsequent_mask(past + T)[:, :, past:].type_as(bth)
         return mask
 
+    def init_decode_state(self, batchsz):
+        # The keys and values of each layer, filled in by the attention as it goes
+        return {'hidden': [dict() for _ in self.transformer.layers], 'length': 0}
+
     def decode(self, bth, hidden):
         bth = self.proj_to_dsz(bth)
-        mask = self.create_mask(bth)
-        return self.transformer(bth, mask), None
+        if hidden is None:
+            return self.transformer(bth, self.create_mask(bth)), None
+        past = hidden[0]['key'].size(2) if 'key' in hidden[0] else 0
+        return self.transformer(bth, self.create_mask(bth, past), hidden), hidden
 
 
 @register_model(task='lm', name='transformer-mlm')
 class TransformerMaskedLanguageModel(TransformerLanguageModel):
 
-    def create_mask(self, bth):
+    def create_mask(self, bth, past=0):
         T = bth.shape[1]
-        mask = torch.ones((1, 1, T, T)).type_as(bth)
+        mask = torch.ones((1, 1, T, past + T)).type_as(bth)
         return mask
@@ -36,16 +36,21 @@ class RemoteModelRESTPytorch(RemoteModelREST):
     def predict(self, examples, **kwargs):
         """The pytorch server can only handle batch size of 1 because the JIT'd
         `pack_padded_sequence jits that batch size. So we send a request per
-        example.
+        example, up to `concurrency` of them at a time.
         """
-        results = []
         example_input = examples[self.input_keys[0]]
         batch_size = len(example_input)
-        for i in range(batch_size):
+
+        def predict_example(i):
             example = {k: np.array([v[i]]) for k, v in examples.items()}
-            example_output = super(RemoteModelRESTPytorch, self).predict(example, **kwargs)
-            results.append(example_output[0])
-        return results
+            return super(RemoteModelRESTPytorch, self).predict(example, **kwargs)[0]
+
+        return self.fan_out(predict_example, range(batch_size))
+
+    def apredict(self, examples, timeout=None, **kwargs):
+        """A coroutine that sends a request per example, the connection pool bounds how many are in flight"""
+        from baseline.aio import apredict_rest_per_example
+        return apredict_rest_per_example(self, examples, timeout=timeout)
 
     def create_request(self, examples):
         request = {}
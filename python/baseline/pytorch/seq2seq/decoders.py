@@ -214,10 +214,18 @@ layer's hidden size == embedding weight dimensions")
         dec_out = dec_out[beams, :]
         return h_i, dec_out, context, src_mask
 
+    def beam_compact(self, rows, extra):
+        """Keep only the rows of the batch elements that are still being searched."""
+        h_i, dec_out, context, src_mask = extra
+        h_i = tuple(hc[:, rows, :] for hc in h_i) if isinstance(h_i, tuple) else h_i[:, rows, :]
+        return h_i, dec_out[rows], context[rows], src_mask[rows]
+
     def beam_search(self, encoder_outputs, **kwargs):
         alpha = kwargs.get('alpha')
         if alpha is not None: kwargs['length_penalty'] = partial(gnmt_length_penalty, alpha=alpha)
-        return beam_search(encoder_outputs, self.beam_init, self.beam_step, self.beam_update, **kwargs)
+        return beam_search(
+            encoder_outputs, self.beam_init, self.beam_step, self.beam_update, compact=self.beam_compact, **kwargs
+        )
 
 
 @register_decoder(name='default')
@@ -289,24 +297,51 @@ class TransformerDecoderWrapper(torch.nn.Module):
         return pred
 
     def beam_init(self, encoder_outputs, K):
-        """Tile for the batch of the encoder inputs."""
+        """Tile for the batch of the encoder inputs and start an empty key/value cache."""
         encoder_outputs = TransformerEncoderOutput(
             repeat_batch(encoder_outputs.output, K),
             repeat_batch(encoder_outputs.src_mask, K)
         )
-        return encoder_outputs
+        return encoder_outputs, self.transformer_decoder.init_cache()
 
     def beam_step(self, paths, extra):
-        """Calculate the probs for the last item based on the full path."""
+        """Calculate the probs for the last item, the earlier ones are in the cache."""
+        encoder_outputs, cache = extra
         B, K, T = paths.size()
-        return self(extra, paths.view(B * K, T))[:, -1], extra
+        last = paths[:, :, -1].view(B * K, 1)
+        embed_out_bth = self.proj_to_hsz(self.tgt_embeddings.encode(last, T - 1) if T > 1 else self.tgt_embeddings(last))
+        src_mask = encoder_outputs.src_mask.unsqueeze(1).unsqueeze(1)
+        output = self.transformer_decoder(embed_out_bth, encoder_outputs.output, src_mask, None, cache)
+        return self.output(self.proj_to_dsz(output))[:, -1], extra
 
     def beam_update(self, beams, extra):
-        """There is no state for the transformer so just pass it."""
-        return extra
+        """Select the cached keys and values of the best performing beams.
+
+        The encoder keys and values are the same for each beam of an example so they stay as they are.
+        """
+        encoder_outputs, cache = extra
+        for layer_cache in cache:
+            self_cache = layer_cache['self']
+            self_cache['key'] = self_cache['key'][beams]
+            self_cache['value'] = self_cache['value'][beams]
+        return encoder_outputs, cache
+
+    def beam_compact(self, rows, extra):
+        """Keep only the rows of the batch elements that are still being searched."""
+        encoder_outputs, cache = extra
+        encoder_outputs = TransformerEncoderOutput(encoder_outputs.output[rows], encoder_outputs.src_mask[rows])
+        for layer_cache in cache:
+            for attn_cache in layer_cache.values():
+                for k in attn_cache:
+                    attn_cache[k] = attn_cache[k][rows]
+        return encoder_outputs, cache
 
     def beam_search(self, encoder_outputs, **kwargs):
-        return beam_search(encoder_outputs, self.beam_init, self.beam_step, self.beam_update, **kwargs)
+        alpha = kwargs.get('alpha')
+        if alpha is not None: kwargs['length_penalty'] = partial(gnmt_length_penalty, alpha=alpha)
+        return beam_search(
+            encoder_outputs, self.beam_init, self.beam_step, self.beam_update, compact=self.beam_compact, **kwargs
+        )
 
 
 def update_lengths(lengths, eoses, idx):
@@ -398,6 +433,7 @@ def beam_search(
         encoder_outputs,
         init, step, update,
         length_penalty=no_length_penalty,
+        compact=None,
         **kwargs
 ):
     """Perform batched Beam Search.
@@ -420,6 +456,11 @@ def beam_search(
         A callable that generates a penalty based on the lengths. Lengths is
         [B, K] and the returned penalty should be [B, K, 1] (or [B, K, V] to
         have token based penalties?)
+    :param compact: `Callable(rows: torch.LongTensor, extra) -> extra:
+        A callable that keeps only the given rows of the decoding state. It is
+        called when every beam of some batch elements has finished so the rest
+        of the search only runs on the unfinished ones. Without it every batch
+        element is stepped until they have all finished.
 
     :Keyword Arguments:
     * *beam* -- `int`: The number of beams to use.
@@ -437,37 +478,49 @@ def beam_search(
     device = encoder_outputs.output.device
     with torch.no_grad():
         extra = init(encoder_outputs, K)
-        paths = torch.full((bsz, K, 1), Offsets.GO, dtype=torch.long, device=device)
+        # The results of every batch element, they are copied in as each one finishes. Past the end of a
+        # path is filled with EOS, which is what a finished beam keeps selecting.
+        all_paths = torch.full((bsz, K, mxlen + 1), Offsets.EOS, dtype=torch.long, device=device)
+        all_paths[:, :, 0] = Offsets.GO
+        all_lengths = torch.zeros((bsz, K), dtype=torch.long, device=device)
+        all_scores = torch.zeros((bsz, K), dtype=torch.float, device=device)
+        # The batch elements that are still being searched and their paths
+        active = torch.arange(bsz, dtype=torch.long, device=device)
+        paths = all_paths.clone()
         # This tracks the log prob of each beam. This is distinct from score which
         # is based on the log prob and penalties.
         log_probs = torch.zeros((bsz, K), dtype=torch.float, device=device)
         # Tracks the lengths of the beams, unfinished beams have a lengths of zero.
         lengths = torch.zeros((bsz, K), dtype=torch.long, device=device)
-        last = paths[:, :, -1]  # [B, K]
+        # Best Beam index is relative within the batch (only [0, K)), adding
+        # these makes the index global (e.g. best beams for the second batch
+        # example is in [K, 2*K)).
+        offsets = torch.arange(bsz, dtype=torch.long, device=device).unsqueeze(-1) * K
+        beam_range = torch.arange(K, dtype=torch.long, device=device)
+        eos_mask = None
+        steps = mxlen + 1
 
         for i in range(mxlen - 1):
-            probs, extra = step(paths, extra)
+            B = active.size(0)
+            probs, extra = step(paths[:, :, :i + 1], extra)
             V = probs.size(-1)
-            probs = probs.view((bsz, K, V))  # [B, K, V]
+            probs = probs.view((B, K, V))  # [B, K, V]
             if i > 0:
                 # This mask is for all beams that are done.
                 done_mask = (lengths != 0).unsqueeze(-1)  # [B, K, 1]
-                # Can creating this mask be moved out of the loop? It never changes but we don't have V
-                # This mask selects the EOS token
-                eos_mask = torch.zeros((1, 1, V), dtype=MASK_TYPE, device=device)
-                eos_mask[:, :, Offsets.EOS] = 1
-                # This mask selects the EOS token of only the beams that are done.
-                mask = done_mask & eos_mask
                 # Put all probability mass on the EOS token for finished beams.
                 # Otherwise as the other beams get longer they will all give
                 # up and eventually select this beam and all outputs become
                 # the same.
                 probs = probs.masked_fill(done_mask, -np.inf)
-                probs = probs.masked_fill(mask, 0)
+                probs = probs.masked_fill(done_mask & eos_mask, 0)
                 probs = log_probs.unsqueeze(-1) + probs  # [B, K, V]
                 # Calculate the score of the beam based on the current length.
-                path_scores = probs / length_penalty(lengths.masked_fill(lengths==0, i+1))
+                path_scores = probs / length_penalty(lengths.masked_fill(lengths == 0, i + 1))
             else:
+                # This mask selects the EOS token, it never changes once we know V
+                eos_mask = torch.zeros((1, 1, V), dtype=MASK_TYPE, device=device)
+                eos_mask[:, :, Offsets.EOS] = 1
                 # On the first step we only look at probabilities for the first beam.
                 # If we don't then the probs will be the same for each beam
                 # This means the same token will be selected for each beam
@@ -475,53 +528,59 @@ def beam_search(
                 # Using only the first beam ensures K different starting points.
                 path_scores = probs[:, 0, :]
 
-            flat_scores = path_scores.view(bsz, -1)  # [B, K * V]
+            flat_scores = path_scores.view(B, -1)  # [B, K * V]
             best_scores, best_idx = flat_scores.topk(K, 1)
             # Get the log_probs of the best scoring beams
-            log_probs = probs.view(bsz, -1).gather(1, best_idx).view(bsz, K)
+            log_probs = probs.view(B, -1).gather(1, best_idx).view(B, K)
 
-            best_beams = best_idx / V  # Get which beam it came from
+            best_beams = best_idx // V  # Get which beam it came from
             best_idx = best_idx % V  # Get the index of the word regardless of which beam it is.
 
-            # Best Beam index is relative within the batch (only [0, K)).
-            # This makes the index global (e.g. best beams for the second
-            # batch example is in [K, 2*K)).
-            offsets = torch.arange(bsz, dtype=torch.long, device=device) * K
-            offset_beams = best_beams + offsets.unsqueeze(-1)
-            flat_beams = offset_beams.view(bsz * K)
-            # Select the paths to extend based on the best beams
-            flat_paths = paths.view(bsz * K, -1)
-            new_paths = flat_paths[flat_beams, :].view(bsz, K, -1)
-            # Add the selected outputs to the paths
-            paths = torch.cat([new_paths, best_idx.unsqueeze(-1)], dim=2)
+            flat_beams = (best_beams + offsets).view(B * K)
+            # Select the paths to extend based on the best beams and add the selected outputs, in place
+            paths[:, :, :i + 1] = paths.view(B * K, -1)[flat_beams, :i + 1].view(B, K, -1)
+            paths[:, :, i + 1] = best_idx
 
             # Select the lengths to keep tracking based on the valid beams left.
-            lengths = lengths.view(-1)[flat_beams].view((bsz, K))
+            lengths = lengths.view(-1)[flat_beams].view((B, K))
 
             extra = update(flat_beams, extra)
 
             # Updated lengths based on if we hit EOS
-            last = paths[:, :, -1]
-            eoses = (last == Offsets.EOS)
-            lengths = update_lengths(lengths, eoses, i + 1)
-            if (lengths != 0).all():
+            lengths = update_lengths(lengths, best_idx == Offsets.EOS, i + 1)
+            finished = (lengths != 0).all(1)
+            if finished.all():
+                steps = i + 2
                 break
+            if compact is not None and finished.any():
+                # Save the batch elements where every beam is done and stop searching them
+                done = finished.nonzero().view(-1)
+                all_paths[active[done]] = paths[done]
+                all_lengths[active[done]] = lengths[done]
+                all_scores[active[done]] = best_scores[done]
+                keep = (~finished).nonzero().view(-1)
+                extra = compact((keep.unsqueeze(-1) * K + beam_range).view(-1), extra)
+                active, paths, lengths, log_probs = active[keep], paths[keep], lengths[keep], log_probs[keep]
+                offsets = offsets[:keep.size(0)]
         else:
             # This runs if the loop didn't break meaning one beam hit the max len
             # Add an EOS to anything that hasn't hit the end. This makes the scores real.
-            probs, extra = step(paths, extra)
+            # The EOS is already at the end of the paths.
+            B = active.size(0)
+            probs, extra = step(paths[:, :, :mxlen], extra)
 
             V = probs.size(-1)
-            probs = probs.view((bsz, K, V))
+            probs = probs.view((B, K, V))
             probs = probs[:, :, Offsets.EOS]  # Select the score of EOS
             # If any of the beams are done mask out the score of this EOS (they already had an EOS)
             probs = probs.masked_fill((lengths != 0), 0)
             log_probs = log_probs + probs
-            end_tokens = torch.full((bsz, K, 1), Offsets.EOS, device=device, dtype=paths.dtype)
-            paths = torch.cat([paths, end_tokens], dim=2)
             lengths = update_lengths(lengths, torch.ones_like(lengths) == 1, mxlen)
             best_scores = log_probs / length_penalty(lengths).squeeze(-1)
 
+        all_paths[active] = paths
+        all_lengths[active] = lengths
+        all_scores[active] = best_scores
+
     # Slice off the Offsets.GO token
-    paths = paths[:, :, 1:]
-    return paths, lengths, best_scores
+    return all_paths[:, :, 1:steps], all_lengths, all_scores
@@ -6,8 +6,8 @@ from baseline.progress import create_progress_bar
 from baseline.utils import listify, get_model_file, get_metric_cmp
 from baseline.train import Trainer, create_trainer, register_trainer, register_training_func
 from baseline.pytorch.optz import OptimizerManager
-from baseline.bleu import bleu
-from baseline.utils import convert_seq2seq_golds, convert_seq2seq_preds
+from baseline.metrics import BleuAccumulator
+from baseline.utils import trim_seq2seq_ids
 
 logger = logging.getLogger('baseline')
 
@@ -47,8 +47,7 @@ class Seq2SeqTrainerPyTorch(Trainer):
         total_loss = total_toks = 0
         steps = len(vs)
         self.valid_epochs += 1
-        preds = []
-        golds = []
+        bleu = BleuAccumulator()
 
         start = time.time()
         pg = create_progress_bar(steps)
@@ -62,11 +61,13 @@ class Seq2SeqTrainerPyTorch(Trainer):
             total_loss += loss.item() * toks
             total_toks += toks
             greedy_preds = [p[0] for p in self._predict(input_, beam=1, make_input=False)]
-            preds.extend(convert_seq2seq_preds(greedy_preds, self.tgt_rlut))
-            golds.extend(convert_seq2seq_golds(tgt.cpu().numpy(), tgt_lens, self.tgt_rlut))
+            bleu.update_ids(
+                trim_seq2seq_ids(greedy_preds),
+                [[gold] for gold in trim_seq2seq_ids(tgt.cpu().numpy(), tgt_lens)]
+            )
 
         metrics = self.calc_metrics(total_loss, total_toks)
-        metrics['bleu'] = bleu(preds, golds)[0]
+        metrics.update(bleu.get_all_metrics())
         self.report(
             self.valid_epochs, metrics, start,
             phase, 'EPOCH', reporting_fns
@@ -77,16 +78,14 @@ class Seq2SeqTrainerPyTorch(Trainer):
     def _evaluate(self, es, reporting_fns, **kwargs):
         self.model.eval()
         pg = create_progress_bar(len(es))
-        preds = []
-        golds = []
+        bleu = BleuAccumulator()
         start = time.time()
         for batch_dict in pg(es):
             tgt = batch_dict['tgt']
             tgt_lens = batch_dict['tgt_lengths']
             pred = [p[0] for p in self._predict(batch_dict, **kwargs)]
-            preds.extend(convert_seq2seq_preds(pred, self.tgt_rlut))
-            golds.extend(convert_seq2seq_golds(tgt, tgt_lens, self.tgt_rlut))
-        metrics = {'bleu': bleu(preds, golds)[0]}
+            bleu.update_ids(trim_seq2seq_ids(pred), [[gold] for gold in trim_seq2seq_ids(tgt, tgt_lens)])
+        metrics = bleu.get_all_metrics()
         self.report(
             0, metrics, start, 'Test', 'EPOCH', reporting_fns
         )
@@ -2,10 +2,11 @@ import six
 import logging
 from baseline.progress import create_progress_bar
 from baseline.train import EpochReportingTrainer, create_trainer, register_trainer, register_training_func
-from baseline.utils import listify, to_spans, f_score, revlut, get_model_file, write_sentence_conll, get_metric_cmp
+from baseline.utils import listify, SpanExtractor, f_score, revlut, get_model_file, write_sentence_conll, get_metric_cmp
 from baseline.pytorch.torchy import *
 from baseline.pytorch.optz import OptimizerManager
-from baseline.utils import span_f1, per_entity_f1, conlleval_output
+from baseline.utils import conlleval_output
+from baseline.metrics import SpanF1Accumulator
 
 logger = logging.getLogger('baseline')
 
@@ -23,6 +24,7 @@ class TaggerTrainerPyTorch(EpochReportingTrainer):
         logger.info('Setting span type %s', self.span_type)
         self.model = model
         self.idx2label = revlut(self.model.labels)
+        self.spans = SpanExtractor(self.idx2label, self.span_type)
         self.clip = float(kwargs.get('clip', 5))
         self.optimizer = OptimizerManager(self.model, **kwargs)
         if self.gpus > 1:
@@ -41,32 +43,27 @@ class TaggerTrainerPyTorch(EpochReportingTrainer):
 
     def process_output(self, guess, truth, sentence_lengths, ids, handle=None, txts=None):
 
-        # For acc
-        correct_labels = 0
-        total_labels = 0
         truth_n = truth.cpu().numpy()
-        # For f1
-        gold_chunks = []
-        pred_chunks = []
-
-        # For each sentence
-        for b in range(len(guess)):
-            sentence = guess[b].cpu().numpy()
-            sentence_length = sentence_lengths[b]
+        lengths = sentence_lengths.cpu().numpy()
+        # The guesses are cut to their lengths, pad them back into one array before they leave the device
+        guess_n = np.zeros_like(truth_n)
+        padded = torch.nn.utils.rnn.pad_sequence(guess, batch_first=True).cpu().numpy()
+        guess_n[:, :padded.shape[1]] = padded
 
-            gold = truth_n[b, :sentence_length]
-            correct_labels += np.sum(np.equal(sentence, gold))
-            total_labels += sentence_length
-            gold_chunks.append(set(to_spans(gold, self.idx2label, self.span_type, self.verbose)))
-            pred_chunks.append(set(to_spans(sentence, self.idx2label, self.span_type, self.verbose)))
+        # For acc
+        mask = np.arange(truth_n.shape[1]) < lengths[:, np.newaxis]
+        correct_labels = np.sum((guess_n == truth_n) & mask)
+        total_labels = np.sum(lengths)
+        # For f1
+        span_counts = self.spans.count(truth_n, guess_n, lengths)
 
-            # Should we write a file out?  If so, we have to have txts
-            if handle is not None and txts is not None:
-                txt_id = ids[b]
-                txt = txts[txt_id]
-                write_sentence_conll(handle, sentence, gold, txt, self.idx2label)
+        # Should we write a file out?  If so, we have to have txts
+        if handle is not None and txts is not None:
+            for b, sentence_length in enumerate(lengths):
+                txt = txts[ids[b]]
+                write_sentence_conll(handle, guess_n[b, :sentence_length], truth_n[b, :sentence_length], txt, self.idx2label)
 
-        return correct_labels, total_labels, gold_chunks, pred_chunks
+        return correct_labels, total_labels, span_counts
 
     def _test(self, ts, **kwargs):
 
@@ -74,8 +71,7 @@ class TaggerTrainerPyTorch(EpochReportingTrainer):
         total_sum = 0
         total_correct = 0
 
-        gold_spans = []
-        pred_spans = []
+        span_metrics = SpanF1Accumulator(self.idx2label, self.span_type)
 
         metrics = {}
         steps = len(ts)
@@ -92,18 +88,17 @@ class TaggerTrainerPyTorch(EpochReportingTrainer):
             lengths = inputs['lengths']
             ids = inputs['ids']
             pred = self.model(inputs)
-            correct, count, golds, guesses = self.process_output(pred, y.data, lengths, ids, handle, txts)
+            correct, count, counts = self.process_output(pred, y.data, lengths, ids, handle, txts)
             total_correct += correct
             total_sum += count
-            gold_spans.extend(golds)
-            pred_spans.extend(guesses)
+            span_metrics.merge(counts)
 
         total_acc = total_correct / float(total_sum)
         metrics['acc'] = total_acc
-        metrics['f1'] = span_f1(gold_spans, pred_spans)
+        metrics.update(span_metrics.get_all_metrics())
         if self.verbose:
             # TODO: Add programmatic access to these metrics?
-            conll_metrics = per_entity_f1(gold_spans, pred_spans)
+            conll_metrics = span_metrics.get_per_entity_metrics()
             conll_metrics['acc'] = total_acc * 100
             conll_metrics['tokens'] = total_sum.item()
             logger.info(conlleval_output(conll_metrics))
@@ -166,10 +166,14 @@ def pytorch_rnn_cell(insz, hsz, rnntype, nlayers, dropout):
 
 
 def pytorch_embedding(weights, finetune=True):
-    lut = nn.Embedding(weights.shape[0], weights.shape[1], padding_idx=0)
-    del lut.weight
-    lut.weight = nn.Parameter(torch.FloatTensor(weights),
-                              requires_grad=finetune)
+    if not finetune and isinstance(weights, np.memmap) and weights.dtype == np.float32 and weights.flags.writeable:
+        # The weights are never written so use the mapped pages (shared with other processes) instead of a copy
+        weights = torch.from_numpy(weights)
+    else:
+        weights = torch.tensor(weights, dtype=torch.float)
+    # Passing the weights in skips initializing a matrix that would just be thrown away
+    lut = nn.Embedding(weights.shape[0], weights.shape[1], padding_idx=0, _weight=weights)
+    lut.weight.requires_grad = finetune
     return lut
 
 
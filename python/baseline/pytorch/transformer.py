@@ -96,21 +96,34 @@ class MultiHeadedAttention(nn.Module):
         self.attn = None
         self.dropout = nn.Dropout(dropout)
 
-    def forward(self, query, key, value, mask=None):
+    def forward(self, query, key, value, mask=None, cache=None, static_kv=False):
         """Low-order projections of query, key and value into multiple heads, then attention application and dropout
 
         :param query: a query for alignment. Can come from self in case of self-attn or decoder in case of E/D
         :param key: a set of keys from encoder or self
         :param value: a set of values from encoder or self
         :param mask: masking (for destination) to prevent seeing what we shouldnt
+        :param cache: (``dict``) The projected keys and values of the earlier steps when decoding one step at a time.
+            The new keys and values are appended to it, so each step only projects its own inputs
+        :param static_kv: (``bool``) The keys and values are the same every step (the encoder output), so once they are
+            in the `cache` they are used as they are
         :return: Multi-head attention output, result of attention application to sequence (B, T, d_model)
         """
         batchsz = query.size(0)
 
         # (B, H, T, D)
         query = self.w_Q(query).view(batchsz, -1, self.h, self.d_k).transpose(1, 2)
-        key = self.w_K(key).view(batchsz, -1, self.h, self.d_k).transpose(1, 2)
-        value = self.w_V(value).view(batchsz, -1, self.h, self.d_k).transpose(1, 2)
+        if static_kv and cache is not None and 'key' in cache:
+            key, value = cache['key'], cache['value']
+        else:
+            key = self.w_K(key).view(batchsz, -1, self.h, self.d_k).transpose(1, 2)
+            value = self.w_V(value).view(batchsz, -1, self.h, self.d_k).transpose(1, 2)
+            if cache is not None:
+                if 'key' in cache:
+                    key = torch.cat([cache['key'], key], dim=2)
+                    value = torch.cat([cache['value'], value], dim=2)
+                cache['key'] = key
+                cache['value'] = value
 
         x, self.attn = self.attn_fn(query, key, value, mask=mask, dropout=self.dropout)
 
@@ -132,15 +145,16 @@ class TransformerEncoder(nn.Module):
         self.ln2 = nn.LayerNorm(self.d_model, eps=1e-12)
         self.dropout = nn.Dropout(pdrop)
 
-    def forward(self, x, mask=None):
+    def forward(self, x, mask=None, cache=None):
         """
         :param x:
         :param mask:
+        :param cache: (``dict``) The self-attention keys and values of the earlier steps, see `MultiHeadedAttention`
         :return:
         """
         # Builtin Attention mask
         x = self.ln1(x)
-        h = self.self_attn(x, x, x, mask)
+        h = self.self_attn(x, x, x, mask, cache)
         x = x + self.dropout(h)
 
         x = self.ln2(x)
@@ -164,13 +178,22 @@ class TransformerDecoder(nn.Module):
         self.ln3 = nn.LayerNorm(self.d_model, eps=1e-12)
         self.dropout = nn.Dropout(pdrop)
 
-    def forward(self, x, memory, src_mask, tgt_mask):
-
+    def forward(self, x, memory, src_mask, tgt_mask, cache=None):
+        """
+        :param x:
+        :param memory:
+        :param src_mask:
+        :param tgt_mask:
+        :param cache: (``dict``) When decoding one step at a time, the keys and values of the earlier steps (`self`)
+            and of the memory (`src`), see `MultiHeadedAttention`
+        :return:
+        """
         x = self.ln1(x)
-        x = x + self.dropout(self.self_attn(x, x, x, tgt_mask))
+        self_cache, src_cache = (None, None) if cache is None else (cache['self'], cache['src'])
+        x = x + self.dropout(self.self_attn(x, x, x, tgt_mask, self_cache))
 
         x = self.ln2(x)
-        x = x + self.dropout(self.src_attn(x, memory, memory, src_mask))
+        x = x + self.dropout(self.src_attn(x, memory, memory, src_mask, src_cache, static_kv=True))
 
         x = self.ln3(x)
         x = x + self.dropout(self.ffn(x))
@@ -183,9 +206,15 @@ class TransformerEncoderStack(nn.Module):
         single_layer = TransformerEncoder(num_heads, d_model, pdrop, scale, activation_type, d_ff)
         self.layers = pytorch_clone_module(single_layer, layers)
 
-    def forward(self, x, mask):
-        for layer in self.layers:
-            x = layer(x, mask)
+    def forward(self, x, mask, cache=None):
+        """
+        :param x:
+        :param mask:
+        :param cache: (``list``) A `dict` per layer to hold its keys and values when decoding one step at a time
+        :return:
+        """
+        for i, layer in enumerate(self.layers):
+            x = layer(x, mask, None if cache is None else cache[i])
         return x
 
 
@@ -195,7 +224,11 @@ class TransformerDecoderStack(nn.Module):
         single_layer = TransformerDecoder(num_heads, d_model, pdrop, scale, activation_type, d_ff)
         self.layers = pytorch_clone_module(single_layer, layers)
 
-    def forward(self, x, memory, src_mask, tgt_mask):
-        for layer in self.layers:
-            x = layer(x, memory, src_mask, tgt_mask)
+    def init_cache(self):
+        """An empty cache for each layer, to decode one step at a time with"""
+        return [{'self': {}, 'src': {}} for _ in self.layers]
+
+    def forward(self, x, memory, src_mask, tgt_mask, cache=None):
+        for i, layer in enumerate(self.layers):
+            x = layer(x, memory, src_mask, tgt_mask, None if cache is None else cache[i])
         return x
@@ -3,16 +3,27 @@ from six.moves import filter
 
 import os
 import re
+import copy
+import glob
+import json
+import bisect
 import codecs
-from itertools import chain
+import pickle
+import hashlib
+import logging
+import multiprocessing
+from functools import partial
+from itertools import chain, islice
 from collections import Counter
 import numpy as np
 import baseline.data
-from baseline.vectorizers import Dict1DVectorizer, GOVectorizer, Token1DVectorizer
-from baseline.utils import import_user_module, revlut, export, optional_params, Offsets, listify
+from baseline.vectorizers import Vectorizer, Dict1DVectorizer, GOVectorizer, Token1DVectorizer, identity_trans_fn
+from baseline.w2v import file_key
+from baseline.utils import import_user_module, revlut, export, optional_params, Offsets, listify, read_json, write_json
 
 __all__ = []
 exporter = export(__all__)
+logger = logging.getLogger('baseline')
 
 
 BASELINE_READERS = {}
@@ -91,16 +102,28 @@ def _read_from_col(col, files, col_splitter=r'\t', word_splitter=r'\s'):
         if file_name is None:
             continue
         with codecs.open(file_name, encoding='utf-8', mode='r') as f:
-            for line in f:
-                line = line.rstrip('\n')
-                if line == "":
-                    continue
-                cols = re.split(col_splitter, line)
-                text.append(re.split(word_splitter, cols[col]))
+            text.extend(_split_col(f, col, col_splitter, word_splitter))
     return text
 
 
-def _build_vocab_for_col(col, files, vectorizers, text=None, col_splitter=r'\t', word_splitter=r'\s'):
+def _split_col(lines, col, col_splitter=r'\t', word_splitter=r'\s'):
+    for line in lines:
+        line = line.rstrip('\n')
+        if line == "":
+            continue
+        cols = re.split(col_splitter, line)
+        yield re.split(word_splitter, cols[col])
+
+
+def _count_col_shard(shard, vectorizers, col, col_splitter=r'\t', word_splitter=r'\s'):
+    vocab = {k: Counter() for k in vectorizers}
+    for t in _split_col(_read_lines(*shard), col, col_splitter, word_splitter):
+        for k, vect in vectorizers.items():
+            vocab[k].update(vect.count(t))
+    return vocab, Counter()
+
+
+def _build_vocab_for_col(col, files, vectorizers, text=None, col_splitter=r'\t', word_splitter=r'\s', workers=1):
     """Build vocab from a single column in file. (separated by `\t`).
 
     Used to read a vocab from a single conll column, read a vocab from the
@@ -112,9 +135,14 @@ def _build_vocab_for_col(col, files, vectorizers, text=None, col_splitter=r'\t',
     :param text: List[str]: The text from the columns or None
     :param col_splitter: `str`: The regex that splits a line into columns.
     :param word_splitter: `str`: The regex that will split a column into words.
+    :param workers: `int`: The number of processes to count with when reading from `files`.
 
     :returns: dict[str] -> dict[str] -> int: The vocabs.
     """
+    if text is None and workers > 1:
+        count_fn = partial(_count_col_shard, col=col, col_splitter=col_splitter, word_splitter=word_splitter)
+        vocab, _ = _count_vocabs(count_fn, _file_shards(files, workers), vectorizers, workers)
+        return vocab
     text = _read_from_col(col, files, col_splitter, word_splitter) if text is None else text
     vocab = {k: Counter() for k in vectorizers}
     for t in text:
@@ -140,10 +168,414 @@ def _vocab_allowed(vectorizers):
         raise RuntimeError(fail_str + vect_str)
 
 
+def _file_checksum(filename, block_size=1 << 20):
+    """Get the sha1 of a file's contents, reading it in blocks.
+
+    :param filename: `str`: The file to hash.
+    :param block_size: `int`: The number of bytes to read at a time.
+
+    :returns: `str`: The hex digest.
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _callable_name(fn):
+    code = getattr(fn, '__code__', None)
+    name = '{}.{}'.format(getattr(fn, '__module__', ''), getattr(fn, '__name__', repr(fn)))
+    # Lambdas all share a name so fall back to the bytecode
+    if code is not None:
+        name += '@' + hashlib.sha1(code.co_code).hexdigest()
+    return name
+
+
+def _vectorizer_signature(vectorizer):
+    """Get a json-able description of a vectorizer that changes whenever its output would.
+
+    :param vectorizer: `Vectorizer`: The vectorizer to describe.
+
+    :returns: `dict`: The class name and all of the fields of the vectorizer.
+    """
+    sig = {'type': '{}.{}'.format(vectorizer.__class__.__module__, vectorizer.__class__.__name__)}
+    for k, v in vars(vectorizer).items():
+        if isinstance(v, Vectorizer):
+            v = _vectorizer_signature(v)
+        elif callable(v):
+            v = _callable_name(v)
+        sig[k] = v
+    return sig
+
+
+def _examples_cache_dir(cache_dir, files, vectorizers, vocabs, **kwargs):
+    """Get the location of the tensorized cache for some files.
+
+    The location is a hash of the contents of the files, the vectorizer config, the vocabs and anything else
+    that changes the vectorized output (like the label indices) so a stale cache is never read.
+
+    :param cache_dir: `str`: The root of the cache, if `None` caching is off.
+    :param files: List[str]: The files that are being read.
+    :param vectorizers: dict[str] -> Vectorizer: The vectorizers.
+    :param vocabs: dict[str] -> dict[str] -> int: The vocabs for each vectorizer.
+    :param kwargs: Any other json-able values that affect the output.
+
+    :returns: `str`: The cache directory for this data or `None`.
+    """
+    if cache_dir is None:
+        return None
+    key = {
+        'files': [_file_checksum(f) for f in files],
+        'vectorizers': {k: _vectorizer_signature(v) for k, v in vectorizers.items()},
+        'vocabs': {k: hashlib.sha1(json.dumps(v, sort_keys=True).encode('utf-8')).hexdigest() for k, v in vocabs.items()},
+    }
+    key.update(kwargs)
+    key = hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return os.path.join(os.path.expanduser(cache_dir), key)
+
+
+def _vectorizer_lens(vectorizers):
+    lens = {}
+    for k, vectorizer in vectorizers.items():
+        vectorizer = getattr(vectorizer, 'vectorizer', vectorizer)
+        lens[k] = {a: getattr(vectorizer, a) for a in ('mxlen', 'mxwlen') if hasattr(vectorizer, a)}
+    return lens
+
+
+def _run_batch(vectorizers, tokens_batch, vocabs, arrays=None):
+    """Vectorize a batch of examples with each vectorizer.
+
+    :param vectorizers: dict[str] -> Vectorizer: The vectorizers.
+    :param tokens_batch: List[List]: The tokens of each example.
+    :param vocabs: dict[str] -> dict[str] -> int: The vocabs for each vectorizer.
+    :param arrays: dict[str] -> np.ndarray: Add the output to these arrays, if `None` a new ``dict`` is created.
+
+    :returns: dict[str] -> np.ndarray: The `[B, ...]` array for each vectorizer and its `_lengths` if it has any.
+    """
+    arrays = {} if arrays is None else arrays
+    for k, vectorizer in vectorizers.items():
+        arrays[k], lengths = vectorizer.run_batch(tokens_batch, vocabs[k])
+        if lengths is not None:
+            arrays['{}_lengths'.format(k)] = lengths
+    return arrays
+
+
+def _save_cached_examples(cache, arrays, vectorizers):
+    """Write vectorized examples to the cache along with the lengths the vectorizers settled on."""
+    logger.info('Writing tensorized examples to %s', cache)
+    baseline.data.MMapExamples.save(cache, arrays, vectorizers=_vectorizer_lens(vectorizers))
+
+
+def _load_cached_examples(cache, vectorizers, do_shuffle, sort_key):
+    """Read examples back from the cache.
+
+    The vectorizers never see the data when the cache is hit so restore any lengths that `run` would have set.
+    """
+    logger.info('Reading tensorized examples from %s', cache)
+    examples = baseline.data.MMapExamples(cache, do_shuffle=do_shuffle, sort_key=sort_key)
+    for k, lens in examples.meta['vectorizers'].items():
+        vectorizer = getattr(vectorizers[k], 'vectorizer', vectorizers[k])
+        for a, v in lens.items():
+            setattr(vectorizer, a, v)
+    return examples
+
+
+_MAX_SEEN = ('max_seen', 'max_seen_tok', 'max_seen_char')
+
+
+def _max_seen(vectorizers):
+    """Get the longest lengths that `count` has recorded on each vectorizer."""
+    seen = {}
+    for k, vectorizer in vectorizers.items():
+        vectorizer = getattr(vectorizer, 'vectorizer', vectorizer)
+        seen[k] = {a: getattr(vectorizer, a) for a in _MAX_SEEN if hasattr(vectorizer, a)}
+    return seen
+
+
+def _update_max_seen(vectorizers, seen):
+    """Fold lengths that were recorded by `count` somewhere else (another process or a cache) into the vectorizers."""
+    for k, lens in seen.items():
+        vectorizer = getattr(vectorizers[k], 'vectorizer', vectorizers[k])
+        for a, v in lens.items():
+            setattr(vectorizer, a, max(getattr(vectorizer, a, 0), v))
+
+
+def _read_lines(filename, start=0, end=None):
+    """Read the lines that start in the byte range `[start, end)` of a file.
+
+    Lines are split the same way `codecs.open` splits them so reading a file in pieces gives the same lines as
+    reading it whole.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            for l in line.decode('utf-8').splitlines(True):
+                yield l
+
+
+def _file_shards(files, num_shards, is_boundary=None):
+    """Split files into about `num_shards` byte ranges.
+
+    Each range starts at the beginning of a line or, if `is_boundary` is given, just after a line that it accepts
+    so examples that span several lines are never split.
+
+    :param files: List[str]: The files to split, `None` entries are skipped.
+    :param num_shards: `int`: The total number of ranges to aim for, files are never merged.
+    :param is_boundary: A function that takes a (binary) line and returns `True` if an example ends with it.
+
+    :returns: List[(str, int, int)]: The file, start and end (`None` for the end of the file) of each range.
+    """
+    files = [f for f in files if f is not None]
+    sizes = [os.path.getsize(f) for f in files]
+    total = float(max(sum(sizes), 1))
+    shards = []
+    for file_name, size in zip(files, sizes):
+        n = max(1, int(round(num_shards * size / total)))
+        starts = [0]
+        with open(file_name, 'rb') as f:
+            for i in range(1, n):
+                # Back up a byte so a split that lands on the start of a line keeps that line
+                f.seek(i * size // n - 1)
+                f.readline()
+                if is_boundary is not None:
+                    line = f.readline()
+                    while line and not is_boundary(line):
+                        line = f.readline()
+                pos = f.tell()
+                if starts[-1] < pos < size:
+                    starts.append(pos)
+        shards += [(file_name, s, e) for s, e in zip(starts, starts[1:] + [None])]
+    return shards
+
+
+def _count_shard(args):
+    count_fn, shard, vectorizers = args
+    counts = count_fn(shard, vectorizers)
+    return counts, _max_seen(vectorizers)
+
+
+def _can_pickle(*args):
+    """Check that the arguments can be sent to another process, logging why not if they can't"""
+    try:
+        pickle.dumps(args, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        logger.warning("Can't count vocabs in parallel, counting in this process instead: %s", e)
+        return False
+    return True
+
+
+def _count_vocabs(count_fn, shards, vectorizers, workers=1, cache_file=None):
+    """Count the vocabs (and labels) in each shard of the data and add them up.
+
+    With `workers > 1` the shards are counted in a process pool.  Each worker counts with its own copy of the
+    vectorizers so the lengths they saw are merged back in afterwards.  If the counting can't be sent to another
+    process (a `lambda` `transform_fn` for instance) this falls back to counting in this one.
+
+    :param count_fn: A function of a shard and the vectorizers that returns a ``dict`` of vocab ``Counter``s and
+        a ``Counter`` of labels.  Labels are merged in the order they were first seen.
+    :param shards: List[(str, int, int)]: The shards from `_file_shards`.
+    :param vectorizers: dict[str] -> Vectorizer: The vectorizers that `count_fn` counts with.
+    :param workers: `int`: The number of processes to count with.
+    :param cache_file: `str`: If not `None`, the counts are read from this file if it exists and written to it if not.
+
+    :returns: The vocabs and the labels for all of the shards.
+    """
+    if cache_file is not None and os.path.exists(cache_file):
+        logger.info('Reading vocab counts from %s', cache_file)
+        cached = read_json(cache_file)
+        _update_max_seen(vectorizers, cached['vectorizers'])
+        return {k: Counter(dict(v)) for k, v in cached['vocabs'].items()}, Counter(dict(cached['labels']))
+
+    results = None
+    if workers > 1 and len(shards) > 1 and _can_pickle(count_fn, vectorizers):
+        pool = multiprocessing.Pool(min(workers, len(shards)))
+        try:
+            results = pool.map(_count_shard, [(count_fn, shard, vectorizers) for shard in shards])
+        finally:
+            pool.terminate()
+    if results is not None:
+        for _, seen in results:
+            _update_max_seen(vectorizers, seen)
+        results = [counts for counts, _ in results]
+    else:
+        results = [count_fn(shard, vectorizers) for shard in shards]
+
+    vocabs = {k: Counter() for k in vectorizers}
+    labels = Counter()
+    for shard_vocabs, shard_labels in results:
+        for k, counts in shard_vocabs.items():
+            vocabs[k].update(counts)
+        labels.update(shard_labels)
+
+    if cache_file is not None:
+        logger.info('Writing vocab counts to %s', cache_file)
+        write_json({
+            'vocabs': {k: list(v.items()) for k, v in vocabs.items()},
+            'labels': list(labels.items()),
+            'vectorizers': _max_seen(vectorizers)
+        }, cache_file)
+    return vocabs, labels
+
+
+def _counts_cache_file(cache_dir, files, vectorizers, **kwargs):
+    """Get the location of the cached vocab counts for some files, or `None` if caching is off."""
+    files = [f for f in files if f is not None]
+    cache = _examples_cache_dir(cache_dir, files, vectorizers, {}, counts=True, **kwargs)
+    if cache is None:
+        return None
+    if not os.path.exists(os.path.dirname(cache)):
+        os.makedirs(os.path.dirname(cache))
+    return cache + '-counts.json'
+
+
+def _expand_files(filename):
+    """Expand a glob of data shards, a name that matches nothing is passed through as is."""
+    files = sorted(glob.glob(filename))
+    return files if files else [filename]
+
+
+def _expand_all(files):
+    """Expand the globs in a list of data files, `None` entries are dropped"""
+    return [f for file_name in files if file_name is not None for f in _expand_files(file_name)]
+
+
+def _no_bucketing(kwargs):
+    """Fail if a streaming load is asked to bucket, examples are only ever seen a buffer at a time so they can't be"""
+    bucketing = [k for k in ('buckets', 'max_tokens') if kwargs.pop(k, None) is not None]
+    if bucketing:
+        raise ValueError("Streaming data can't be bucketed, remove {} or `streaming` from the config".format(
+            ' and '.join('`{}`'.format(k) for k in bucketing)
+        ))
+
+
+def _no_streaming(reader, kwargs):
+    """Fail if a reader that always loads its whole file is asked to stream it, instead of quietly loading it"""
+    if kwargs.pop('streaming', False):
+        raise ValueError("{} can't stream its data, remove `streaming` from the config".format(
+            reader.__class__.__name__
+        ))
+    kwargs.pop('shuffle_buffer', None)
+
+
+def _num_examples(files, read_fn, cache_dir=None, **kwargs):
+    """Count the examples in a set of streamed files.
+
+    Counting means reading every file, so with a `cache_dir` the count of each file is kept there, keyed on its
+    path, size and modification time, and a file is only ever counted once.
+
+    :param files: List[str]: The files.
+    :param read_fn: A function that takes a file name and returns an iterator over its examples.
+    :param cache_dir: `str`: Where to keep the counts, if `None` every file is counted.
+    :param kwargs: Any other json-able values that change how many examples are read from a file.
+
+    :returns: `int`: The number of examples.
+    """
+    total = 0
+    for file_name in files:
+        cache = None
+        if cache_dir is not None:
+            key = {'file': file_key(file_name)}
+            key.update(kwargs)
+            key = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+            cache = os.path.join(os.path.expanduser(cache_dir), '{}-num-examples.json'.format(key))
+            if os.path.exists(cache):
+                total += read_json(cache)['num_examples']
+                continue
+        num_examples = sum(1 for _ in read_fn(file_name))
+        if cache is not None:
+            if not os.path.exists(os.path.dirname(cache)):
+                os.makedirs(os.path.dirname(cache))
+            write_json({'file': file_name, 'num_examples': num_examples}, cache)
+        total += num_examples
+    return total
+
+
+def _stream_files(files, shuffle, read_fn):
+    """Chain the raw examples from each file, visiting the files in a random order if `shuffle`."""
+    order = np.random.permutation(len(files)) if shuffle else range(len(files))
+    for i in order:
+        for example in read_fn(files[i]):
+            yield example
+
+
+def _line_tokens(line):
+    """Split a (binary) line into tokens, the same way `LineSeqReader` does when it reads the whole file."""
+    tokens = []
+    for sentence in line.decode('utf-8').splitlines():
+        tokens += sentence.split() + ['<EOS>']
+    return tokens
+
+
+class _LazyExamples(object):
+    """The examples of a file, read the first time they are looked at"""
+    def __init__(self, read_fn, filename):
+        self.read_fn = read_fn
+        self.filename = filename
+        self._examples = None
+
+    @property
+    def examples(self):
+        if self._examples is None:
+            self._examples = self.read_fn(self.filename)
+        return self._examples
+
+    def __getitem__(self, i):
+        return self.examples[i]
+
+    def __len__(self):
+        return len(self.examples)
+
+    def __iter__(self):
+        return iter(self.examples)
+
+
+class _TokenIndex(object):
+    """Random access into the token stream of a set of line-per-sentence files.
+
+    Counting the tokens leaves a checkpoint every `every` lines so that a read starting at any token offset only
+    has to seek and then skip at most `every` lines worth of tokens.
+    """
+    def __init__(self, files, every=1000):
+        self.files = files
+        self.tokens_before = []
+        self.checkpoints = []
+        num_tokens = 0
+        for fi, file_name in enumerate(files):
+            pos = 0
+            with open(file_name, 'rb') as f:
+                for i, line in enumerate(f):
+                    if i % every == 0:
+                        self.tokens_before.append(num_tokens)
+                        self.checkpoints.append((fi, pos))
+                    num_tokens += len(_line_tokens(line))
+                    pos += len(line)
+        self.num_tokens = num_tokens
+
+    def _tokens_from(self, checkpoint):
+        fi, pos = self.checkpoints[checkpoint]
+        for file_name in self.files[fi:]:
+            with open(file_name, 'rb') as f:
+                f.seek(pos)
+                for line in f:
+                    for token in _line_tokens(line):
+                        yield token
+            pos = 0
+
+    def __call__(self, offset):
+        checkpoint = bisect.bisect_right(self.tokens_before, offset) - 1
+        skip = offset - self.tokens_before[checkpoint]
+        return islice(self._tokens_from(checkpoint), skip, None)
+
+
 @exporter
 class ParallelCorpusReader(object):
 
-    def __init__(self, vectorizers, trim=False, truncate=False):
+    def __init__(self, vectorizers, trim=False, truncate=False, cache_dir=None, vocab_workers=1):
         super(ParallelCorpusReader, self).__init__()
 
         self.src_vectorizers = {}
@@ -155,6 +587,8 @@ class ParallelCorpusReader(object):
                 self.src_vectorizers[k] = vectorizer
         self.trim = trim
         self.truncate = truncate
+        self.cache_dir = cache_dir
+        self.vocab_workers = int(vocab_workers)
 
     def build_vocabs(self, files, **kwargs):
         pass
@@ -162,10 +596,27 @@ class ParallelCorpusReader(object):
     def load_examples(self, tsfile, vocab1, vocab2, shuffle, sort_key):
         pass
 
-    def load(self, tsfile, vocab1, vocab2, batchsz, shuffle=False, sort_key=None):
+    def _all_vectorizers(self):
+        all_vects = self.src_vectorizers.copy()
+        all_vects['tgt'] = self.tgt_vectorizer
+        return all_vects
+
+    def _run_batch(self, srcs, tgts, src_vocabs, tgt_vocab):
+        arrays = _run_batch(self.src_vectorizers, srcs, src_vocabs)
+        arrays['tgt'], arrays['tgt_lengths'] = self.tgt_vectorizer.run_batch(tgts, tgt_vocab)
+        return arrays
+
+    def _cache_path(self, files, src_vocabs, tgt_vocab):
+        vocabs = dict(src_vocabs)
+        vocabs['tgt'] = tgt_vocab
+        return _examples_cache_dir(self.cache_dir, files, self._all_vectorizers(), vocabs, reader=self.__class__.__name__)
+
+    def load(self, tsfile, vocab1, vocab2, batchsz, shuffle=False, sort_key=None, **kwargs):
+        _no_streaming(self, kwargs)
         examples = self.load_examples(tsfile, vocab1, vocab2, shuffle, sort_key)
         return baseline.data.ExampleDataFeed(examples, batchsz,
-                                             shuffle=shuffle, trim=self.trim, sort_key=sort_key, truncate=self.truncate)
+                                             shuffle=shuffle, trim=self.trim, sort_key=sort_key, truncate=self.truncate,
+                                             **kwargs)
 
 
 @register_reader(task='seq2seq', name='tsv')
@@ -173,7 +624,8 @@ class TSVParallelCorpusReader(ParallelCorpusReader):
 
     def __init__(self, vectorizers,
                  trim=False, truncate=False, src_col_num=0, tgt_col_num=1, **kwargs):
-        super(TSVParallelCorpusReader, self).__init__(vectorizers, trim, truncate)
+        super(TSVParallelCorpusReader, self).__init__(vectorizers, trim, truncate, kwargs.get('cache_dir'),
+                                                      kwargs.get('vocab_workers', 1))
         self.src_col_num = src_col_num
         self.tgt_col_num = tgt_col_num
 
@@ -188,8 +640,9 @@ class TSVParallelCorpusReader(ParallelCorpusReader):
             src_vocab = _build_vocab_for_col(None, None, self.src_vectorizers, text=text)
             tgt_vocab = _build_vocab_for_col(None, None, {'tgt': self.tgt_vectorizer}, text=text)
             return src_vocab, tgt_vocab['tgt']
-        src_vocab = _build_vocab_for_col(self.src_col_num, files, self.src_vectorizers)
-        tgt_vocab = _build_vocab_for_col(self.tgt_col_num, files, {'tgt': self.tgt_vectorizer})
+        src_vocab = _build_vocab_for_col(self.src_col_num, files, self.src_vectorizers, workers=self.vocab_workers)
+        tgt_vocab = _build_vocab_for_col(self.tgt_col_num, files, {'tgt': self.tgt_vectorizer},
+                                         workers=self.vocab_workers)
         min_f = kwargs.get('min_f', {})
         tgt_min_f = {'tgt': min_f.pop('tgt', -1)}
         src_vocab = _filter_vocab(src_vocab, min_f)
@@ -197,22 +650,21 @@ class TSVParallelCorpusReader(ParallelCorpusReader):
         return src_vocab, tgt_vocab['tgt']
 
     def load_examples(self, tsfile, src_vocabs, tgt_vocab, do_shuffle, src_sort_key):
-        ts = []
+        cache = self._cache_path([tsfile], src_vocabs, tgt_vocab)
+        if cache is not None and baseline.data.MMapExamples.exists(cache):
+            return _load_cached_examples(cache, self._all_vectorizers(), do_shuffle, src_sort_key)
+        srcs = []
+        tgts = []
         with codecs.open(tsfile, encoding='utf-8', mode='r') as f:
             for line in f:
                 splits = re.split("\t", line.strip())
-                src = list(filter(lambda x: len(x) != 0, re.split("\s+", splits[0])))
-
-                example = {}
-                for k, vectorizer in self.src_vectorizers.items():
-                    example[k], length = vectorizer.run(src, src_vocabs[k])
-                    if length is not None:
-                        example['{}_lengths'.format(k)] = length
-
-                tgt = list(filter(lambda x: len(x) != 0, re.split("\s+", splits[1])))
-                example['tgt'], example['tgt_lengths'] = self.tgt_vectorizer.run(tgt, tgt_vocab)
-                ts.append(example)
-        return baseline.data.Seq2SeqExamples(ts, do_shuffle=do_shuffle, src_sort_key=src_sort_key)
+                srcs.append(list(filter(lambda x: len(x) != 0, re.split("\s+", splits[0]))))
+                tgts.append(list(filter(lambda x: len(x) != 0, re.split("\s+", splits[1]))))
+        arrays = self._run_batch(srcs, tgts, src_vocabs, tgt_vocab)
+        if cache is not None:
+            _save_cached_examples(cache, arrays, self._all_vectorizers())
+            return _load_cached_examples(cache, self._all_vectorizers(), do_shuffle, src_sort_key)
+        return baseline.data.ColumnarExamples(arrays, do_shuffle=do_shuffle, sort_key=src_sort_key)
 
 
 @exporter
@@ -220,7 +672,8 @@ class TSVParallelCorpusReader(ParallelCorpusReader):
 class MultiFileParallelCorpusReader(ParallelCorpusReader):
 
     def __init__(self, vectorizers, trim=False, truncate=False, **kwargs):
-        super(MultiFileParallelCorpusReader, self).__init__(vectorizers, trim, truncate)
+        super(MultiFileParallelCorpusReader, self).__init__(vectorizers, trim, truncate, kwargs.get('cache_dir'),
+                                                            kwargs.get('vocab_workers', 1))
         pair_suffix = kwargs['pair_suffix']
 
         self.src_suffix = pair_suffix[0]
@@ -241,8 +694,10 @@ class MultiFileParallelCorpusReader(ParallelCorpusReader):
             src_vocab = _build_vocab_for_col(None, None, self.src_vectorizers, text=text)
             tgt_vocab = _build_vocab_for_col(None, None, {'tgt': self.tgt_vectorizer}, text=text)
             return src_vocab, tgt_vocab['tgt']
-        src_vocab = _build_vocab_for_col(0, [f + self.src_suffix for f in files], self.src_vectorizers)
-        tgt_vocab = _build_vocab_for_col(0, [f + self.tgt_suffix for f in files], {'tgt': self.tgt_vectorizer})
+        src_vocab = _build_vocab_for_col(0, [f + self.src_suffix for f in files], self.src_vectorizers,
+                                         workers=self.vocab_workers)
+        tgt_vocab = _build_vocab_for_col(0, [f + self.tgt_suffix for f in files], {'tgt': self.tgt_vectorizer},
+                                         workers=self.vocab_workers)
         min_f = kwargs.get('min_f', {})
         tgt_min_f = {'tgt': min_f.pop('tgt', -1)}
         src_vocab = _filter_vocab(src_vocab, min_f)
@@ -250,21 +705,22 @@ class MultiFileParallelCorpusReader(ParallelCorpusReader):
         return src_vocab, tgt_vocab['tgt']
 
     def load_examples(self, tsfile, src_vocabs, tgt_vocab, do_shuffle, src_sort_key):
-        ts = []
+        cache = self._cache_path([tsfile + self.src_suffix, tsfile + self.tgt_suffix], src_vocabs, tgt_vocab)
+        if cache is not None and baseline.data.MMapExamples.exists(cache):
+            return _load_cached_examples(cache, self._all_vectorizers(), do_shuffle, src_sort_key)
+        srcs = []
+        tgts = []
 
         with codecs.open(tsfile + self.src_suffix, encoding='utf-8', mode='r') as fsrc:
             with codecs.open(tsfile + self.tgt_suffix, encoding='utf-8', mode='r') as ftgt:
                 for src, tgt in zip(fsrc, ftgt):
-                    example = {}
-                    src = re.split("\s+", src.strip())
-                    for k, vectorizer in self.src_vectorizers.items():
-                        example[k], length = vectorizer.run(src, src_vocabs[k])
-                        if length is not None:
-                            example['{}_lengths'.format(k)] = length
-                    tgt = re.split("\s+", tgt.strip())
-                    example['tgt'], example['tgt_lengths'] = self.tgt_vectorizer.run(tgt, tgt_vocab)
-                    ts.append(example)
-        return baseline.data.Seq2SeqExamples(ts, do_shuffle=do_shuffle, src_sort_key=src_sort_key)
+                    srcs.append(re.split("\s+", src.strip()))
+                    tgts.append(re.split("\s+", tgt.strip()))
+        arrays = self._run_batch(srcs, tgts, src_vocabs, tgt_vocab)
+        if cache is not None:
+            _save_cached_examples(cache, arrays, self._all_vectorizers())
+            return _load_cached_examples(cache, self._all_vectorizers(), do_shuffle, src_sort_key)
+        return baseline.data.ColumnarExamples(arrays, do_shuffle=do_shuffle, sort_key=src_sort_key)
 
 
 @exporter
@@ -275,6 +731,8 @@ class SeqPredictReader(object):
         self.vectorizers = vectorizers
         self.trim = trim
         self.truncate = truncate
+        self.cache_dir = kwargs.get('cache_dir')
+        self.vocab_workers = int(kwargs.get('vocab_workers', 1))
         self.label2index = {
             Offsets.VALUES[Offsets.PAD]: Offsets.PAD,
             Offsets.VALUES[Offsets.GO]: Offsets.GO,
@@ -285,7 +743,6 @@ class SeqPredictReader(object):
     def build_vocab(self, files, **kwargs):
         pre_vocabs = None
         pre_labels = None
-        vocabs = {k: Counter() for k in self.vectorizers.keys()}
 
         vocab_file = kwargs.get('vocab_file')
         label_file = kwargs.get('label_file')
@@ -296,19 +753,15 @@ class SeqPredictReader(object):
             pre_labels = Counter(chain(*_read_from_col(0, listify(label_file))))
             self.label2index = {l: i for i, l in enumerate(pre_labels)}
 
-        labels = Counter()
-
         #if not pre_vocabs:
-        for file in files:
-            if file is None:
-                continue
-
-            examples = self.read_examples(file)
-            for example in examples:
-                labels.update(self.label_vectorizer.count(example))
-                for k, vectorizer in self.vectorizers.items():
-                    vocab_example = vectorizer.count(example)
-                    vocabs[k].update(vocab_example)
+        all_vects = self.vectorizers.copy()
+        all_vects['y'] = self.label_vectorizer
+        files = _expand_all(files)
+        num_shards = self.vocab_workers if self._is_example_boundary is not None else 1
+        shards = _file_shards(files, num_shards, self._is_example_boundary)
+        cache_file = _counts_cache_file(self.cache_dir, files, all_vects, **self._cache_params())
+        vocabs, labels = _count_vocabs(self._count_shard, shards, all_vects, self.vocab_workers, cache_file)
+        vocabs.pop('y')
 
         if pre_labels and not pre_vocabs:
             return vocabs
@@ -324,26 +777,84 @@ class SeqPredictReader(object):
     def read_examples(self):
         pass
 
-    def load(self, filename, vocabs, batchsz, shuffle=False, sort_key=None):
+    # Readers whose examples span several lines can set this to a function that takes a (binary) line and returns
+    # `True` if it ends an example, so that `build_vocab` can split a file between processes
+    _is_example_boundary = None
 
-        ts = []
-        texts = self.read_examples(filename)
+    def _count_shard(self, shard, vectorizers):
+        file_name, start, end = shard
+        if start == 0 and end is None:
+            examples = self.read_examples(file_name)
+        else:
+            examples = self.iter_examples(file_name, start, end)
+        vocabs = {k: Counter() for k in self.vectorizers}
+        labels = Counter()
+        for example in examples:
+            labels.update(vectorizers['y'].count(example))
+            for k in self.vectorizers:
+                vocabs[k].update(vectorizers[k].count(example))
+        return vocabs, labels
+
+    def iter_examples(self, filename, start=0, end=None):
+        """Lazily read the examples that start in the byte range `[start, end)` of a file.
+
+        This default reads the whole file, so it only handles the whole range.  Readers that set
+        `_is_example_boundary` must override it, and any reader that can should to avoid holding the file.
+        """
+        if start != 0 or end is not None:
+            raise NotImplementedError("{} can't read part of a file".format(self.__class__.__name__))
+        return iter(self.read_examples(filename))
+
+    def _cache_params(self):
+        """Anything, other than the data, vectorizers and vocabs, that changes the tensorized examples"""
+        return {'reader': self.__class__.__name__, 'labels': self.label2index}
+
+    def _run_batch(self, ids, examples_tokens, vocabs):
+        arrays = _run_batch(self.vectorizers, examples_tokens, vocabs)
+        arrays['y'], arrays['y_lengths'] = self.label_vectorizer.run_batch(examples_tokens, self.label2index)
+        arrays['ids'] = np.array(ids, dtype=int)
+        return arrays
+
+    def load(self, filename, vocabs, batchsz, shuffle=False, sort_key=None, **kwargs):
 
         if sort_key is not None and not sort_key.endswith('_lengths'):
             sort_key += '_lengths'
 
-        for i, example_tokens in enumerate(texts):
-            example = {}
-            for k, vectorizer in self.vectorizers.items():
-                example[k], lengths = vectorizer.run(example_tokens, vocabs[k])
-                if lengths is not None:
-                    example['{}_lengths'.format(k)] = lengths
-            example['y'], lengths = self.label_vectorizer.run(example_tokens, self.label2index)
-            example['y_lengths'] = lengths
-            example['ids'] = i
-            ts.append(example)
-        examples = baseline.data.DictExamples(ts, do_shuffle=shuffle, sort_key=sort_key)
-        return baseline.data.ExampleDataFeed(examples, batchsz=batchsz, shuffle=shuffle, trim=self.trim, truncate=self.truncate), texts
+        if kwargs.pop('streaming', False):
+            _no_bucketing(kwargs)
+            files = _expand_files(filename)
+            if kwargs.get('num_examples') is None:
+                kwargs['num_examples'] = _num_examples(files, self.iter_examples, self.cache_dir,
+                                                       reader=self.__class__.__name__)
+
+            def stream_fn(do_shuffle):
+                return enumerate(_stream_files(files, do_shuffle, self.iter_examples))
+
+            def vectorize_fn(raw):
+                ids, examples_tokens = zip(*raw)
+                return self._run_batch(ids, list(examples_tokens), vocabs)
+
+            return baseline.data.StreamingDataFeed(stream_fn, vectorize_fn, batchsz, shuffle=shuffle,
+                                                   sort_key=sort_key, trim=self.trim, truncate=self.truncate,
+                                                   **kwargs), None
+
+        all_vects = self.vectorizers.copy()
+        all_vects['y'] = self.label_vectorizer
+        cache = _examples_cache_dir(self.cache_dir, [filename], all_vects, vocabs, **self._cache_params())
+        if cache is not None and baseline.data.MMapExamples.exists(cache):
+            examples = _load_cached_examples(cache, all_vects, shuffle, sort_key)
+            # The raw examples are only needed to write out predictions, so don't parse the file unless they are used
+            texts = _LazyExamples(self.read_examples, filename)
+            return baseline.data.ExampleDataFeed(examples, batchsz=batchsz, shuffle=shuffle, trim=self.trim, truncate=self.truncate, **kwargs), texts
+
+        texts = self.read_examples(filename)
+        arrays = self._run_batch(range(len(texts)), texts, vocabs)
+        if cache is not None:
+            _save_cached_examples(cache, arrays, all_vects)
+            examples = _load_cached_examples(cache, all_vects, shuffle, sort_key)
+        else:
+            examples = baseline.data.ColumnarExamples(arrays, do_shuffle=shuffle, sort_key=sort_key)
+        return baseline.data.ExampleDataFeed(examples, batchsz=batchsz, shuffle=shuffle, trim=self.trim, truncate=self.truncate, **kwargs), texts
 
 
 @exporter
@@ -354,34 +865,43 @@ class CONLLSeqReader(SeqPredictReader):
         super(CONLLSeqReader, self).__init__(vectorizers, trim, truncate, mxlen, **kwargs)
         self.named_fields = kwargs.get('named_fields', {})
 
+    def _cache_params(self):
+        params = super(CONLLSeqReader, self)._cache_params()
+        params['named_fields'] = self.named_fields
+        return params
+
     def read_examples(self, tsfile):
+        return list(self.iter_examples(tsfile))
+
+    @staticmethod
+    def _is_example_boundary(line):
+        return len(re.split("\s", line.decode('utf-8').strip())) <= 1
+
+    def iter_examples(self, tsfile, start=0, end=None):
 
         tokens = []
-        examples = []
 
-        with codecs.open(tsfile, encoding='utf-8', mode='r') as f:
-            for i, line in enumerate(f):
-                states = re.split("\s", line.strip())
-
-                token = dict()
-                if len(states) > 1:
-                    for j in range(len(states)):
-                        noff = j - len(states)
-                        if noff >= 0:
-                            noff = j
-                        field_name = self.named_fields.get(str(j),
-                                                           self.named_fields.get(str(noff), str(j)))
-                        token[field_name] = states[j]
-                    tokens.append(token)
-
-                else:
-                    if len(tokens) == 0:
-                        raise Exception("Unexpected empty line ({}) in {}".format(i, tsfile))
-                    examples.append(tokens)
-                    tokens = []
-            if len(tokens) > 0:
-                examples.append(tokens)
-        return examples
+        for i, line in enumerate(_read_lines(tsfile, start, end)):
+            states = re.split("\s", line.strip())
+
+            token = dict()
+            if len(states) > 1:
+                for j in range(len(states)):
+                    noff = j - len(states)
+                    if noff >= 0:
+                        noff = j
+                    field_name = self.named_fields.get(str(j),
+                                                       self.named_fields.get(str(noff), str(j)))
+                    token[field_name] = states[j]
+                tokens.append(token)
+
+            else:
+                if len(tokens) == 0:
+                    raise Exception("Unexpected empty line ({}) in {}".format(i, tsfile))
+                yield tokens
+                tokens = []
+        if len(tokens) > 0:
+            yield tokens
 
 
 def _norm_ext(ext):
@@ -422,30 +942,26 @@ class ParallelSeqReader(SeqPredictReader):
         with codecs.open(file_name, encoding='utf-8', mode='r') as f:
             return [l.strip().split() for l in f]
 
-    def load(self, filename, vocabs, batchsz, shuffle=False, sort_key=None):
+    def load(self, filename, vocabs, batchsz, shuffle=False, sort_key=None, **kwargs):
 
-        ts = []
+        _no_streaming(self, kwargs)
         texts = self.read_examples(filename + self.data)
         tag_texts = self.read_examples(filename + self.tag)
 
         if sort_key is not None and not sort_key.endswith('_lengths'):
             sort_key += '_lengths'
 
-        raw_texts = []
+        num_examples = min(len(texts), len(tag_texts))
+        texts = texts[:num_examples]
+        tag_texts = tag_texts[:num_examples]
+        raw_texts = [[{'text': t, 'y': l} for t, l in zip(example_tokens, tag_tokens)]
+                     for example_tokens, tag_tokens in zip(texts, tag_texts)]
 
-        for i, (example_tokens, tag_tokens) in enumerate(zip(texts, tag_texts)):
-            example = {}
-            for k, vectorizer in self.vectorizers.items():
-                example[k], lengths = vectorizer.run(example_tokens, vocabs[k])
-                if lengths is not None:
-                    example['{}_lengths'.format(k)] = lengths
-            example['y'], lengths = self.label_vectorizer.run(tag_tokens, self.label2index)
-            example['y_lengths'] = lengths
-            example['ids'] = i
-            ts.append(example)
-            raw_texts.append([{'text': t, 'y': l} for t, l in zip(example_tokens, tag_tokens)])
-        examples = baseline.data.DictExamples(ts, do_shuffle=shuffle, sort_key=sort_key)
-        return baseline.data.ExampleDataFeed(examples, batchsz=batchsz, shuffle=shuffle, trim=self.trim, truncate=self.truncate), raw_texts
+        arrays = _run_batch(self.vectorizers, texts, vocabs)
+        arrays['y'], arrays['y_lengths'] = self.label_vectorizer.run_batch(tag_texts, self.label2index)
+        arrays['ids'] = np.arange(num_examples)
+        examples = baseline.data.ColumnarExamples(arrays, do_shuffle=shuffle, sort_key=sort_key)
+        return baseline.data.ExampleDataFeed(examples, batchsz=batchsz, shuffle=shuffle, trim=self.trim, truncate=self.truncate, **kwargs), raw_texts
 
 
 @exporter
@@ -492,9 +1008,11 @@ class TSVSeqLabelReader(SeqLabelReader):
         self.vectorizers = vectorizers
         self.clean_fn = kwargs.get('clean_fn')
         if self.clean_fn is None:
-            self.clean_fn = lambda x: x
+            self.clean_fn = identity_trans_fn
         self.trim = trim
         self.truncate = truncate
+        self.cache_dir = kwargs.get('cache_dir')
+        self.vocab_workers = int(kwargs.get('vocab_workers', 1))
 
     SPLIT_ON = '[\t\s]+'
 
@@ -545,29 +1063,33 @@ class TSVSeqLabelReader(SeqLabelReader):
                 files = filter(os.path.isfile, [os.path.join(base, x) for x in os.listdir(base)])
             else:
                 files = [files]
-        vocab = {k: Counter() for k in self.vectorizers.keys()}
-
-        for file_name in files:
-            if file_name is None:
-                continue
-            with codecs.open(file_name, encoding='utf-8', mode='r') as f:
-                for il, line in enumerate(f):
-                    label, text = TSVSeqLabelReader.label_and_sentence(line, self.clean_fn)
-                    if len(text) == 0:
-                        continue
-
-                    for k, vectorizer in self.vectorizers.items():
-                        vocab_file = vectorizer.count(text)
-                        vocab[k].update(vocab_file)
-
-                    if label not in self.label2index:
-                        self.label2index[label] = label_idx
-                        label_idx += 1
+        files = _expand_all(files)
+        cache_file = _counts_cache_file(self.cache_dir, files, self.vectorizers, reader=self.__class__.__name__,
+                                        clean_fn=_callable_name(self.clean_fn))
+        shards = _file_shards(files, self.vocab_workers)
+        vocab, labels = _count_vocabs(self._count_shard, shards, self.vectorizers, self.vocab_workers, cache_file)
+        for label in labels:
+            if label not in self.label2index:
+                self.label2index[label] = label_idx
+                label_idx += 1
 
         vocab = _filter_vocab(vocab, kwargs.get('min_f', {}))
 
         return vocab, self.get_labels()
 
+    def _count_shard(self, shard, vectorizers):
+        vocab = {k: Counter() for k in vectorizers}
+        labels = Counter()
+        for line in _read_lines(*shard):
+            label, text = TSVSeqLabelReader.label_and_sentence(line, self.clean_fn)
+            if len(text) == 0:
+                continue
+
+            for k, vectorizer in vectorizers.items():
+                vocab[k].update(vectorizer.count(text))
+            labels[label] += 1
+        return vocab, labels
+
     def get_labels(self):
         labels = [''] * len(self.label2index)
         for label, index in self.label2index.items():
@@ -581,55 +1103,69 @@ class TSVSeqLabelReader(SeqLabelReader):
         if sort_key is not None and not sort_key.endswith('_lengths'):
             sort_key += '_lengths'
 
-        examples = []
         texts = []
         with codecs.open(filename, encoding='utf-8', mode='r') as f:
             for il, line in enumerate(f):
                 label, text = TSVSeqLabelReader.label_and_sentence(line, self.clean_fn)
-                texts.append(text)
+                texts.append((label, text))
+        examples = self._run_batch([(label, text) for label, text in texts if len(text) != 0], vocabs)
+        return baseline.data.ExampleDataFeed(baseline.data.ColumnarExamples(examples,
+                                                                            do_shuffle=shuffle,
+                                                                            sort_key=sort_key),
+                                             batchsz=batchsz, shuffle=shuffle, trim=self.trim, truncate=self.truncate), [text for _, text in texts]
+
+    def _run_batch(self, labels_and_texts, vocabs):
+        texts = [text for _, text in labels_and_texts]
+        arrays = _run_batch(self.vectorizers, texts, vocabs)
+        arrays['y'] = np.array([self.label2index[label] for label, _ in labels_and_texts], dtype=int)
+        return arrays
+
+    def _iter_labels_and_sentences(self, filename):
+        with codecs.open(filename, encoding='utf-8', mode='r') as f:
+            for line in f:
+                label, text = TSVSeqLabelReader.label_and_sentence(line, self.clean_fn)
                 if len(text) == 0:
                     continue
-                y = self.label2index[label]
-                example_dict = dict()
-                for k, vectorizer in self.vectorizers.items():
-                    example_dict[k], lengths = vectorizer.run(text, vocabs[k])
-                    if lengths is not None:
-                        example_dict['{}_lengths'.format(k)] = lengths
-
-                example_dict['y'] = y
-                examples.append(example_dict)
-        return baseline.data.ExampleDataFeed(baseline.data.DictExamples(examples,
-                                                                        do_shuffle=shuffle,
-                                                                        sort_key=sort_key),
-                                             batchsz=batchsz, shuffle=shuffle, trim=self.trim, truncate=self.truncate), texts
+                yield label, text
 
     def load(self, filename, vocabs, batchsz, **kwargs):
     
-        shuffle = kwargs.get('shuffle', False)
-        sort_key = kwargs.get('sort_key', None)
+        shuffle = kwargs.pop('shuffle', False)
+        sort_key = kwargs.pop('sort_key', None)
         if sort_key is not None and not sort_key.endswith('_lengths'):
             sort_key += '_lengths'
-    
-        examples = []
-    
-        with codecs.open(filename, encoding='utf-8', mode='r') as f:
-            for il, line in enumerate(f):
-                label, text = TSVSeqLabelReader.label_and_sentence(line, self.clean_fn)
-                if len(text) == 0:
-                    continue
-                y = self.label2index[label]
-                example_dict = dict()
-                for k, vectorizer in self.vectorizers.items():
-                    example_dict[k], lengths = vectorizer.run(text, vocabs[k])
-                    if lengths is not None:
-                        example_dict['{}_lengths'.format(k)] = lengths
-            
-                example_dict['y'] = y
-                examples.append(example_dict)
-        return baseline.data.ExampleDataFeed(baseline.data.DictExamples(examples,
-                                                                        do_shuffle=shuffle,
-                                                                        sort_key=sort_key),
-                                             batchsz=batchsz, shuffle=shuffle, trim=self.trim, truncate=self.truncate)
+
+        if kwargs.pop('streaming', False):
+            _no_bucketing(kwargs)
+            files = _expand_files(filename)
+            if kwargs.get('num_examples') is None:
+                kwargs['num_examples'] = _num_examples(files, self._iter_labels_and_sentences, self.cache_dir,
+                                                       reader=self.__class__.__name__,
+                                                       clean_fn=_callable_name(self.clean_fn))
+
+            def stream_fn(do_shuffle):
+                return _stream_files(files, do_shuffle, self._iter_labels_and_sentences)
+
+            def vectorize_fn(raw):
+                return self._run_batch(raw, vocabs)
+
+            return baseline.data.StreamingDataFeed(stream_fn, vectorize_fn, batchsz, shuffle=shuffle,
+                                                   sort_key=sort_key, trim=self.trim, truncate=self.truncate,
+                                                   **kwargs)
+
+        cache = _examples_cache_dir(self.cache_dir, [filename], self.vectorizers, vocabs,
+                                    reader=self.__class__.__name__, labels=self.label2index,
+                                    clean_fn=_callable_name(self.clean_fn))
+        if cache is not None and baseline.data.MMapExamples.exists(cache):
+            examples = _load_cached_examples(cache, self.vectorizers, shuffle, sort_key)
+        else:
+            examples = self._run_batch(list(self._iter_labels_and_sentences(filename)), vocabs)
+            if cache is not None:
+                _save_cached_examples(cache, examples, self.vectorizers)
+                examples = _load_cached_examples(cache, self.vectorizers, shuffle, sort_key)
+            else:
+                examples = baseline.data.ColumnarExamples(examples, do_shuffle=shuffle, sort_key=sort_key)
+        return baseline.data.ExampleDataFeed(examples, batchsz=batchsz, shuffle=shuffle, trim=self.trim, truncate=self.truncate, **kwargs)
 
 
 @exporter
@@ -639,6 +1175,8 @@ class LineSeqReader(object):
     def __init__(self, vectorizers, trim, **kwargs):
         self.nctx = kwargs['nctx']
         self.vectorizers = vectorizers
+        self.cache_dir = kwargs.get('cache_dir')
+        self.vocab_workers = int(kwargs.get('vocab_workers', 1))
 
     def build_vocab(self, files, **kwargs):
         vocab_file = kwargs.get('vocab_file')
@@ -646,23 +1184,29 @@ class LineSeqReader(object):
             _vocab_allowed(self.vectorizers)
             return _build_vocab_for_col(0, listify(vocab_file), self.vectorizers)
 
-        vocabs = {k: Counter() for k in self.vectorizers.keys()}
-
-        for file in files:
-            if file is None:
-                continue
-
-            with codecs.open(file, encoding='utf-8', mode='r') as f:
-                sentences = []
-                for line in f:
-                    sentences += line.split() + ['<EOS>']
-                for k, vectorizer in self.vectorizers.items():
-                    vocabs[k].update(vectorizer.count(sentences))
+        # Each file is counted as a single sequence so it can only be split between processes by file
+        files = _expand_all(files)
+        cache_file = _counts_cache_file(self.cache_dir, files, self.vectorizers, reader=self.__class__.__name__)
+        shards = _file_shards(files, 1)
+        vocabs, _ = _count_vocabs(self._count_shard, shards, self.vectorizers, self.vocab_workers, cache_file)
 
         vocabs = _filter_vocab(vocabs, kwargs.get('min_f', {}))
         return vocabs
 
-    def load(self, filename, vocabs, batchsz, tgt_key='x'):
+    @staticmethod
+    def _count_shard(shard, vectorizers):
+        sentences = []
+        for line in _read_lines(*shard):
+            sentences += line.split() + ['<EOS>']
+        return {k: vectorizer.count(sentences) for k, vectorizer in vectorizers.items()}, Counter()
+
+    def load(self, filename, vocabs, batchsz, tgt_key='x', **kwargs):
+
+        if kwargs.pop('streaming', False):
+            _no_bucketing(kwargs)
+            kwargs.pop('shuffle_buffer', None)
+            kwargs.pop('num_examples', None)
+            return self._load_streaming(filename, vocabs, batchsz, tgt_key, **kwargs)
 
         x = dict()
         with codecs.open(filename, encoding='utf-8', mode='r') as f:
@@ -676,4 +1220,19 @@ class LineSeqReader(object):
                 shp[0] = valid_lengths
                 x['{}_dims'.format(k)] = tuple(shp)
 
-        return baseline.data.SeqWordCharDataFeed(x, self.nctx, batchsz, tgt_key=tgt_key)
+        return baseline.data.SeqWordCharDataFeed(x, self.nctx, batchsz, tgt_key=tgt_key, **kwargs)
+
+    def _load_streaming(self, filename, vocabs, batchsz, tgt_key, **kwargs):
+        """Read the BPTT batches straight from the files, see `baseline.data.StreamingSeqWordCharDataFeed`"""
+        token_fn = _TokenIndex(_expand_files(filename))
+        # The vectorizers only ever see a chunk of `nctx + 1` tokens
+        vectorizers = {}
+        for k, vectorizer in self.vectorizers.items():
+            vectorizers[k] = copy.copy(vectorizer)
+            vectorizers[k].mxlen = self.nctx + 1
+
+        def vectorize_fn(rows):
+            return {k: vectorizer.run_batch(rows, vocabs[k])[0] for k, vectorizer in vectorizers.items()}
+
+        return baseline.data.StreamingSeqWordCharDataFeed(token_fn, vectorize_fn, token_fn.num_tokens, self.nctx,
+                                                          batchsz, tgt_key=tgt_key, **kwargs)
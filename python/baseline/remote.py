@@ -1,7 +1,13 @@
-from six.moves.http_client import HTTPConnection
+from six.moves.http_client import HTTPConnection, HTTPException
 from six.moves.urllib.parse import urlparse
+from six.moves import queue
 
 import json
+import struct
+import socket
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from baseline.utils import (
     import_user_module, export, optional_params, register, listify
@@ -39,6 +45,146 @@ def verify_example(examples, keys):
         raise ValueError("Data should have keys: {}\n {} are missing.".format(keys, missing_keys))
 
 
+TENSORS_CONTENT_TYPE = 'application/x-baseline-tensors'
+TENSORS_MAGIC = b'BLT1'
+_ALIGN = 8
+
+
+def _padding(n):
+    return -n % _ALIGN
+
+
+@exporter
+def encode_tensors(tensors, **meta):
+    """Pack numpy arrays into the binary wire format
+
+    The payload is `TENSORS_MAGIC`, the length of the header as a little-endian `uint32`, a JSON header and then the
+    raw little-endian bytes of each tensor, each starting on an 8 byte boundary.  The header holds `meta` and the name,
+    dtype, shape and offset (from the end of the header) of each tensor.
+
+    :param tensors: A `dict` of name to array, the order is kept
+    :param meta: Anything else to put in the header, it must be JSON serializable
+    :return: (``bytes``) The payload
+    """
+    specs = []
+    buffers = []
+    offset = 0
+    for name, tensor in tensors.items():
+        tensor = np.asarray(tensor)
+        if tensor.dtype.kind == 'O':
+            tensor = tensor.astype(np.str_)
+        shape = list(tensor.shape)
+        # `ascontiguousarray` makes scalars 1D so keep the shape from before
+        tensor = np.ascontiguousarray(tensor, dtype=tensor.dtype.newbyteorder('<'))
+        specs.append({'name': name, 'dtype': tensor.dtype.str, 'shape': shape, 'offset': offset})
+        buffers.append(tensor.tobytes())
+        buffers.append(b'\0' * _padding(tensor.nbytes))
+        offset += tensor.nbytes + _padding(tensor.nbytes)
+    meta['tensors'] = specs
+    header = json.dumps(meta).encode('utf-8')
+    header += b' ' * _padding(len(TENSORS_MAGIC) + 4 + len(header))
+    return b''.join([TENSORS_MAGIC, struct.pack('<I', len(header)), header] + buffers)
+
+
+@exporter
+def decode_tensors(data):
+    """Unpack a payload made by `encode_tensors`
+
+    The arrays are read-only views of `data` made with `np.frombuffer`, nothing is copied.
+
+    :param data: (``bytes``) The payload
+    :return: An `OrderedDict` of name to array and a `dict` of everything else in the header
+    """
+    if data[:len(TENSORS_MAGIC)] != TENSORS_MAGIC:
+        raise ValueError("This is not a tensor payload")
+    start = len(TENSORS_MAGIC) + 4
+    header_len, = struct.unpack('<I', data[len(TENSORS_MAGIC):start])
+    meta = json.loads(data[start:start + header_len].decode('utf-8'))
+    start += header_len
+    tensors = OrderedDict()
+    for spec in meta.pop('tensors'):
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        count = int(np.prod(shape))
+        tensor = np.frombuffer(data, dtype=dtype, count=count, offset=start + spec['offset'])
+        tensors[spec['name']] = tensor.reshape(shape)
+    return tensors, meta
+
+
+@exporter
+class HTTPConnectionPool(object):
+
+    def __init__(self, hostname, port, pool_size=4, timeout=None):
+        """A thread safe pool of keep-alive HTTP connections to one server
+
+        :param hostname: The server
+        :param port: The port
+        :param pool_size: The most connections to have open at once, more requests wait for a connection to be free
+        :param timeout: The socket timeout for each connection in seconds (defaults to no timeout)
+        """
+        self.hostname = hostname
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self):
+        if self.timeout is None:
+            return HTTPConnection(self.hostname, self.port)
+        return HTTPConnection(self.hostname, self.port, timeout=self.timeout)
+
+    @staticmethod
+    def _send(conn, method, path, body, headers):
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            return response, response.read()
+        except Exception:
+            conn.close()
+            raise
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request over an idle connection, or a new one if none are idle
+
+        :param method: The HTTP method
+        :param path: The path to request
+        :param body: The body of the request
+        :param headers: A `dict` of headers
+        :return: The status and the body of the response
+        """
+        headers = {} if headers is None else headers
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+            if conn is not None:
+                try:
+                    response, data = self._send(conn, method, path, body, headers)
+                except socket.timeout:
+                    raise
+                except (HTTPException, socket.error):
+                    # The server can close a connection while it is idle, so try once more on a new one
+                    conn = None
+            if conn is None:
+                conn = self._connect()
+                response, data = self._send(conn, method, path, body, headers)
+            if response.will_close:
+                conn.close()
+            else:
+                self._idle.put(conn)
+        return response.status, data
+
+    def close(self):
+        """Close all of the idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
 class RemoteModel(object):
     def __init__(
             self,
@@ -110,9 +256,19 @@ class RemoteModelREST(RemoteModel):
             inputs=None,
             version=None,
             return_labels=None,
+            pool_size=4,
+            timeout=None,
+            concurrency=None,
+            wire_format='json',
     ):
         """A remote model with REST transport
 
+        Requests go over a pool of keep-alive connections so they don't pay for a new TCP connection each time.
+
+        With `wire_format='tensors'` the requests and responses are sent as raw arrays (see `encode_tensors`) instead of
+        JSON lists.  No server in baseline reads them, so this is for servers that use `decode_tensors` and
+        `encode_tensors`.  `Service.load` picks it when the bundle's `model.assets` says the server accepts it.
+
         :param remote: The remote endpoint
         :param name:  The name of the model
         :param signature: The model signature
@@ -123,6 +279,11 @@ class RemoteModelREST(RemoteModel):
         :param version: The model version (defaults to None)
         :param return_labels: Whether the remote model returns class indices or the class labels directly. This depends
         on the `return_labels` parameter in exporters
+        :param pool_size: The most connections to keep open to the server (defaults to 4)
+        :param timeout: The socket timeout in seconds (defaults to None, no timeout)
+        :param concurrency: When a batch is sent as several requests, the most to have in flight at once (defaults to
+        `pool_size`)
+        :param wire_format: How to encode the requests and responses, `json` or `tensors` (defaults to `json`)
         """
         super(RemoteModelREST, self).__init__(
             remote, name, signature, labels, beam, lengths_key, inputs, version, return_labels
@@ -134,7 +295,30 @@ class RemoteModelREST(RemoteModel):
         v_str = '/versions/{}'.format(self.version) if self.version is not None else ''
         path = url.path if url.path.endswith("/") else "{}/".format(url.path)
         self.path = '{}v1/models/{}{}:predict'.format(path, self.name, v_str)
-        self.headers = {'Content-type': 'application/json'}
+        if wire_format not in ('json', 'tensors'):
+            raise ValueError("Unknown wire format {}".format(wire_format))
+        self.wire_format = wire_format
+        if wire_format == 'tensors':
+            self.headers = {'Content-type': TENSORS_CONTENT_TYPE, 'Accept': TENSORS_CONTENT_TYPE}
+        else:
+            self.headers = {'Content-type': 'application/json'}
+        self.pool = HTTPConnectionPool(self.hostname, self.port, pool_size, timeout)
+        self.concurrency = pool_size if concurrency is None else concurrency
+        self._fan_out_pool = None
+
+    def fan_out(self, fn, items):
+        """Call `fn` on each item, with up to `concurrency` calls running at once
+
+        :param fn: The function, it is called from worker threads
+        :param items: The items
+        :return: The results, in the same order as `items`
+        """
+        items = list(items)
+        if self.concurrency <= 1 or len(items) <= 1:
+            return [fn(item) for item in items]
+        if self._fan_out_pool is None:
+            self._fan_out_pool = ThreadPool(self.concurrency)
+        return self._fan_out_pool.map(fn, items)
 
     def predict(self, examples, **kwargs):
         """Run prediction over HTTP/REST.
@@ -145,63 +329,88 @@ class RemoteModelREST(RemoteModel):
 
         verify_example(examples, self.input_keys)
 
-        request = self.create_request(examples)
-        conn = HTTPConnection(self.hostname, self.port)
-        conn.request('POST', self.path, json.dumps(request), self.headers)
-        response = conn.getresponse().read()
-        outcomes_list = json.loads(response)
-        if "error" in outcomes_list:
-            raise ValueError("remote server returns error: {0}".format(outcomes_list["error"]))
-        outcomes_list = outcomes_list["outputs"]
+        _, response = self.pool.request('POST', self.path, self.serialize_request(examples), self.headers)
+        outcomes_list = self.parse_response(response)
         outcomes_list = self.deserialize_response(examples, outcomes_list)
         return outcomes_list
 
+    def serialize_request(self, examples):
+        """Encode the examples as the body of a request in the `wire_format`
+
+        :param examples: The input examples
+        :return: (``bytes``) The body
+        """
+        if self.wire_format == 'tensors':
+            return encode_tensors(self.create_tensor_request(examples), signature_name=self.signature)
+        return json.dumps(self.create_request(examples)).encode('utf-8')
+
+    def parse_response(self, response):
+        """Decode the body of a response, the server can always answer in JSON (an error for example)
+
+        :param response: (``bytes``) The body
+        :return: The outputs, a `dict` of name to output or a single output
+        """
+        if response[:len(TENSORS_MAGIC)] == TENSORS_MAGIC:
+            outputs, meta = decode_tensors(response)
+            if 'error' in meta:
+                raise ValueError("remote server returns error: {0}".format(meta['error']))
+            return outputs['outputs'] if list(outputs.keys()) == ['outputs'] else outputs
+        outcomes_list = json.loads(response.decode('utf-8'))
+        if "error" in outcomes_list:
+            raise ValueError("remote server returns error: {0}".format(outcomes_list["error"]))
+        return outcomes_list["outputs"]
+
+    def create_tensor_request(self, examples):
+        """Get the arrays to send when the `wire_format` is `tensors`
+
+        :param examples: The input examples
+        :return: An `OrderedDict` of the inputs, in `input_keys` order, then the lengths
+        """
+        tensors = OrderedDict((k, examples[k]) for k in self.input_keys)
+        if self.lengths_key is not None and self.lengths_key not in tensors:
+            tensors[self.lengths_key] = examples[self.lengths_key]
+        return tensors
+
+    def apredict(self, examples, timeout=None, **kwargs):
+        """A coroutine that runs prediction over HTTP/REST (Python 3 only).
+
+        All of the calls on an event loop share one pool of `pool_size` non-blocking connections.
+
+        :param examples: The input examples
+        :param timeout: A deadline for the request in seconds (defaults to None, no deadline)
+        :return: The outcomes
+        """
+        from baseline.aio import apredict_rest
+        return apredict_rest(self, examples, timeout=timeout)
+
     def deserialize_response(self, examples, predict_response):
-        """Read the JSON response and decode it according to the signature.
+        """Read the response and decode it according to the signature.
+
+        The outputs are turned into arrays all at once, so decoding costs the same for JSON lists and for tensors.
 
         :param examples: Input examples
-        :param predict_response: an HTTP/REST output
+        :param predict_response: an HTTP/REST output, see `parse_response`
         """
         if self.signature == 'suggest_text':
             # s2s returns int values.
-            tensor = np.array(predict_response)
+            tensor = np.asarray(predict_response)
             tensor = tensor.transpose(1, 2, 0)
             return tensor
 
-        num_ex = len(predict_response['classes'])
+        if self.signature == 'embed_text':
+            return np.asarray(predict_response['scores'])
+
+        classes = np.asarray(predict_response['classes'])
+        if not self.return_labels:
+            classes = classes.astype(np.int32, copy=False)
 
         if self.signature == 'tag_text':
-            classes = predict_response['classes']
             lengths = examples[self.lengths_key]
-            result = []
-            for i in range(num_ex):
-                length_i = lengths[i]
-                classes_i = classes[i]
-                if self.return_labels:
-                    d = [np.array(classes_i[j]) for j in range(length_i)]
-                else:
-                    d = [np.array(np.int32(classes_i[j])) for j in range(length_i)]
-                result.append(d)
-
-            return result
+            return [classes[i, :lengths[i]] for i in range(len(classes))]
 
         if self.signature == 'predict_text':
-            scores = predict_response['scores']
-            classes = predict_response['classes']
-            result = []
-            for i in range(num_ex):
-                score_i = scores[i]
-                classes_i = classes[i]
-                if self.return_labels:
-                    d = [(c, np.float32(s)) for c, s in zip(classes_i, score_i)]
-                else:
-                    d = [(np.int32(c), np.float32(s)) for c, s in zip(classes_i, score_i)]
-                result.append(d)
-
-        if self.signature == 'embed_text':
-            result = np.array(predict_response['scores'])
-
-        return result
+            scores = np.asarray(predict_response['scores'], dtype=np.float32)
+            return [list(zip(classes_i, score_i)) for classes_i, score_i in zip(classes, scores)]
 
 
 @exporter
@@ -210,8 +419,8 @@ class RemoteModelGRPC(RemoteModel):
     def __init__(self, remote, name, signature, labels=None, beam=None, lengths_key=None, inputs=None, version=None, return_labels=False):
         """A remote model with gRPC transport
 
-        When using this type of model, there is an external dependency on the `grpc` package, as well as the
-        TF serving protobuf stub files.  There is also currently a dependency on `tensorflow`
+        When using this type of model, there is an external dependency on the `grpc` and `protobuf` packages.  The
+        TF serving messages come from `baseline.serving` so `tensorflow` is not needed.
 
         :param remote: The remote endpoint
         :param name:  The name of the model
@@ -227,14 +436,15 @@ class RemoteModelGRPC(RemoteModel):
         super(RemoteModelGRPC, self).__init__(
             remote, name, signature, labels, beam, lengths_key, inputs, version, return_labels
         )
-        self.predictpb = import_user_module('tensorflow_serving.apis.predict_pb2')
-        self.servicepb = import_user_module('tensorflow_serving.apis.prediction_service_pb2_grpc')
-        self.metadatapb = import_user_module('tensorflow_serving.apis.get_model_metadata_pb2')
+        self.predictpb = import_user_module('baseline.serving')
+        self.servicepb = self.predictpb
         self.grpc = import_user_module('grpc')
         self.channel = self.grpc.insecure_channel(remote)
+        self.stub = self.servicepb.PredictionServiceStub(self.channel)
 
     def decode_output(self, x):
-        return x.decode('ascii') if self.return_labels else np.int32(x)
+        """Decode an array of `classes` from the server"""
+        return np.char.decode(x, 'ascii') if self.return_labels else x.astype(np.int32, copy=False)
 
     def get_labels(self):
         """Return the model's labels
@@ -252,16 +462,22 @@ class RemoteModelGRPC(RemoteModel):
         verify_example(examples, self.input_keys)
 
         request = self.create_request(examples)
-        stub = self.servicepb.PredictionServiceStub(self.channel)
-        outcomes_list = stub.Predict(request)
+        outcomes_list = self.stub.Predict(request)
         outcomes_list = self.deserialize_response(examples, outcomes_list)
 
         return outcomes_list
 
-    def create_request(self, examples):
-        # TODO: Remove TF dependency client side
-        import tensorflow as tf
+    def apredict(self, examples, timeout=None, **kwargs):
+        """A coroutine that runs prediction over a `grpc.aio` channel (Python 3 only)
+
+        :param examples: The input examples
+        :param timeout: A deadline for the request in seconds (defaults to None, no deadline)
+        :return: The outcomes
+        """
+        from baseline.aio import apredict_grpc
+        return apredict_grpc(self, examples, timeout=timeout)
 
+    def create_request(self, examples):
         request = self.predictpb.PredictRequest()
         request.model_spec.name = self.name
         request.model_spec.signature_name = self.signature
@@ -269,20 +485,8 @@ class RemoteModelGRPC(RemoteModel):
             request.model_spec.version.value = self.version
 
         for feature in self.input_keys:
-            if isinstance(examples[feature], np.ndarray):
-                shape = examples[feature].shape
-            else:
-                shape = [1]
-
-            dtype = examples[feature].dtype.type
-            if issubclass(dtype, np.integer): dtype = tf.int32
-            elif issubclass(dtype, np.floating): dtype = tf.float32
-            else: dtype = tf.string
-
-            tensor_proto = tf.contrib.util.make_tensor_proto(examples[feature], shape=shape, dtype=dtype)
-            request.inputs[feature].CopyFrom(
-                tensor_proto
-            )
+            shape = examples[feature].shape if isinstance(examples[feature], np.ndarray) else [1]
+            self.predictpb.make_tensor_proto(examples[feature], request.inputs[feature], shape=shape)
 
         return request
 
@@ -297,49 +501,29 @@ class RemoteModelGRPC(RemoteModel):
         the predict endpoint happens to have the ability to filter output for certain keys, but
         we do not support this currently. There are two keys we want to extract: classes and scores.
 
+        Each output is turned into an array in one call (see `baseline.serving.make_ndarray`) and sliced from there.
+
         :params predict_response: a PredictResponse protobuf object,
                     as defined in tensorflow_serving proto files
         """
-
-        example_len = predict_response.outputs.get('classes').tensor_shape.dim[1].size
-        num_examples = predict_response.outputs.get('classes').tensor_shape.dim[0].size
+        make_ndarray = self.predictpb.make_ndarray
+        outputs = predict_response.outputs
 
         if self.signature == 'suggest_text':
             # s2s returns int values.
-            classes = predict_response.outputs.get('classes')
-            shape = [dim.size for dim in classes.tensor_shape.dim]
-            results = np.reshape(np.array(classes.int_val), shape)
-            results = results.transpose(1, 2, 0)
-            return results
+            return make_ndarray(outputs['classes']).transpose(1, 2, 0)
+
+        if self.signature == 'embed_text':
+            return make_ndarray(outputs['scores'])
+
+        classes = self.decode_output(make_ndarray(outputs['classes']))
 
         if self.signature == 'tag_text':
-            if self.return_labels:
-                classes = predict_response.outputs.get('classes').string_val
-            else:
-                classes = predict_response.outputs.get('classes').int_val
             lengths = examples[self.lengths_key]
-            result = []
-            for i in range(num_examples):
-                length = lengths[i]
-                tmp = [self.decode_output(x) for x in classes[example_len*i:example_len*(i+1)][:length]]
-                result.append(tmp)
-
-            return result
+            return [classes[i, :lengths[i]] for i in range(len(classes))]
 
         if self.signature == 'predict_text':
-            scores = predict_response.outputs.get('scores').float_val
-            if self.return_labels:
-                classes = predict_response.outputs.get('classes').string_val
-            else:
-                classes = predict_response.outputs.get('classes').int_val
-            result = []
             length = len(self.get_labels())
-            for i in range(num_examples):   # wrap in numpy because the local models send that dtype out
-                d = [(self.decode_output(c), np.float32(s)) for c, s in zip(classes[example_len*i:example_len*(i+1)][:length], scores[length*i:length*(i+1)][:length])]
-                result.append(d)
-            return result
-
-        if self.signature == 'embed_text':
-            scores = predict_response.outputs.get('scores')
-            shape = [dim.size for dim in scores.tensor_shape.dim]
-            return np.reshape(np.array(scores.float_val), shape)
+            # wrap in numpy because the local models send that dtype out
+            scores = make_ndarray(outputs['scores']).astype(np.float32, copy=False)[:, :length]
+            return [list(zip(classes_i, scores_i)) for classes_i, scores_i in zip(classes[:, :length], scores)]
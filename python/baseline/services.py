@@ -1,8 +1,12 @@
 import six
 
 import os
+import copy
+import time
 import pickle
-from collections import defaultdict
+import hashlib
+import threading
+from collections import deque, OrderedDict
 import numpy as np
 import baseline
 import logging
@@ -19,6 +23,7 @@ from baseline.utils import (
     load_vocabs,
     lookup_sentence,
     normalize_backend,
+    batch_multinomial,
 )
 from baseline.model import load_model_for
 logger = logging.getLogger('baseline')
@@ -28,13 +33,185 @@ __all__ = []
 exporter = export(__all__)
 
 
+def _with_lens(vectorizer, **lens):
+    """Get a copy of a vectorizer with some of its lengths (`mxlen`, `mxwlen`) changed, or itself if none change"""
+    lens = {k: v for k, v in lens.items() if getattr(vectorizer, k) != v}
+    if not lens:
+        return vectorizer
+    vectorizer = copy.copy(vectorizer)
+    for k, v in lens.items():
+        setattr(vectorizer, k, v)
+    return vectorizer
+
+
+class _CacheLookup(object):
+
+    def __init__(self, cache, keys, hits, misses, examples):
+        self.cache = cache
+        self.keys = keys
+        self.hits = hits
+        self.misses = misses
+        self.examples = {k: v[misses] for k, v in examples.items()} if len(misses) else None
+
+    def fill(self, outcomes):
+        """Add the model's outcomes for the misses to the cache and put them together with the hits
+
+        :param outcomes: What the model returned for `self.examples`, None if there were no misses
+        :return: The outcomes for the whole batch, in order
+        """
+        results = [None] * len(self.keys)
+        for i, value in self.hits.items():
+            results[i] = value
+        for i, outcome in zip(self.misses, outcomes if outcomes is not None else []):
+            results[i] = self.cache.put(self.keys[i], outcome)
+        if self.cache.dtype is not None:
+            return np.stack(results)
+        return results
+
+
+@exporter
+class PredictionCache(object):
+
+    def __init__(self, max_size=1024, ttl=None, dtype=None):
+        """A thread safe LRU cache of model outcomes, keyed on a hash of each vectorized example
+
+        The key covers the padded, vectorized example and the arguments to `model.predict`, so changing the
+        vectorizers (`mxlen` for example) changes the key rather than returning a stale outcome.
+
+        :param max_size: (``int``) The most outcomes to keep, the least recently used are dropped first
+        :param ttl: (``float``) How long an outcome is good for in seconds (defaults to None, forever)
+        :param dtype: When set, each outcome is stored as an array of this type (like `np.float16`) and a batch of them
+            comes back as one array.  This is for models that output arrays like embeddings, the default stores the
+            outcomes as they are.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.dtype = dtype
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Get the number of `hits` and `misses` (counted per example), the `hit_rate` and the `size` of the cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / float(total) if total else 0.0,
+                'size': len(self._entries),
+            }
+
+    @staticmethod
+    def keys(examples, extra=None):
+        """Hash each example in a batch
+
+        :param examples: The vectorized batch, a `dict` of arrays where the first dimension is the batch
+        :param extra: Anything else the outcome depends on, it must have a stable `repr`
+        :return: A key for each example
+        """
+        names = sorted(examples.keys())
+        arrays = [np.ascontiguousarray(examples[name]) for name in names]
+        prefix = repr((names, [(a.dtype.str, a.shape[1:]) for a in arrays], extra)).encode('utf-8')
+        keys = []
+        for i in range(len(arrays[0])):
+            digest = hashlib.sha1(prefix)
+            for array in arrays:
+                digest.update(array[i].tobytes())
+            keys.append(digest.digest())
+        return keys
+
+    def get(self, key):
+        """Get an outcome and mark it as recently used
+
+        :param key: The key
+        :return: The outcome, or None if it isn't cached or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and entry[1] < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Move it to the end (most recently used), `move_to_end` doesn't exist in Python 2
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry[0]
+
+    def put(self, key, value):
+        """Add an outcome, dropping the least recently used one if the cache is full
+
+        :param key: The key
+        :param value: The outcome
+        :return: The outcome as it is stored
+        """
+        if self.dtype is not None:
+            value = np.array(value, dtype=self.dtype)
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def lookup(self, examples, extra=None):
+        """Split a batch into the examples that are cached and the ones that need to go to the model
+
+        :param examples: The vectorized batch
+        :param extra: Anything else the outcome depends on, like the arguments to `model.predict`
+        :return: A lookup, send `lookup.examples` (None when everything was cached) to the model and pass the result
+            to `lookup.fill` to get the outcomes for the whole batch
+        """
+        keys = self.keys(examples, extra)
+        hits = {}
+        misses = []
+        for i, key in enumerate(keys):
+            value = self.get(key)
+            if value is None:
+                misses.append(i)
+            else:
+                hits[i] = value
+        return _CacheLookup(self, keys, hits, np.array(misses, dtype=np.int64), examples)
+
+
 class Service(object):
 
+    # The type to store cached outcomes as, see `PredictionCache`
+    cache_dtype = None
+
     def __init__(self, vocabs=None, vectorizers=None, model=None, preproc='client'):
         self.vectorizers = vectorizers
         self.model = model
         self.vocabs = vocabs
         self.preproc = preproc
+        self.cache = None
+        self.length_buckets = {'mxlen': None, 'mxwlen': None}
+        self._sized_vectorizers = {}
+
+    def enable_cache(self, max_size=1024, ttl=None, dtype=None):
+        """Cache the model's outcomes so repeated inputs don't go to the model again
+
+        Only the examples in a batch that aren't cached are sent to the model.
+
+        :param max_size: (``int``) The most outcomes to keep
+        :param ttl: (``float``) How long an outcome is good for in seconds (defaults to None, forever)
+        :param dtype: The type to store the outcomes as (defaults to `cache_dtype`)
+        :return: The `PredictionCache`, `cache.stats()` has the hit and miss counts
+        """
+        self.cache = PredictionCache(max_size, ttl, self.cache_dtype if dtype is None else dtype)
+        return self.cache
 
     def get_vocab(self, vocab_type='word'):
         return self.vocabs.get(vocab_type)
@@ -51,7 +228,53 @@ class Service(object):
         raise Exception("Undefined task name")
 
     def predict(self, tokens, **kwargs):
-        pass
+        """Run the model on some input
+
+        :param tokens: The input, see `batch_input`
+        :return: The output of the model, formatted by `format_output`
+        """
+        examples, inputs = self.prepare(tokens, **kwargs)
+        model_kwargs = self.model_kwargs(**kwargs)
+        if self.cache is None:
+            outcomes = self.model.predict(examples, **model_kwargs)
+        else:
+            lookup = self.cache.lookup(examples, sorted(model_kwargs.items()))
+            misses = self.model.predict(lookup.examples, **model_kwargs) if lookup.examples is not None else None
+            outcomes = lookup.fill(misses)
+        return self.format_output(outcomes, inputs, **kwargs)
+
+    def apredict(self, tokens, timeout=None, **kwargs):
+        """A coroutine that does the same thing as `predict` for asyncio (Python 3 only)
+
+        A remote model is called on a non-blocking transport, a local model is run in the event loop's executor.
+
+        :param tokens: The input, see `batch_input`
+        :param timeout: A deadline for the call to the model in seconds (defaults to None, no deadline)
+        :return: The output of the model, formatted by `format_output`
+        """
+        from baseline.aio import apredict
+        return apredict(self, tokens, timeout=timeout, **kwargs)
+
+    def prepare(self, tokens, **kwargs):
+        """Turn the input into the batch to send to the model
+
+        :param tokens: The input, see `batch_input`
+        :return: The batch and whatever `format_output` needs to know about the input
+        """
+        raise NotImplementedError
+
+    def model_kwargs(self, **kwargs):
+        """Get the keyword arguments to call `self.model.predict` with"""
+        return {}
+
+    def format_output(self, outcomes, inputs, **kwargs):
+        """Turn what the model returns into the output of `predict`
+
+        :param outcomes: The output of the model
+        :param inputs: The second thing returned by `prepare`
+        :return: The output of `predict`
+        """
+        return outcomes
 
     def batch_input(self, tokens):
         """Turn the input into a consistent format.
@@ -77,6 +300,9 @@ class Service(object):
     def set_vectorizer_lens(self, mxlen, mxwlen):
         """Set the max lengths on the vectorizers if unset.
 
+        This changes the vectorizers, which are shared by every call, so `predict` doesn't use it anymore, it passes
+        the lengths to `vectorize` instead.
+
         :param mxlen: `int`: The max length of an example
         :param mxwlen: `int`: The max length of a word in the batch
         """
@@ -92,6 +318,66 @@ class Service(object):
                 elif self.preproc == 'server' and vectorizer.mxwlen == -1:  # keep the original behavior
                     vectorizer.mxwlen = mxwlen
 
+    def set_length_buckets(self, mxlen='pow2', mxwlen='pow2'):
+        """Pad each batch up to one of a few lengths so the model only ever sees a few shapes
+
+        Each can be a sorted list of lengths, `pow2` for powers of two (up to the length the vectorizer was exported
+        with, if it has one) or None to pad to the longest example in the batch.  A batch longer than the biggest
+        bucket is padded to its own length.
+
+        :param mxlen: The buckets for the length of an example
+        :param mxwlen: The buckets for the length of a word
+        """
+        self.length_buckets = {'mxlen': mxlen, 'mxwlen': mxwlen}
+        self._sized_vectorizers = {}
+
+    def resize_vectorizer(self, vectorizer, attr):
+        """Should the `attr` (`mxlen` or `mxwlen`) of `vectorizer` be set from each batch"""
+        if self.preproc == 'client':
+            return True
+        return getattr(vectorizer, attr) == -1  # keep the original behavior
+
+    def _bucket(self, attr, length, limit):
+        buckets = self.length_buckets.get(attr)
+        if buckets is None:
+            return length
+        if buckets == 'pow2':
+            size = 1 << max(length - 1, 0).bit_length()
+            return max(min(size, limit), length) if limit > 0 else size
+        for size in buckets:
+            if size >= length:
+                return size
+        return length
+
+    def sized_vectorizers(self, mxlen, mxwlen, vectorizers=None):
+        """Get copies of the vectorizers with their lengths set for a batch, the shared ones are never changed
+
+        The copies are kept for each pair of lengths, so with `set_length_buckets` there are only ever a few.
+
+        :param mxlen: `int`: The max length of an example in the batch
+        :param mxwlen: `int`: The max length of a word in the batch
+        :param vectorizers: The vectorizers to size (defaults to `self.vectorizers`)
+        :return: A `dict` of vectorizers like `vectorizers`
+        """
+        vectorizers = self.vectorizers if vectorizers is None else vectorizers
+        key = (mxlen, mxwlen)
+        sized = self._sized_vectorizers.get(key)
+        if sized is None:
+            sized = {}
+            lengths = {'mxlen': mxlen, 'mxwlen': mxwlen}
+            for k, vectorizer in vectorizers.items():
+                lens = {
+                    attr: self._bucket(attr, length, getattr(vectorizer, attr))
+                    for attr, length in lengths.items()
+                    if hasattr(vectorizer, attr) and self.resize_vectorizer(vectorizer, attr)
+                }
+                sized[k] = _with_lens(vectorizer, **lens)
+            # Without buckets there can be a lot of pairs of lengths so don't let this grow forever
+            if len(self._sized_vectorizers) >= 256:
+                self._sized_vectorizers = {}
+            self._sized_vectorizers[key] = sized
+        return sized
+
     def get_vectorizer_lens(self):
         """get the max len from the vectorizers if defined
         """
@@ -105,37 +391,34 @@ class Service(object):
                     mxwlen = vectorizer.mxwlen
         return mxlen, mxwlen
 
-    def vectorize(self, tokens_seq):
+    def vectorize(self, tokens_seq, mxlen=None, mxwlen=None):
         """Turn the input into that batch dict for prediction.
 
         :param tokens_seq: `List[List[str]]`: The input text batch.
+        :param mxlen: `int`: The max length of an example in the batch, see `sized_vectorizers` (defaults to None,
+            use the vectorizers as they are)
+        :param mxwlen: `int`: The max length of a word in the batch
 
         :returns: dict[str] -> np.ndarray: The vectorized batch.
         """
-        examples = defaultdict(list)
-        for i, tokens in enumerate(tokens_seq):
-            for k, vectorizer in self.vectorizers.items():
-                vec, length = vectorizer.run(tokens, self.vocabs[k])
-                examples[k].append(vec)
-                if length is not None:
-                    lengths_key = '{}_lengths'.format(k)
-                    examples[lengths_key].append(length)
-
-        for k in self.vectorizers.keys():
-            examples[k] = np.stack(examples[k])
-            lengths_key = '{}_lengths'.format(k)
-            if lengths_key in examples:
-                examples[lengths_key] = np.stack(examples[lengths_key])
+        examples = {}
+        vectorizers = self.vectorizers if mxlen is None else self.sized_vectorizers(mxlen, mxwlen)
+        for k, vectorizer in vectorizers.items():
+            examples[k], lengths = vectorizer.run_batch(tokens_seq, self.vocabs[k])
+            if lengths is not None:
+                examples['{}_lengths'.format(k)] = lengths
         return examples
 
     @classmethod
     def load(cls, bundle, **kwargs):
         """Load a model from a bundle.
 
-        This can be either a local model or a remote, exported model.
+        This can be either a local model or a remote, exported model.  Pass `cache_size` (and optionally `cache_ttl`
+        and `cache_dtype`) to cache the outcomes, see `enable_cache`.
 
         :returns a Service implementation
         """
+        cache_kwargs = {k: kwargs.pop(k) for k in ('cache_size', 'cache_ttl', 'cache_dtype') if k in kwargs}
         # can delegate
         if os.path.isdir(bundle):
             directory = bundle
@@ -143,7 +426,7 @@ class Service(object):
             directory = unzip_files(bundle)
 
         model_basename = find_model_basename(directory)
-        vocabs = load_vocabs(directory)
+        vocabs = load_vocabs(directory, compiled=True)
         vectorizers = load_vectorizers(directory)
 
         be = normalize_backend(kwargs.get('backend', 'tf'))
@@ -156,9 +439,12 @@ class Service(object):
             model, preproc = Service._create_remote_model(
                 directory, be, remote, name, cls.signature_name(), beam,
                 preproc=kwargs.get('preproc', 'client'),
-                version=kwargs.get('version')
+                version=kwargs.get('version'),
+                pool_size=kwargs.get('pool_size'),
+                timeout=kwargs.get('timeout'),
+                concurrency=kwargs.get('concurrency'),
             )
-            return cls(vocabs, vectorizers, model, preproc)
+            return cls._with_cache(cls(vocabs, vectorizers, model, preproc), **cache_kwargs)
 
         # Currently nothing to do here
         # labels = read_json(os.path.join(directory, model_basename) + '.labels')
@@ -169,7 +455,13 @@ class Service(object):
         except:
             pass
         model = load_model_for(cls.task_name(), model_basename, **kwargs)
-        return cls(vocabs, vectorizers, model, 'client')
+        return cls._with_cache(cls(vocabs, vectorizers, model, 'client'), **cache_kwargs)
+
+    @staticmethod
+    def _with_cache(service, cache_size=None, cache_ttl=None, cache_dtype=None):
+        if cache_size:
+            service.enable_cache(int(cache_size), cache_ttl, cache_dtype)
+        return service
 
     @staticmethod
     def _create_remote_model(directory, backend, remote, name, signature_name, beam, **kwargs):
@@ -181,6 +473,8 @@ class Service(object):
         :name the model name, as defined in tf-serving's model.config
         :signature_name  the signature to use.
         :beam used for s2s and found in the kwargs. We default this and pass it in.
+        :pool_size, timeout, concurrency configure the connections of an HTTP remote, see `RemoteModelREST`
+        An HTTP remote sends `tensors` only if the bundle's metadata lists it in `wire_formats`, otherwise `json`
 
         :returns a RemoteModel
         """
@@ -199,6 +493,10 @@ class Service(object):
         import_user_module('baseline.{}.remote'.format(backend))
         exp_type = 'http' if remote.startswith('http') else 'grpc'
         exp_type = '{}-preproc'.format(exp_type) if preproc == 'server' else exp_type
+        remote_kwargs = {}
+        if exp_type.startswith('http'):
+            remote_kwargs = {k: kwargs[k] for k in ('pool_size', 'timeout', 'concurrency') if kwargs.get(k) is not None}
+            remote_kwargs['wire_format'] = 'tensors' if 'tensors' in assets['metadata'].get('wire_formats', []) else 'json'
         model = create_remote(
             exp_type,
             remote=remote, name=name,
@@ -209,6 +507,7 @@ class Service(object):
             beam=beam,
             return_labels=return_labels,
             version=version,
+            **remote_kwargs
         )
         return model, preproc
 
@@ -236,22 +535,25 @@ class ClassifierService(Service):
         """Take tokens and apply the internal vocab and vectorizers.  The tokens should be either a batch of text
         single utterance of type ``list``
         """
+        return super(ClassifierService, self).predict(tokens, preproc=preproc)
+
+    def prepare(self, tokens, preproc=None):
         if preproc is not None:
             logger.warning("Warning: Passing `preproc` to `ClassifierService.predict` is deprecated.")
         tokens_seq, mxlen, mxwlen = self.batch_input(tokens)
-        self.set_vectorizer_lens(mxlen, mxwlen)
         if self.preproc == "client":
-            examples = self.vectorize(tokens_seq)
+            examples = self.vectorize(tokens_seq, mxlen, mxwlen)
         elif self.preproc == 'server':
             # TODO: here we allow vectorizers even for preproc=server to get `word_lengths`.
             # vectorizers should not be available when preproc=server.
-            featurized_examples = self.vectorize(tokens_seq)
+            featurized_examples = self.vectorize(tokens_seq, mxlen, mxwlen)
             examples = {
                         'tokens': np.array([" ".join(x) for x in tokens_seq]),
                         self.model.lengths_key: featurized_examples[self.model.lengths_key]
             }
+        return examples, None
 
-        outcomes_list = self.model.predict(examples)
+    def format_output(self, outcomes_list, inputs, **kwargs):
         results = []
         for outcomes in outcomes_list:
             if self.return_labels:
@@ -263,6 +565,8 @@ class ClassifierService(Service):
 
 @exporter
 class EmbeddingsService(Service):
+    cache_dtype = np.float32
+
     @classmethod
     def task_name(cls):
         return 'servable_embeddings'
@@ -272,17 +576,19 @@ class EmbeddingsService(Service):
         return 'embed_text'
 
     def predict(self, tokens, preproc=None):
+        return super(EmbeddingsService, self).predict(tokens, preproc=preproc)
+
+    def prepare(self, tokens, preproc=None):
         if preproc is not None:
             logger.warning("Warning: Passing `preproc` to `EmbeddingsService.predict` is deprecated.")
         tokens_seq, mxlen, mxwlen = self.batch_input(tokens)
-        self.set_vectorizer_lens(mxlen, mxwlen)
         if self.preproc == 'client':
-            examples = self.vectorize(tokens_seq)
+            examples = self.vectorize(tokens_seq, mxlen, mxwlen)
         else:
             examples = {
                 'tokens': np.array([" ".join(x) for x in tokens_seq]),
             }
-        return self.model.predict(examples)
+        return examples, None
 
     @classmethod
     def load(cls, bundle, **kwargs):
@@ -395,18 +701,19 @@ class TaggerService(Service):
         :param tokens: (``list``) A list of tokens
 
         """
+        return super(TaggerService, self).predict(tokens, **kwargs)
+
+    def prepare(self, tokens, **kwargs):
         preproc = kwargs.get('preproc', None)
         if preproc is not None:
             logger.warning("Warning: Passing `preproc` to `TaggerService.predict` is deprecated.")
         export_mapping = kwargs.get('export_mapping', {})  # if empty dict argument was passed
         if not export_mapping:
             export_mapping = {'tokens': 'text'}
-        label_field = kwargs.get('label', 'label')
         tokens_seq, mxlen, mxwlen = self.batch_input(tokens)
-        self.set_vectorizer_lens(mxlen, mxwlen)
         # TODO: here we allow vectorizers even for preproc=server to get `word_lengths`.
         # vectorizers should not be available when preproc=server.
-        examples = self.vectorize(tokens_seq)
+        examples = self.vectorize(tokens_seq, mxlen, mxwlen)
         if self.preproc == 'server':
             unfeaturized_examples = {}
             for exporter_field in export_mapping:
@@ -414,9 +721,10 @@ class TaggerService(Service):
                                                                    for y in x]) for x in tokens_seq])
             unfeaturized_examples[self.model.lengths_key] = examples[self.model.lengths_key]  # remote model
             examples = unfeaturized_examples
+        return examples, tokens_seq
 
-        outcomes = self.model.predict(examples)
-
+    def format_output(self, outcomes, tokens_seq, **kwargs):
+        label_field = kwargs.get('label', 'label')
         outputs = []
         for i, outcome in enumerate(outcomes):
             output = []
@@ -448,47 +756,99 @@ class LanguageModelService(Service):
         kwargs['batchsz'] = 1
         return super(LanguageModelService, cls).load(bundle, **kwargs)
 
-    # Do a greedy decode for now, everything else will be super slow
-    def predict(self, tokens, **kwargs):
-        mxlen = kwargs.get('mxlen', 10)
-        mxwlen = kwargs.get('mxwlen', 40)
+    def _vectorize_steps(self, tokens_seq, mxwlen, examples=None):
+        """Vectorize the next steps of a batch of sequences that all have the same number of them
 
+        :param tokens_seq: A list of lists of tokens
+        :param mxwlen: The word length for vectorizers that don't have one
+        :param examples: The vectorized earlier steps, to append to (defaults to None)
+        :return: The vectorized steps
+        """
+        new_examples = {}
         for k, vectorizer in self.vectorizers.items():
-            if hasattr(vectorizer, 'mxlen') and vectorizer.mxlen == -1:
-                vectorizer.mxlen = mxlen
-            if hasattr(vectorizer, 'mxwlen') and vectorizer.mxwlen == -1:
-                vectorizer.mxwlen = mxwlen
-
-        token_buffer = tokens
-        tokens_seq = tokens
-        examples = dict()
-        for i in range(mxlen):
-
-            for k, vectorizer in self.vectorizers.items():
-                vectorizer.mxlen = len(token_buffer)
-                vec, length = vectorizer.run(token_buffer, self.vocabs[k])
-                if k in examples:
-                    examples[k] = np.append(examples[k], vec)
-                else:
-                    examples[k] = vec
+            lens = {'mxlen': len(tokens_seq[0])} if hasattr(vectorizer, 'mxlen') else {}
+            if getattr(vectorizer, 'mxwlen', None) == -1:
+                lens['mxwlen'] = mxwlen
+            vec, lengths = _with_lens(vectorizer, **lens).run_batch(tokens_seq, self.vocabs[k])
+            lengths_key = '{}_lengths'.format(k)
+            if examples is not None:
+                vec = np.concatenate([examples[k], vec], axis=1)
+                if lengths is not None:
+                    lengths = examples[lengths_key] + lengths
+            new_examples[k] = vec
+            if lengths is not None:
+                new_examples[lengths_key] = lengths
+        return new_examples
 
-                if length is not None:
-                    lengths_key = '{}_lengths'.format(k)
-                    if lengths_key in examples:
-                        examples[lengths_key] += length
+    def predict(self, tokens, **kwargs):
+        """Continue a sequence of tokens, or a batch of them, one token at a time
+
+        Models with a `predict_next` (the pytorch ones) keep their state from one step to the next and are only given
+        the newest token, so each step costs the same.  Other models are given the whole sequence again at every step.
+
+        Sequences of different lengths are decoded together: the shared length goes first, then each sequence is fed
+        the rest of its own tokens before it starts to take the predicted ones.
+
+        :param tokens: A list of tokens, or a list of lists of tokens
+        :param mxlen: (``int``) The most tokens to add to a sequence (defaults to 10)
+        :param mxwlen: (``int``) The word length for vectorizers that don't have one (defaults to 40)
+        :param sample: (``bool``) Sample each token instead of taking the most likely one (defaults to False)
+        :param k: (``int``) When sampling, only sample from the `k` most likely tokens (defaults to None, all of them)
+        :param temperature: (``float``) The temperature to sample at (defaults to 1.0)
+        :param stop: The tokens that end a sequence, they are not added to it (defaults to `['<EOS>']`)
+        :return: The sequence with the added tokens, or a list of them for a batch
+        """
+        mxlen = kwargs.get('mxlen', 10)
+        mxwlen = kwargs.get('mxwlen', 40)
+        stop = set(kwargs.get('stop', ['<EOS>']))
+        sample = kwargs.get('sample', False)
+
+        batched = len(tokens) > 0 and isinstance(tokens[0], (list, tuple))
+        tokens_seq = [list(t) for t in tokens] if batched else [list(tokens)]
+        if not all(tokens_seq):
+            raise ValueError('Every sequence needs at least one token to continue')
+        batchsz = len(tokens_seq)
+        shared = min(len(t) for t in tokens_seq)
+        forced = [deque(t[shared:]) for t in tokens_seq]
+        added = [0] * batchsz
+        done = [mxlen <= 0] * batchsz
+
+        incremental = hasattr(self.model, 'predict_next')
+        if incremental:
+            state = self.model.init_decode_state(batchsz)
+        examples = None
+
+        step_tokens = [t[:shared] for t in tokens_seq]
+        while True:
+            if incremental:
+                probs = self.model.predict_next(self._vectorize_steps(step_tokens, mxwlen), state)
+            else:
+                examples = self._vectorize_steps(step_tokens, mxwlen, examples)
+                probs = np.asarray(self.model.predict(examples))
+                probs = probs.reshape((batchsz, -1, probs.shape[-1]))[:, -1]
+            if sample:
+                next_tokens = batch_multinomial(probs, kwargs.get('k'), kwargs.get('temperature', 1.0))
+            else:
+                next_tokens = np.argmax(probs, axis=-1)
+
+            step_tokens = []
+            for i, next_token in enumerate(next_tokens):
+                if forced[i]:
+                    step_tokens.append([forced[i].popleft()])
+                    continue
+                token_str = self.idx_to_token.get(next_token, '<PAD>')
+                if not done[i]:
+                    added[i] += 1
+                    if token_str in stop:
+                        done[i] = True
                     else:
-                        examples[lengths_key] = np.array(length)
-            batch_dict = {k: v.reshape((1,) + v.shape) for k, v in examples.items()}
-            softmax_tokens = self.model.predict(batch_dict)
-            next_token = np.argmax(softmax_tokens, axis=-1)[-1]
-
-            token_str = self.idx_to_token.get(next_token, '<PAD>')
-            if token_str == '<EOS>':
+                        if token_str != '<PAD>':
+                            tokens_seq[i].append(token_str)
+                        done[i] = added[i] >= mxlen
+                step_tokens.append([token_str])
+            if all(done):
                 break
-            if token_str != '<PAD>':
-                tokens_seq += [token_str]
-            token_buffer = [token_str]
-        return tokens_seq
+        return tokens_seq if batched else tokens_seq[0]
 
 
 @exporter
@@ -540,31 +900,32 @@ class EncoderDecoderService(Service):
             if hasattr(vectorizer, 'mxwlen') and vectorizer.mxwlen == -1:
                 vectorizer.mxwlen = mxwlen
 
-    def vectorize(self, tokens_seq):
-        examples = defaultdict(list)
-        for i, tokens in enumerate(tokens_seq):
-            for k, vectorizer in self.src_vectorizers.items():
-                vec, length = vectorizer.run(tokens, self.src_vocabs[k])
-                examples[k] += [vec]
-                if length is not None:
-                    lengths_key = '{}_lengths'.format(k)
-                    examples[lengths_key] += [length]
-
-        for k in self.src_vectorizers.keys():
-            examples[k] = np.stack(examples[k])
-            lengths_key = '{}_lengths'.format(k)
-            if lengths_key in examples:
-                examples[lengths_key] = np.array(examples[lengths_key])
+    def resize_vectorizer(self, vectorizer, attr):
+        return getattr(vectorizer, attr) == -1
+
+    def vectorize(self, tokens_seq, mxlen=None, mxwlen=None):
+        examples = {}
+        vectorizers = self.src_vectorizers
+        if mxlen is not None:
+            vectorizers = self.sized_vectorizers(mxlen, mxwlen, vectorizers)
+        for k, vectorizer in vectorizers.items():
+            examples[k], lengths = vectorizer.run_batch(tokens_seq, self.src_vocabs[k])
+            if lengths is not None:
+                examples['{}_lengths'.format(k)] = lengths
         return examples
 
     def predict(self, tokens, K=1, **kwargs):
+        return super(EncoderDecoderService, self).predict(tokens, K=K, **kwargs)
+
+    def prepare(self, tokens, **kwargs):
         tokens_seq, mxlen, mxwlen = self.batch_input(tokens)
-        self.set_vectorizer_lens(mxlen, mxwlen)
-        examples = self.vectorize(tokens_seq)
+        return self.vectorize(tokens_seq, mxlen, mxwlen), None
 
+    def model_kwargs(self, K=1, **kwargs):
         kwargs['beam'] = int(kwargs.get('beam', K))
-        outcomes = self.model.predict(examples, **kwargs)
+        return kwargs
 
+    def format_output(self, outcomes, inputs, K=1, **kwargs):
         results = []
         B = len(outcomes)
         for i in range(B):
@@ -580,3 +941,195 @@ class EncoderDecoderService(Service):
             if K > 1:
                 results.append(n_best_result)
         return results
+
+
+class _BatchedRequest(object):
+
+    def __init__(self, utterances, kwargs, future):
+        self.utterances = utterances
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued = time.time()
+
+
+@exporter
+class MicroBatchingService(object):
+
+    def __init__(self, service, max_batch_size=32, max_wait_ms=5, num_workers=1):
+        """Put concurrent calls to `service.predict` together and run them as one batch
+
+        Requests wait in a queue until `max_batch_size` examples are waiting or the oldest one has waited for
+        `max_wait_ms`.  The batch goes through `service.predict`, which pads it with `batch_input` and `vectorize` and
+        calls `model.predict` once, then the results are split back up between the callers.  Only requests with the
+        same keyword arguments go in the same batch.
+
+        This works with any `Service` that implements `prepare` (not `LanguageModelService`) and any model, local or
+        remote.  Setting `num_workers` above 1 lets that many batches run at once, which helps when the model is
+        remote and most of the time is spent waiting on the network.
+
+        Needs `concurrent.futures` (Python 3 or the `futures` backport)
+
+        :param service: (``Service``) The service to batch for
+        :param max_batch_size: (``int``) The most examples to put in a batch
+        :param max_wait_ms: (``float``) The longest to hold a request while waiting for others to batch with it
+        :param num_workers: (``int``) How many batches can run at once
+        """
+        from concurrent.futures import Future
+        if six.get_unbound_function(type(service).prepare) is six.get_unbound_function(Service.prepare):
+            raise ValueError("{} can not be micro-batched".format(type(service).__name__))
+        self._future_cls = Future
+        self.service = service
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._metrics_lock = threading.Lock()
+        self.reset_metrics()
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._work, name='micro-batching-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, tokens, **kwargs):
+        """Queue a call to `service.predict`
+
+        :param tokens: The input, one utterance or a batch of them, see `Service.batch_input`
+        :return: A `concurrent.futures.Future` for what `service.predict(tokens, **kwargs)` would return
+        """
+        # Same test as `batch_input`, a list of tokens is one utterance
+        if isinstance(tokens[0], (six.string_types, dict)):
+            utterances = [tokens]
+        else:
+            utterances = list(tokens)
+        future = self._future_cls()
+        with self._cond:
+            if self._closed:
+                raise ValueError("The MicroBatchingService is closed")
+            self._pending.append(_BatchedRequest(utterances, kwargs, future))
+            self._cond.notify()
+        return future
+
+    def predict(self, tokens, timeout=None, **kwargs):
+        """Run `service.predict` on the input as part of a batch, blocking until it is done
+
+        :param tokens: The input, see `Service.batch_input`
+        :param timeout: How long to wait for the result in seconds (defaults to None, wait forever)
+        :return: The output of `service.predict`
+        """
+        return self.submit(tokens, **kwargs).result(timeout)
+
+    def apredict(self, tokens, timeout=None, **kwargs):
+        """A coroutine that does the same thing as `predict` for asyncio (Python 3 only)
+
+        :param tokens: The input, see `Service.batch_input`
+        :param timeout: A deadline in seconds, a request that is still queued at the deadline is dropped (defaults to
+            None, no deadline)
+        :return: The output of `service.predict`
+        """
+        from baseline.aio import await_future
+        return await_future(self.submit(tokens, **kwargs), timeout=timeout)
+
+    def close(self):
+        """Stop taking requests, finish the ones that are queued and stop the workers"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def reset_metrics(self):
+        with self._metrics_lock:
+            self._batches = 0
+            self._requests = 0
+            self._examples = 0
+            self._largest_batch = 0
+            self._total_delay = 0.0
+            self._longest_delay = 0.0
+
+    def metrics(self):
+        """Get the batch sizes and queueing delays since the service started or `reset_metrics` was called
+
+        :return: A `dict` of the number of `batches`, `requests` and `examples`, the average and largest batch size
+            (in examples) and the average and longest time a request waited in the queue (in milliseconds)
+        """
+        with self._metrics_lock:
+            batches = max(self._batches, 1)
+            requests = max(self._requests, 1)
+            return {
+                'batches': self._batches,
+                'requests': self._requests,
+                'examples': self._examples,
+                'avg_batch_size': self._examples / float(batches),
+                'max_batch_size': self._largest_batch,
+                'avg_queue_delay_ms': self._total_delay * 1000.0 / requests,
+                'max_queue_delay_ms': self._longest_delay * 1000.0,
+            }
+
+    def _waiting(self, first):
+        return sum(len(r.utterances) for r in self._pending if r.kwargs == first.kwargs)
+
+    def _take(self, first):
+        batch = []
+        rest = deque()
+        size = 0
+        for request in self._pending:
+            n = len(request.utterances)
+            if request.kwargs == first.kwargs and (not batch or size + n <= self.max_batch_size):
+                batch.append(request)
+                size += n
+            else:
+                rest.append(request)
+        self._pending = rest
+        return batch
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if not self._pending:
+                    if self._closed:
+                        return None
+                    self._cond.wait()
+                    continue
+                first = self._pending[0]
+                wait = first.enqueued + self.max_wait - time.time()
+                if self._closed or wait <= 0 or self._waiting(first) >= self.max_batch_size:
+                    return self._take(first)
+                self._cond.wait(wait)
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # Drop anything that was cancelled while it was waiting
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if batch:
+                self._run(batch)
+
+    def _run(self, batch):
+        start = time.time()
+        utterances = [utterance for request in batch for utterance in request.utterances]
+        delays = [start - request.enqueued for request in batch]
+        with self._metrics_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._examples += len(utterances)
+            self._largest_batch = max(self._largest_batch, len(utterances))
+            self._total_delay += sum(delays)
+            self._longest_delay = max([self._longest_delay] + delays)
+        logger.debug("Micro-batch of %d examples from %d requests, longest wait %.2fms",
+                     len(utterances), len(batch), max(delays) * 1000.0)
+        try:
+            results = self.service.predict(utterances, **batch[0].kwargs)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        offset = 0
+        for request in batch:
+            n = len(request.utterances)
+            request.future.set_result(results[offset:offset + n])
+            offset += n
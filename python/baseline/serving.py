@@ -0,0 +1,245 @@
+"""The TF serving `Predict` messages, without `tensorflow`
+
+The stubs in `tensorflow_serving.apis` import the `TensorProto` from `tensorflow`, which loads all of it.  A client only
+needs a few messages so they are defined here, with the same names and field numbers, in a private descriptor pool
+so they don't clash with `tensorflow` if it is loaded too.  Only the `protobuf` package (and `grpc` to make a stub) is
+needed.
+"""
+import numpy as np
+from google.protobuf import descriptor_pb2, descriptor_pool, wrappers_pb2
+from baseline.utils import export
+
+__all__ = []
+exporter = export(__all__)
+
+_Field = descriptor_pb2.FieldDescriptorProto
+
+DT_INVALID = 0
+DT_FLOAT = 1
+DT_DOUBLE = 2
+DT_INT32 = 3
+DT_UINT8 = 4
+DT_INT16 = 5
+DT_INT8 = 6
+DT_STRING = 7
+DT_INT64 = 9
+DT_BOOL = 10
+DT_UINT16 = 17
+DT_HALF = 19
+DT_UINT32 = 22
+DT_UINT64 = 23
+
+# The numpy type of each `DataType` and the repeated field that holds its values when there is no `tensor_content`
+_NUMPY_TYPES = {
+    DT_FLOAT: (np.dtype('<f4'), 'float_val'),
+    DT_DOUBLE: (np.dtype('<f8'), 'double_val'),
+    DT_INT32: (np.dtype('<i4'), 'int_val'),
+    DT_UINT8: (np.dtype('u1'), 'int_val'),
+    DT_INT16: (np.dtype('<i2'), 'int_val'),
+    DT_INT8: (np.dtype('i1'), 'int_val'),
+    DT_INT64: (np.dtype('<i8'), 'int64_val'),
+    DT_BOOL: (np.dtype('?'), 'bool_val'),
+    DT_UINT16: (np.dtype('<u2'), 'int_val'),
+    DT_HALF: (np.dtype('<f2'), 'half_val'),
+    DT_UINT32: (np.dtype('<u4'), 'uint32_val'),
+    DT_UINT64: (np.dtype('<u8'), 'uint64_val'),
+}
+
+
+def _field(name, number, type_, label=_Field.LABEL_OPTIONAL, type_name=None):
+    field = _Field(name=name, number=number, type=type_, label=label)
+    if type_name is not None:
+        field.type_name = type_name
+    return field
+
+
+def _repeated(name, number, type_):
+    field = _field(name, number, type_, _Field.LABEL_REPEATED)
+    field.options.packed = True
+    return field
+
+
+def _map_entry(name, value_type):
+    entry = descriptor_pb2.DescriptorProto(name=name)
+    entry.field.extend([
+        _field('key', 1, _Field.TYPE_STRING),
+        _field('value', 2, _Field.TYPE_MESSAGE, type_name=value_type),
+    ])
+    entry.options.map_entry = True
+    return entry
+
+
+def _tensor_file():
+    f = descriptor_pb2.FileDescriptorProto(
+        name='tensorflow/core/framework/tensor.proto', package='tensorflow', syntax='proto3'
+    )
+    data_type = f.enum_type.add(name='DataType')
+    for value, name in sorted((v, k) for k, v in globals().items() if k.startswith('DT_')):
+        data_type.value.add(name=name, number=value)
+
+    shape = f.message_type.add(name='TensorShapeProto')
+    dim = shape.nested_type.add(name='Dim')
+    dim.field.extend([_field('size', 1, _Field.TYPE_INT64), _field('name', 2, _Field.TYPE_STRING)])
+    shape.field.extend([
+        _field('dim', 2, _Field.TYPE_MESSAGE, _Field.LABEL_REPEATED, '.tensorflow.TensorShapeProto.Dim'),
+        _field('unknown_rank', 3, _Field.TYPE_BOOL),
+    ])
+
+    tensor = f.message_type.add(name='TensorProto')
+    tensor.field.extend([
+        _field('dtype', 1, _Field.TYPE_ENUM, type_name='.tensorflow.DataType'),
+        _field('tensor_shape', 2, _Field.TYPE_MESSAGE, type_name='.tensorflow.TensorShapeProto'),
+        _field('version_number', 3, _Field.TYPE_INT32),
+        _field('tensor_content', 4, _Field.TYPE_BYTES),
+        _repeated('half_val', 13, _Field.TYPE_INT32),
+        _repeated('float_val', 5, _Field.TYPE_FLOAT),
+        _repeated('double_val', 6, _Field.TYPE_DOUBLE),
+        _repeated('int_val', 7, _Field.TYPE_INT32),
+        _field('string_val', 8, _Field.TYPE_BYTES, _Field.LABEL_REPEATED),
+        _repeated('scomplex_val', 9, _Field.TYPE_FLOAT),
+        _repeated('int64_val', 10, _Field.TYPE_INT64),
+        _repeated('bool_val', 11, _Field.TYPE_BOOL),
+        _repeated('dcomplex_val', 12, _Field.TYPE_DOUBLE),
+        _repeated('uint32_val', 16, _Field.TYPE_UINT32),
+        _repeated('uint64_val', 17, _Field.TYPE_UINT64),
+    ])
+    return f
+
+
+def _predict_file():
+    f = descriptor_pb2.FileDescriptorProto(
+        name='tensorflow_serving/apis/predict.proto', package='tensorflow.serving', syntax='proto3',
+        dependency=['google/protobuf/wrappers.proto', 'tensorflow/core/framework/tensor.proto'],
+    )
+    model_spec = f.message_type.add(name='ModelSpec')
+    model_spec.field.extend([
+        _field('name', 1, _Field.TYPE_STRING),
+        _field('version', 2, _Field.TYPE_MESSAGE, type_name='.google.protobuf.Int64Value'),
+        _field('signature_name', 3, _Field.TYPE_STRING),
+    ])
+
+    request = f.message_type.add(name='PredictRequest')
+    request.nested_type.extend([_map_entry('InputsEntry', '.tensorflow.TensorProto')])
+    request.field.extend([
+        _field('model_spec', 1, _Field.TYPE_MESSAGE, type_name='.tensorflow.serving.ModelSpec'),
+        _field('inputs', 2, _Field.TYPE_MESSAGE, _Field.LABEL_REPEATED, '.tensorflow.serving.PredictRequest.InputsEntry'),
+        _field('output_filter', 3, _Field.TYPE_STRING, _Field.LABEL_REPEATED),
+    ])
+
+    response = f.message_type.add(name='PredictResponse')
+    response.nested_type.extend([_map_entry('OutputsEntry', '.tensorflow.TensorProto')])
+    response.field.extend([
+        _field('model_spec', 2, _Field.TYPE_MESSAGE, type_name='.tensorflow.serving.ModelSpec'),
+        _field('outputs', 1, _Field.TYPE_MESSAGE, _Field.LABEL_REPEATED, '.tensorflow.serving.PredictResponse.OutputsEntry'),
+    ])
+    return f
+
+
+def _message_classes(pool, names):
+    try:
+        from google.protobuf.message_factory import GetMessageClass
+    except ImportError:
+        from google.protobuf.message_factory import MessageFactory
+        GetMessageClass = MessageFactory(pool).GetPrototype
+    return [GetMessageClass(pool.FindMessageTypeByName(name)) for name in names]
+
+
+def _build_pool():
+    pool = descriptor_pool.DescriptorPool()
+    wrappers = descriptor_pb2.FileDescriptorProto()
+    wrappers_pb2.DESCRIPTOR.CopyToProto(wrappers)
+    for f in (wrappers, _tensor_file(), _predict_file()):
+        pool.AddSerializedFile(f.SerializeToString())
+    return pool
+
+
+_POOL = _build_pool()
+TensorShapeProto, TensorProto, ModelSpec, PredictRequest, PredictResponse = _message_classes(_POOL, [
+    'tensorflow.TensorShapeProto',
+    'tensorflow.TensorProto',
+    'tensorflow.serving.ModelSpec',
+    'tensorflow.serving.PredictRequest',
+    'tensorflow.serving.PredictResponse',
+])
+__all__.extend(['TensorShapeProto', 'TensorProto', 'ModelSpec', 'PredictRequest', 'PredictResponse'])
+
+
+@exporter
+class PredictionServiceStub(object):
+
+    def __init__(self, channel):
+        """The `Predict` method of `tensorflow.serving.PredictionService`
+
+        :param channel: A `grpc` (or `grpc.aio`) channel
+        """
+        self.Predict = channel.unary_unary(
+            '/tensorflow.serving.PredictionService/Predict',
+            request_serializer=PredictRequest.SerializeToString,
+            response_deserializer=PredictResponse.FromString,
+        )
+
+
+@exporter
+def make_tensor_proto(values, tensor_proto=None, shape=None):
+    """Fill a `TensorProto` from an array
+
+    Integers are sent as `DT_INT32`, floats as `DT_FLOAT` and everything else as `DT_STRING`.  Numbers go in
+    `tensor_content` as one buffer.
+
+    :param values: The array
+    :param tensor_proto: The `TensorProto` to fill (defaults to a new one)
+    :param shape: The shape to give the tensor (defaults to the shape of `values`)
+    :return: The `TensorProto`
+    """
+    tensor_proto = TensorProto() if tensor_proto is None else tensor_proto
+    values = np.asarray(values)
+    shape = values.shape if shape is None else shape
+    for size in shape:
+        tensor_proto.tensor_shape.dim.add(size=size)
+    if values.dtype.kind in 'iu':
+        tensor_proto.dtype = DT_INT32
+        tensor_proto.tensor_content = np.ascontiguousarray(values, dtype='<i4').tobytes()
+    elif values.dtype.kind == 'f':
+        tensor_proto.dtype = DT_FLOAT
+        tensor_proto.tensor_content = np.ascontiguousarray(values, dtype='<f4').tobytes()
+    else:
+        tensor_proto.dtype = DT_STRING
+        tensor_proto.string_val.extend(
+            v if isinstance(v, bytes) else str(v).encode('utf-8') for v in values.ravel().tolist()
+        )
+    return tensor_proto
+
+
+@exporter
+def make_ndarray(tensor_proto):
+    """Turn a `TensorProto` into an array
+
+    A `tensor_content` buffer becomes an array in one call with `np.frombuffer`, so does a repeated numeric field.
+    Strings come back as a `bytes` array.
+
+    :param tensor_proto: The `TensorProto`
+    :return: The array
+    """
+    shape = tuple(dim.size for dim in tensor_proto.tensor_shape.dim)
+    size = int(np.prod(shape))
+    if tensor_proto.dtype == DT_STRING:
+        values = np.array(list(tensor_proto.string_val), dtype=np.bytes_)
+    elif tensor_proto.dtype not in _NUMPY_TYPES:
+        raise ValueError("Can't make an array from a tensor with DataType {}".format(tensor_proto.dtype))
+    else:
+        dtype, field = _NUMPY_TYPES[tensor_proto.dtype]
+        if tensor_proto.tensor_content:
+            return np.frombuffer(tensor_proto.tensor_content, dtype=dtype, count=size).reshape(shape)
+        field_values = getattr(tensor_proto, field)
+        if field == 'half_val':
+            values = np.array(field_values, dtype=np.uint16).view(dtype)
+        else:
+            values = np.array(field_values, dtype=dtype)
+    if values.size == size:
+        return values.reshape(shape)
+    # Like tensorflow, a tensor where every value is the same can store just one of them
+    if values.size == 1:
+        return np.full(shape, values[0], dtype=values.dtype)
+    if values.size == 0:
+        return np.zeros(shape, dtype=values.dtype)
+    raise ValueError("The tensor has {} values but its shape is {}".format(values.size, shape))
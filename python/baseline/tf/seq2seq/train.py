@@ -13,7 +13,7 @@ from baseline.utils import (
     convert_seq2seq_preds,
 )
 from baseline.train import Trainer, create_trainer, register_trainer, register_training_func
-from baseline.bleu import bleu
+from baseline.metrics import BleuAccumulator
 from baseline.tf.tfy import SET_TRAIN_FLAG, create_session
 
 
@@ -106,16 +106,17 @@ class Seq2SeqTrainerTf(Trainer):
     def _evaluate(self, es, reporting_fns):
         """Run the model with beam search and report Bleu."""
         pg = create_progress_bar(len(es))
-        preds = []
-        golds = []
+        bleu = BleuAccumulator()
         start = time.time()
         for batch_dict in pg(es):
             tgt = batch_dict.pop('tgt')
             tgt_lens = batch_dict.pop('tgt_lengths')
             pred = [p[0] for p in self.model.predict(batch_dict)]
-            preds.extend(convert_seq2seq_preds(pred, self.tgt_rlut))
-            golds.extend(convert_seq2seq_golds(tgt, tgt_lens, self.tgt_rlut))
-        metrics = {'bleu': bleu(preds, golds)[0]}
+            bleu.update(
+                convert_seq2seq_preds(pred, self.tgt_rlut),
+                convert_seq2seq_golds(tgt, tgt_lens, self.tgt_rlut)
+            )
+        metrics = bleu.get_all_metrics()
         self.report(
             0, metrics, start, 'Test', 'EPOCH', reporting_fns
         )
@@ -129,8 +130,7 @@ class Seq2SeqTrainerTf(Trainer):
         total_loss = 0
         total_toks = 0
         metrics = {}
-        preds = []
-        golds = []
+        bleu = BleuAccumulator()
 
         start = time.time()
         pg = create_progress_bar(len(vs))
@@ -142,11 +142,13 @@ class Seq2SeqTrainerTf(Trainer):
             total_loss += lossv * toks
             total_toks += toks
 
-            preds.extend(convert_seq2seq_preds(top_preds.T, self.tgt_rlut))
-            golds.extend(convert_seq2seq_golds(batch_dict['tgt'], batch_dict['tgt_lengths'], self.tgt_rlut))
+            bleu.update(
+                convert_seq2seq_preds(top_preds.T, self.tgt_rlut),
+                convert_seq2seq_golds(batch_dict['tgt'], batch_dict['tgt_lengths'], self.tgt_rlut)
+            )
 
         metrics = self.calc_metrics(total_loss, total_toks)
-        metrics['bleu'] = bleu(preds, golds)[0]
+        metrics.update(bleu.get_all_metrics())
         self.report(
             self.valid_epochs, metrics, start,
             phase, 'EPOCH', reporting_fns
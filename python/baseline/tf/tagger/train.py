@@ -6,9 +6,10 @@ import numpy as np
 import tensorflow as tf
 from baseline.tf.optz import optimizer
 from baseline.progress import create_progress_bar
-from baseline.utils import to_spans, f_score, listify, revlut, get_model_file, write_sentence_conll, get_metric_cmp
+from baseline.utils import SpanExtractor, f_score, listify, revlut, get_model_file, write_sentence_conll, get_metric_cmp
 from baseline.train import EpochReportingTrainer, create_trainer, register_trainer, register_training_func
-from baseline.utils import span_f1, per_entity_f1, conlleval_output
+from baseline.utils import conlleval_output
+from baseline.metrics import SpanF1Accumulator
 from baseline.tf.tfy import reload_lower_layers
 
 logger = logging.getLogger('baseline')
@@ -21,47 +22,40 @@ class TaggerEvaluatorTf(object):
         self.idx2label = revlut(model.labels)
         self.span_type = span_type
         logger.info('Setting span type %s', self.span_type)
+        self.spans = SpanExtractor(self.idx2label, self.span_type)
         self.verbose = verbose
 
     def process_batch(self, batch_dict, handle=None, txts=None):
 
         guess = self.model.predict(batch_dict)
-        sentence_lengths = batch_dict[self.model.lengths_key]
+        sentence_lengths = np.asarray(batch_dict[self.model.lengths_key])
         ids = batch_dict['ids']
         truth = batch_dict['y']
-        correct_labels = 0
-        total_labels = 0
+        # The guesses are cut to their lengths, truth is padded
+        guess_n = np.zeros_like(truth)
+        for b, sentence in enumerate(guess):
+            assert(sentence_lengths[b] == len(sentence))
+            guess_n[b, :len(sentence)] = sentence
+
+        mask = np.arange(truth.shape[1]) < sentence_lengths[:, np.newaxis]
+        correct_labels = np.sum((guess_n == truth) & mask)
+        total_labels = np.sum(sentence_lengths)
 
         # For fscore
-        gold_chunks = []
-        pred_chunks = []
-
-        # For each sentence
-        for b in range(len(guess)):
-            length = sentence_lengths[b]
-            assert(length == len(guess[b]))
-            sentence = guess[b]
-            # truth[b] is padded, cutting at :length gives us back true length
-            gold = truth[b][:length]
-            correct_labels += np.sum(np.equal(sentence, gold))
-            total_labels += length
-
-            gold_chunks.append(set(to_spans(gold, self.idx2label, self.span_type, self.verbose)))
-            pred_chunks.append(set(to_spans(sentence, self.idx2label, self.span_type, self.verbose)))
-
-            # Should we write a file out?  If so, we have to have txts
-            if handle is not None:
-                id = ids[b]
-                txt = txts[id]
-                write_sentence_conll(handle, sentence, gold, txt, self.idx2label)
+        span_counts = self.spans.count(truth, guess_n, sentence_lengths)
+
+        # Should we write a file out?  If so, we have to have txts
+        if handle is not None:
+            for b, length in enumerate(sentence_lengths):
+                txt = txts[ids[b]]
+                write_sentence_conll(handle, guess[b], truth[b][:length], txt, self.idx2label)
 
-        return correct_labels, total_labels, gold_chunks, pred_chunks
+        return correct_labels, total_labels, span_counts
 
     def test(self, ts, conll_output=None, txts=None, **kwargs):
 
         total_correct = total_sum = 0
-        gold_spans = []
-        pred_spans = []
+        span_metrics = SpanF1Accumulator(self.idx2label, self.span_type)
 
         steps = len(ts)
         pg = create_progress_bar(steps)
@@ -73,18 +67,17 @@ class TaggerEvaluatorTf(object):
 
         try:
             for batch_dict in pg(ts):
-                correct, count, golds, guesses = self.process_batch(batch_dict, handle, txts)
+                correct, count, counts = self.process_batch(batch_dict, handle, txts)
                 total_correct += correct
                 total_sum += count
-                gold_spans.extend(golds)
-                pred_spans.extend(guesses)
+                span_metrics.merge(counts)
 
             total_acc = total_correct / float(total_sum)
             # Only show the fscore if requested
-            metrics['f1'] = span_f1(gold_spans, pred_spans)
+            metrics.update(span_metrics.get_all_metrics())
             metrics['acc'] = total_acc
             if self.verbose:
-                conll_metrics = per_entity_f1(gold_spans, pred_spans)
+                conll_metrics = span_metrics.get_per_entity_metrics()
                 conll_metrics['acc'] = total_acc * 100
                 conll_metrics['tokens'] = total_sum
                 logger.info(conlleval_output(conll_metrics))
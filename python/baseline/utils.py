@@ -20,6 +20,10 @@ from functools import partial, update_wrapper, wraps
 import numpy as np
 import addons
 import collections
+try:
+    from collections.abc import Mapping, MappingView, Sequence
+except ImportError:
+    from collections import Mapping, MappingView, Sequence
 
 __all__ = []
 logger = logging.getLogger('baseline')
@@ -440,10 +444,9 @@ def web_cleanup(word):
 
 @exporter
 def is_sequence(x):
-    import collections
     if isinstance(x, six.string_types):
         return False
-    return isinstance(x, (collections.Sequence, collections.MappingView))
+    return isinstance(x, (Sequence, MappingView))
 
 
 @exporter
@@ -700,6 +703,30 @@ def beam_multinomial(k, probs):
     return idx[sample_idx]
 
 
+@exporter
+def batch_multinomial(probs, k=None, temperature=1.0):
+    """Sample an index from each row of a batch of distributions, a batched `beam_multinomial`
+
+    :param probs: (``np.ndarray``) A `[B, V]` batch of probability distributions
+    :param k: (``int``) Only sample from the `k` most likely indices of each row (defaults to None, sample from all)
+    :param temperature: (``float``) Sharpen (below 1) or flatten (above 1) the distributions before sampling
+    :return: (``np.ndarray``) The `[B]` sampled indices
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    rows = np.arange(len(probs))[:, np.newaxis]
+    idx = None
+    if k is not None and k < probs.shape[1]:
+        idx = np.argpartition(probs, probs.shape[1] - k, axis=1)[:, -k:]
+        probs = probs[rows, idx]
+    if temperature != 1.0:
+        logits = np.log(np.maximum(probs, 1e-30)) / temperature
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+    cdf = np.cumsum(probs, axis=1)
+    draws = (cdf < np.random.rand(len(probs), 1) * cdf[:, -1:]).sum(axis=1)
+    draws = np.minimum(draws, probs.shape[1] - 1)
+    return draws if idx is None else idx[rows[:, 0], draws]
+
+
 @exporter
 def fill_y(nc, yidx):
     """Convert a `B` sparse array to a dense one, to expand labels
@@ -1377,6 +1404,116 @@ def to_chunks_iobes(sequence, verbose=False, delim="@"):
     return chunks
 
 
+# The kinds of label, as `to_chunks` and `to_chunks_iobes` see them
+_SPAN_O, _SPAN_B, _SPAN_I, _SPAN_E, _SPAN_S = range(5)
+
+
+def _span_kind(label, iobes):
+    if iobes:
+        for kind, prefix in ((_SPAN_B, 'B-'), (_SPAN_S, 'S-'), (_SPAN_I, 'I-'), (_SPAN_E, 'E-')):
+            if label.startswith(prefix):
+                return kind, label.replace(prefix, '')
+        return _SPAN_O, None
+    if label.startswith('I-'):
+        return _SPAN_I, label.replace('I-', '')
+    if label == 'O':
+        return _SPAN_O, None
+    # Anything else starts a chunk, like `to_chunks` does
+    return _SPAN_B, label.replace('B-', '')
+
+
+def _label_array(labels, width):
+    """Make a `[B, T]` array (`T` at least `width`) out of an array or a list of label sequences of different lengths"""
+    if isinstance(labels, np.ndarray) and labels.ndim == 2 and labels.shape[1] >= width:
+        return labels
+    array = np.zeros((len(labels), width), dtype=np.int64)
+    for i, row in enumerate(labels):
+        row = np.asarray(row)[:width]
+        array[i, :len(row)] = row
+    return array
+
+
+@exporter
+class SpanExtractor(object):
+
+    def __init__(self, idx2label, span_type='iob'):
+        """Find the chunks in whole batches of label ids, without turning them into strings
+
+        The chunks are the ones `to_spans` finds, but as `(type, start, end)` integers rather than strings like
+        `LOC@3@4`.  The chunks of every sentence in a batch are found at once with array operations.
+
+        :param idx2label: `Dict[int] -> str` A mapping for integers to tag names.
+        :param span_type: `str` The tagging scheme.
+        """
+        iobes = span_type == 'iobes'
+        size = max(idx2label.keys()) + 1
+        self.kinds = np.zeros(size, dtype=np.int8)
+        self.type_ids = np.zeros(size, dtype=np.int64)
+        self.types = []
+        type_index = {}
+        for idx, label in idx2label.items():
+            kind, name = _span_kind(label, iobes)
+            self.kinds[idx] = kind
+            if name is not None:
+                if name not in type_index:
+                    type_index[name] = len(self.types)
+                    self.types.append(name)
+                self.type_ids[idx] = type_index[name]
+
+    def extract(self, labels, lengths):
+        """Find the chunks of a batch of label sequences
+
+        :param labels: `np.ndarray` The `[B, T]` label ids, or a list of `B` sequences of them.
+        :param lengths: `np.ndarray` The `[B]` lengths of the sequences.
+
+        :returns: `Tuple[np.ndarray]` The sentence, type, start and (exclusive) end of each chunk, in the order
+            they appear.
+        """
+        lengths = np.asarray(lengths).reshape(-1)
+        width = int(lengths.max()) if len(lengths) else 0
+        labels = _label_array(labels, width)[:, :width]
+        valid = np.arange(width) < lengths[:, np.newaxis]
+        labels = np.where(valid, labels, 0)
+        kinds = np.where(valid, self.kinds[labels], _SPAN_O)
+        types = self.type_ids[labels]
+        in_chunk = kinds != _SPAN_O
+        # Whether the label at `t` carries on the chunk of `t - 1`
+        joins = np.zeros_like(valid)
+        opened = (kinds[:, :-1] == _SPAN_B) | (kinds[:, :-1] == _SPAN_I)
+        carries = (kinds[:, 1:] == _SPAN_I) | (kinds[:, 1:] == _SPAN_E)
+        joins[:, 1:] = opened & carries & (types[:, 1:] == types[:, :-1])
+        starts = in_chunk & ~joins
+        ends = in_chunk.copy()
+        ends[:, :-1] &= ~joins[:, 1:]
+        rows, start_idx = np.nonzero(starts)
+        _, end_idx = np.nonzero(ends)
+        return rows, types[rows, start_idx], start_idx, end_idx + 1
+
+    def count(self, golds, preds, lengths):
+        """Count the gold, predicted and matching chunks of each type in a batch
+
+        :param golds: `np.ndarray` The `[B, T]` gold label ids, or a list of `B` sequences of them.
+        :param preds: `np.ndarray` The `[B, T]` predicted label ids, or a list of `B` sequences of them.
+        :param lengths: `np.ndarray` The `[B]` lengths of the sequences.
+
+        :returns: `np.ndarray` A `[3, len(self.types)]` array with the number of chunks of each type that are in
+            both, the number of gold chunks and the number of predicted chunks.
+        """
+        counts = np.zeros((3, len(self.types)), dtype=np.int64)
+        if not self.types:
+            return counts
+        lengths = np.asarray(lengths).reshape(-1)
+        width = int(lengths.max()) + 1 if len(lengths) else 1
+        keys = []
+        for i, labels in enumerate((golds, preds)):
+            rows, types, starts, ends = self.extract(labels, lengths)
+            counts[i + 1] = np.bincount(types, minlength=len(self.types))
+            keys.append(((rows * width + starts) * width + ends) * len(self.types) + types)
+        overlap = np.intersect1d(keys[0], keys[1], assume_unique=True)
+        counts[0] = np.bincount(overlap % len(self.types), minlength=len(self.types))
+        return counts
+
+
 @exporter
 def span_f1(golds, preds):
     """Calculate Span level F1 score.
@@ -1408,7 +1545,6 @@ def per_entity_f1(golds, preds, delim="@"):
         `conlleval_output`. `acc` and `tokens` (the token level accuracy
         and the number of tokens respectively) need to be added.
     """
-    metrics = {}
     overlap = Counter()
     gold_total = Counter()
     pred_total = Counter()
@@ -1430,6 +1566,46 @@ def per_entity_f1(golds, preds, delim="@"):
             ent = o.split(delim)[0]
             pred_total[ent] += 1
             types.add(ent)
+    return _per_entity_metrics(overlap, gold_total, pred_total, types)
+
+
+@exporter
+def span_f1_from_counts(overlap, gold_total, pred_total):
+    """Calculate Span level F1 score from counts of chunks, like the ones `SpanExtractor.count` gives.
+
+    :param overlap: `np.ndarray` The number of chunks of each type that are both gold and predicted.
+    :param gold_total: `np.ndarray` The number of gold chunks of each type.
+    :param pred_total: `np.ndarray` The number of predicted chunks of each type.
+
+    :returns: `float` The f1 score, the same as `span_f1` on the chunks that were counted.
+    """
+    return f_score(int(np.sum(overlap)), int(np.sum(gold_total)), int(np.sum(pred_total)))
+
+
+@exporter
+def per_entity_f1_from_counts(overlap, gold_total, pred_total, types):
+    """Calculate Span level F1 with break downs per entity type from counts of chunks.
+
+    :param overlap: `np.ndarray` The number of chunks of each type that are both gold and predicted.
+    :param gold_total: `np.ndarray` The number of gold chunks of each type.
+    :param pred_total: `np.ndarray` The number of predicted chunks of each type.
+    :param types: `List[str]` The name of each type, like `SpanExtractor.types`.
+
+    :returns: `dict` The same metrics as `per_entity_f1` on the chunks that were counted.
+    """
+    overlaps = Counter({'total': int(np.sum(overlap))})
+    golds = Counter({'total': int(np.sum(gold_total))})
+    preds = Counter({'total': int(np.sum(pred_total))})
+    seen = set()
+    for t, o, g, p in zip(types, overlap, gold_total, pred_total):
+        if g or p:
+            overlaps[t], golds[t], preds[t] = int(o), int(g), int(p)
+            seen.add(t)
+    return _per_entity_metrics(overlaps, golds, preds, seen)
+
+
+def _per_entity_metrics(overlap, gold_total, pred_total, types):
+    metrics = {}
     metrics['overlap'] = overlap['total']
     metrics['gold_total'] = gold_total['total']
     metrics['pred_total'] = pred_total['total']
@@ -1573,27 +1749,107 @@ def save_vectorizers(basedir, vectorizers, name='vectorizers'):
     write_json(vectorizer_modules, module_file)
 
 
+@exporter
+class CompiledVocab(dict):
+    """A read-only vocab that can be saved and loaded quickly.
+
+    Lookups are plain `dict` lookups, so it can be used anywhere a vocab is.  On top of that it has a dense table from
+    unicode code point to id for its single char keys (`char_table`) so the char vectorizers can look up a whole batch
+    of chars with one gather, and it is stored as two flat arrays (the keys as one block of utf-8 and the ids) which
+    load much faster than JSON for large vocabs.  Ids are whatever the vocab had so the `Offsets` stay where they are.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('A CompiledVocab can not be changed')
+
+    __setitem__ = __delitem__ = update = pop = popitem = setdefault = clear = _read_only
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    @property
+    def char_table(self):
+        """A dense `np.array` from code point to id over the single char keys, unknown chars get `<UNK>` (or -1)"""
+        table = self.__dict__.get('_char_table')
+        if table is None:
+            chars = [(ord(k), v) for k, v in self.items() if isinstance(k, six.text_type) and len(k) == 1]
+            table = np.full(max(c for c, _ in chars) + 1 if chars else 0, self.get('<UNK>', -1), dtype=np.int64)
+            for c, v in chars:
+                table[c] = v
+            self.__dict__['_char_table'] = table
+        return table
+
+    def save(self, filename):
+        """Save the vocab in the binary format
+
+        :param filename: (``str``) Where to save it, an `.npz` file
+        :raises ValueError: If a key is not a string or contains a null char
+        """
+        keys = list(self.keys())
+        if not all(isinstance(k, six.string_types) for k in keys):
+            raise ValueError('Only vocabs with string keys can be compiled')
+        blob = u'\x00'.join(k if isinstance(k, six.text_type) else k.decode('utf-8') for k in keys).encode('utf-8')
+        if blob.count(b'\x00') != max(len(keys) - 1, 0):
+            raise ValueError('Only vocabs without null chars in their keys can be compiled')
+        ids = np.array([self[k] for k in keys], dtype=np.int64)
+        np.savez(filename, keys=np.frombuffer(blob, dtype=np.uint8), ids=ids)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a vocab saved with `save`
+
+        :param filename: (``str``) The `.npz` file
+        :return: (``CompiledVocab``) The vocab
+        """
+        return cls(_read_compiled_vocab(filename))
+
+
+def _read_compiled_vocab(filename):
+    """Read the `(key, id)` pairs of a vocab saved by `CompiledVocab.save`"""
+    with np.load(filename) as data:
+        keys = data['keys'].tobytes().decode('utf-8')
+        ids = data['ids'].tolist()
+    return list(zip(keys.split(u'\x00'), ids)) if ids else []
+
+
 @exporter
 def save_vocabs(basedir, embeds_or_vocabs, name='vocabs'):
+    """Save each vocab as `{name}-{key}-{pid}.json` and, when its keys allow it, in the faster binary format as
+    `{name}-{key}-{pid}.npz` next to it (see `CompiledVocab.save`)
+    """
     for k, embeds_or_vocabs in embeds_or_vocabs.items():
         save_md = '{}/{}-{}-{}.json'.format(basedir, name, k, os.getpid())
         # Its a vocab
-        if isinstance(embeds_or_vocabs, collections.Mapping):
-            write_json(embeds_or_vocabs, save_md)
+        if isinstance(embeds_or_vocabs, Mapping):
+            vocab = embeds_or_vocabs
         # Type is embeds
         else:
-            write_json(embeds_or_vocabs.vocab, save_md)
+            vocab = embeds_or_vocabs.vocab
+        write_json(vocab, save_md)
+        try:
+            CompiledVocab(vocab).save('{}/{}-{}-{}.npz'.format(basedir, name, k, os.getpid()))
+        except ValueError as e:
+            logger.warning('Not compiling vocab %s: %s', k, e)
 
 
 @exporter
-def load_vocabs(directory):
-    vocab_fnames = find_files_with_prefix(directory, 'vocabs')
+def load_vocabs(directory, compiled=False):
+    """Load the vocabs saved by `save_vocabs`, reading the `.npz` version of each when it is there
+
+    :param directory: (``str``) The directory the vocabs were saved in
+    :param compiled: (``bool``) Return read-only `CompiledVocab`s instead of plain `dict`s, these let the char
+        vectorizers look up a whole batch of chars at once
+    :return: (``dict``) The vocabs by key
+    """
+    vocab_fnames = sorted(find_files_with_prefix(directory, 'vocabs'), key=lambda f: not f.endswith('.npz'))
     vocabs = {}
     for f in vocab_fnames:
-        logger.info(f)
         k = f.split('-')[-2]
-        vocab = read_json(f)
-        vocabs[k] = vocab
+        if k in vocabs:
+            continue
+        logger.info(f)
+        vocab = _read_compiled_vocab(f) if f.endswith('.npz') else read_json(f)
+        vocabs[k] = CompiledVocab(vocab) if compiled else dict(vocab)
     return vocabs
 
 
@@ -1779,6 +2035,31 @@ def convert_seq2seq_preds(indices, rlut, subword_fix=lambda x: x):
     return preds
 
 
+@exporter
+def trim_seq2seq_ids(indices, lengths=None):
+    """Cut the indices of sentences down to the tokens, like a bleu corpus but without converting them to words.
+
+    The sentences stop at the first `<EOS>` and `<PAD>` and `<GO>` are removed, as `lookup_sentence` does.
+
+    :param indices: The indices of the sentences. Should be in the shape
+        `[B, T]`. Iterating though axis=1 should yield ints.
+    :param lengths: The length of the sentences, if `None` they are only cut
+        at `<EOS>`.
+
+    :returns: List[np.ndarray] The indices of the tokens in each sentence
+    """
+    trimmed = []
+    for i, idx in enumerate(indices):
+        idx = np.asarray(idx, dtype=np.int64)
+        if lengths is not None:
+            idx = idx[:lengths[i]]
+        eos = np.flatnonzero(idx == Offsets.EOS)
+        if len(eos) > 0:
+            idx = idx[:eos[0]]
+        trimmed.append(idx[(idx != Offsets.PAD) & (idx != Offsets.GO)])
+    return trimmed
+
+
 @exporter
 def undo_bpe(seq):
     """Undo the BPE splits to make Bleu comparable.
@@ -1,6 +1,11 @@
 import numpy as np
+from itertools import chain, islice
 from baseline.utils import export, optional_params, listify, register, Offsets
 import collections
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 
 __all__ = []
@@ -16,6 +21,25 @@ class Vectorizer(object):
     def run(self, tokens, vocab):
         pass
 
+    def run_batch(self, tokens_batch, vocab):
+        """Vectorize a batch of examples into a single array.
+
+        The default stacks `run` over the batch, subclasses fill one preallocated array instead.
+
+        :param tokens_batch: A list of examples, each a list of tokens
+        :param vocab: The vocab to look the tokens up in
+        :return: The vectors stacked in a ``[B, ...]`` array and an array of the ``B`` lengths (or ``None``)
+        """
+        vecs = []
+        lengths = []
+        for tokens in tokens_batch:
+            vec, length = self.run(tokens, vocab)
+            vecs.append(vec)
+            lengths.append(length)
+        if not vecs:
+            return np.zeros((0,) + tuple(self.get_dims()), dtype=int), np.zeros(0, dtype=int)
+        return np.stack(vecs), None if lengths[0] is None else np.array(lengths)
+
     def count(self, tokens):
         pass
 
@@ -40,6 +64,60 @@ def identity_trans_fn(x):
     return x
 
 
+def _lookup_rows(rows, vocab):
+    """Look up rows of atoms in a vocab, looking up each distinct atom in the batch once.
+
+    Atoms that are not in the vocab get `<UNK>`.  If the vocab has no `<UNK>` a row stops at its first unknown
+    atom, the same as `AbstractVectorizer._next_element`
+
+    :param rows: A list of lists of atoms
+    :param vocab: The vocab
+    :return: The ids of all of the rows, concatenated, and the length of each row
+    """
+    lengths = np.array([len(row) for row in rows], dtype=int)
+    unk = vocab.get('<UNK>', -1)
+    table = {atom: vocab.get(atom, unk) for atom in set(chain.from_iterable(rows))}
+    ids = np.fromiter(map(table.__getitem__, chain.from_iterable(rows)), dtype=int, count=lengths.sum())
+    if unk == -1 and (ids == -1).any():
+        rows = np.split(ids, np.cumsum(lengths)[:-1]) if len(rows) else []
+        rows = [row[:np.argmax(row == -1)] if (row == -1).any() else row for row in rows]
+        lengths = np.array([len(row) for row in rows], dtype=int)
+        ids = np.concatenate(rows) if rows else ids
+    return ids, lengths
+
+
+def _fill(ids, lengths, shape):
+    """Copy the concatenated rows `ids` into the front of each row of a zero padded array of `shape`
+
+    :param ids: The rows, concatenated along the first axis, each row must fit in `shape[1]`
+    :param lengths: The length of each row
+    :param shape: The shape of the output, ``[B, T, ...]``
+    :return: The padded array
+    """
+    vec = np.zeros(shape, dtype=int)
+    vec[np.arange(shape[1]) < lengths[:, np.newaxis]] = ids
+    return vec
+
+
+def _fill_rows(rows, shape):
+    """Copy variable length rows into the front of a zero padded array, cutting them off at `shape[1]`
+
+    :param rows: A list of ``B`` arrays, each of shape ``[L, ...]``
+    :param shape: The shape of the output, ``[B, T, ...]``
+    :return: The padded array and the (cut off) length of each row
+    """
+    lengths = np.array([min(len(row), shape[1]) for row in rows], dtype=int)
+    if not rows:
+        return np.zeros(shape, dtype=int), lengths
+    return _fill(np.concatenate([row[:shape[1]] for row in rows]), lengths, shape), lengths
+
+
+def _ragged_arange(lengths):
+    """The position of every element within its row, for rows of `lengths`, concatenated"""
+    starts = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - np.repeat(starts, lengths)
+
+
 @exporter
 class AbstractVectorizer(Vectorizer):
 
@@ -99,6 +177,18 @@ class Token1DVectorizer(AbstractVectorizer):
             return vec1d, None
         return vec1d, valid_length
 
+    def run_batch(self, tokens_batch, vocab):
+
+        if self.mxlen < 0:
+            self.mxlen = self.max_seen
+
+        ids, lengths = _lookup_rows([list(islice(self.iterable(tokens), self.mxlen)) for tokens in tokens_batch], vocab)
+        vec = _fill(ids, lengths, (len(tokens_batch), self.mxlen))
+        if self.time_reverse:
+            return vec[:, ::-1].copy(), None
+        # `run` reports a length of 1 for an empty example
+        return vec, np.maximum(lengths, 1)
+
     def get_dims(self):
         return self.mxlen,
 
@@ -123,6 +213,14 @@ class GOVectorizer(Vectorizer):
         vec1d[valid_length+1] = Offsets.EOS
         return vec1d, valid_length + 2
 
+    def run_batch(self, tokens_batch, vocab):
+        vec, lengths = self.vectorizer.run_batch(tokens_batch, vocab)
+        go = np.full((len(vec), 1), Offsets.GO, dtype=vec.dtype)
+        pad = np.full((len(vec), 1), Offsets.PAD, dtype=vec.dtype)
+        vec = np.concatenate([go, vec, pad], axis=1)
+        vec[np.arange(len(vec)), lengths + 1] = Offsets.EOS
+        return vec, lengths + 2
+
     def get_dims(self):
         return self.vectorizer.get_dims()[0] + 2,
 
@@ -165,6 +263,49 @@ class AbstractCharVectorizer(AbstractVectorizer):
                 yield vocab.get(ch, OOV)
             yield EOW
 
+    def _batch_words(self, tokens_batch):
+        """Collect the distinct words of a batch
+
+        :param tokens_batch: A list of examples, each a list of tokens
+        :return: The distinct words, the index into them of every token in the batch and the number of tokens in each
+            example
+        """
+        index = {}
+        word_idx = []
+        num_words = []
+        for tokens in tokens_batch:
+            idx = [index.setdefault(token, len(index)) for token in self.iterable(tokens)]
+            word_idx.extend(idx)
+            num_words.append(len(idx))
+        words = [None] * len(index)
+        for word, i in index.items():
+            words[i] = word
+        return words, np.array(word_idx, dtype=int), np.array(num_words, dtype=int)
+
+    def _char_ids(self, words, vocab):
+        """Look up the chars of all of the words at once
+
+        If the vocab has a `char_table` (see `baseline.utils.CompiledVocab`) this is a single gather over the code
+        points of the words, otherwise each distinct char is looked up in the vocab once.
+
+        :param words: A list of words
+        :param vocab: The vocab
+        :return: The char ids of the words, concatenated, and the length of each word
+        """
+        OOV = vocab['<UNK>']
+        lengths = np.array([len(word) for word in words], dtype=int)
+        chars = u''.join(words)
+        table = getattr(vocab, 'char_table', None)
+        if table is not None and len(table):
+            try:
+                points = np.frombuffer(chars.encode('utf-32-le'), dtype='<u4').astype(np.int64)
+                if len(points) == lengths.sum():
+                    return np.where(points < len(table), table[np.minimum(points, len(table) - 1)], OOV), lengths
+            except UnicodeError:
+                pass
+        lut = {ch: vocab.get(ch, OOV) for ch in set(chars)}
+        return np.fromiter(map(lut.__getitem__, chars), dtype=int, count=len(chars)), lengths
+
 
 @exporter
 @register_vectorizer(name='char2d')
@@ -225,6 +366,52 @@ class Char2DVectorizer(AbstractCharVectorizer):
         valid_length = i
         return vec2d, valid_length
 
+    def _split_word(self, atoms, EOW):
+        """Lay out the char ids of one word as rows of the output, cutting it at `mxwlen` the same way as `run`"""
+        words = []
+        word = []
+        over = False
+        for atom in atoms:
+            if over:
+                if atom == EOW:
+                    over = False
+                continue
+            if atom == EOW or len(word) == self.mxwlen:
+                over = atom != EOW
+                words.append(word)
+                word = []
+            else:
+                word.append(atom)
+        vec2d = np.zeros((len(words), self.mxwlen), dtype=int)
+        for i, word in enumerate(words):
+            vec2d[i, :len(word)] = word
+        return vec2d
+
+    def run_batch(self, tokens_batch, vocab):
+
+        if self.mxlen < 0:
+            self.mxlen = self.max_seen_tok
+        if self.mxwlen < 0:
+            self.mxwlen = self.max_seen_char
+
+        EOW = vocab.get('<EOW>', vocab.get(' ', Offsets.PAD))
+        shape = (len(tokens_batch), self.mxlen, self.mxwlen)
+        words, word_idx, num_words = self._batch_words(tokens_batch)
+        ids, word_lengths = self._char_ids(words, vocab)
+        if (ids == EOW).any():
+            # A char that maps to `EOW` ends its word early, so let `_split_word` lay out the words
+            starts = np.cumsum(word_lengths) - word_lengths
+            pieces = [self._split_word(list(ids[s:s + n]) + [EOW], EOW) for s, n in zip(starts, word_lengths)]
+            offsets = np.cumsum(num_words) - num_words
+            empty = np.zeros((0, self.mxwlen), dtype=int)
+            rows = [np.concatenate([empty] + [pieces[w] for w in word_idx[o:o + n]]) for o, n in zip(offsets, num_words)]
+            return _fill_rows(rows, shape)
+        # One row per distinct word, then gather the rows of each example
+        keep = _ragged_arange(word_lengths) < self.mxwlen
+        table = _fill(ids[keep], np.minimum(word_lengths, self.mxwlen), (len(words), self.mxwlen))
+        lengths = np.minimum(num_words, self.mxlen)
+        return _fill(table[word_idx[_ragged_arange(num_words) < self.mxlen]], lengths, shape), lengths
+
     def get_dims(self):
         return self.mxlen, self.mxwlen
 
@@ -282,6 +469,29 @@ class Char1DVectorizer(AbstractCharVectorizer):
             return vec1d, None
         return vec1d, i + 1
 
+    def run_batch(self, tokens_batch, vocab):
+
+        if self.mxlen < 0:
+            self.mxlen = self.max_seen_tok
+
+        EOW = vocab.get('<EOW>', vocab.get(' ', Offsets.PAD))
+        words, word_idx, num_words = self._batch_words(tokens_batch)
+        ids, word_lengths = self._char_ids(words, vocab)
+        # Lay out every distinct word followed by `EOW`, then gather the words of each example
+        word_lengths = word_lengths + 1
+        starts = np.cumsum(word_lengths) - word_lengths
+        flat = np.full(word_lengths.sum(), EOW, dtype=int)
+        flat[np.repeat(starts, word_lengths - 1) + _ragged_arange(word_lengths - 1)] = ids
+        token_lengths = word_lengths[word_idx]
+        atoms = flat[np.repeat(starts[word_idx], token_lengths) + _ragged_arange(token_lengths)]
+        totals = np.bincount(np.repeat(np.arange(len(tokens_batch)), num_words), weights=token_lengths,
+                             minlength=len(tokens_batch)).astype(int)
+        lengths = np.minimum(totals, self.mxlen)
+        vec = _fill(atoms[_ragged_arange(totals) < self.mxlen], lengths, (len(tokens_batch), self.mxlen))
+        if self.time_reverse:
+            return vec[:, ::-1].copy(), None
+        return vec, lengths
+
     def get_dims(self):
         return self.mxlen,
 
@@ -322,6 +532,17 @@ class TextNGramVectorizer(Token1DVectorizer):
             return vec2d, None
         return vec2d, lengths
 
+    def run_batch(self, tokens_batch, vocab):
+        if self.mxlen < 0:
+            self.mxlen = self.max_seen
+        zp = self.get_padding()
+        rows = [list(islice(self.iterable(zp + tokens + zp), self.mxlen)) for tokens in tokens_batch]
+        ids, lengths = _lookup_rows(rows, vocab)
+        vec = _fill(ids, lengths, (len(tokens_batch), self.mxlen))
+        if self.time_reverse:
+            return vec[:, ::-1].copy(), None
+        return vec, np.array([min(self.mxlen, len(tokens)) for tokens in tokens_batch], dtype=int)
+
 
 @register_vectorizer(name='dict-ngram')
 class DictTextNGramVectorizer(TextNGramVectorizer):
@@ -342,7 +563,7 @@ class DictTextNGramVectorizer(TextNGramVectorizer):
 
     def iterable(self, tokens):
         nt = len(tokens)
-        if isinstance(tokens[0], collections.Mapping):
+        if isinstance(tokens[0], Mapping):
             token_list = [self._tx(tok[self.fields[0]]) for tok in tokens]
         else:
             token_list = [self._tx(tok) for tok in tokens]
@@ -1,22 +1,124 @@
 import io
+import os
+import json
 import logging
+import hashlib
 import collections
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 import contextlib
 import copy
 import numpy as np
-from baseline.utils import export, write_json, read_config_file, Offsets
+from baseline.utils import export, write_json, read_config_file, Offsets, CompiledVocab
 from baseline.mime_type import mime_type
 __all__ = []
 exporter = export(__all__)
 logger = logging.getLogger('baseline')
 
 
+_BLOCK_SIZE = 1 << 24
+
+
 def norm_weights(word_vectors):
     norms = np.linalg.norm(word_vectors, axis=1, keepdims=True)
     norms = (norms == 0) + norms
     return word_vectors / norms
 
 
+def _capacity(vsz, known_vocab, keep_unused):
+    """An upper bound on the rows needed for the `Offsets`, the vectors read from a file and the random vectors for the
+    rest of `known_vocab`"""
+    return Offsets.OFFSET + (vsz if keep_unused else 0) + (len(known_vocab) if known_vocab else 0)
+
+
+def _grow(weights, rows):
+    """Make sure there is room for `rows` vectors in `weights`, resizing it in place"""
+    if rows > len(weights):
+        weights.resize((max(rows, 2 * len(weights)), weights.shape[1]), refcheck=False)
+
+
+def _stack_vectors(word_vectors, dsz):
+    """Copy a list of vectors into a new matrix, after room for the `Offsets`"""
+    weights = np.zeros((Offsets.OFFSET + len(word_vectors), dsz), dtype=np.float32)
+    for i, vec in enumerate(word_vectors, Offsets.OFFSET):
+        weights[i] = vec
+    return weights
+
+
+def _word2vec_rows(f, vsz, width, block_size=_BLOCK_SIZE):
+    """Scan the entries of a binary word2vec file, reading it in large blocks
+
+    :param f: The file, positioned after the header
+    :param vsz: (`int`) The number of entries
+    :param width: (`int`) The size of a vector in bytes
+    :param block_size: (`int`) How much to read at a time
+    :return: A generator of ``(word, block, offset)``, the vector for `word` is the `width` bytes at `offset` in `block`
+    """
+    block = b''
+    start = 0
+    for _ in range(vsz):
+        end = block.find(b' ', start)
+        while end == -1 or end + 1 + width > len(block):
+            more = f.read(block_size)
+            if not more:
+                raise ValueError('The word2vec file ended after fewer than {} entries'.format(vsz))
+            block = block[start:] + more
+            start = 0
+            end = block.find(b' ')
+        # Only strip out normal space and \n not other spaces which are words.
+        yield block[start:end].decode('utf-8').strip(' \n'), block, end + 1
+        start = end + 1 + width
+
+
+@exporter
+def file_key(filename):
+    """Identify a file by its path, size and modification time, for keying caches of things built from it
+
+    :param filename: (`str`) The file
+    :return: A JSON serializable `list` that changes when the file does
+    """
+    stat = os.stat(filename)
+    return [os.path.realpath(filename), stat.st_size, stat.st_mtime]
+
+
+def _vectors_cache_file(filename, cache_dir):
+    """Get where the converted copy of an embeddings file goes, keyed on its path, size and modification time"""
+    key = json.dumps(file_key(filename)).encode('utf-8')
+    return os.path.join(os.path.expanduser(cache_dir), 'vectors-{}'.format(hashlib.sha1(key).hexdigest()))
+
+
+def _save_atomic(filename, save_fn):
+    """Write a file under a name only this process uses and then move it into place
+
+    A reader never sees a partly written file, and processes that write the same file at the same time each write
+    their own copy, the last rename wins.
+
+    :param filename: (`str`) Where the file goes
+    :param save_fn: A function that writes the file to an open binary file object
+    """
+    tmp = '{}.tmp-{}'.format(filename, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            save_fn(f)
+        os.rename(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _shared_embeddings_file(cache_dir, key):
+    """Get where the shared copy of some embeddings goes
+
+    :param cache_dir: (`str`) The directory of the store
+    :param key: (`dict`) Everything the embeddings are built from, it must be json-able
+    :return: (`str`) The base name of the files
+    """
+    key = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(os.path.expanduser(cache_dir), 'shared-{}'.format(key))
+
+
 @exporter
 def write_word2vec_file(filename, vocab, word_vectors):
     """Write out a binary word2vec file
@@ -36,7 +138,7 @@ def write_word2vec_file(filename, vocab, word_vectors):
 
     offset = 0
     # Check for case where we have a dict and possibly magic values to prune
-    if isinstance(vocab, collections.Mapping):
+    if isinstance(vocab, Mapping):
         vocab_copy = copy.deepcopy(vocab)
 
         for v in Offsets.VALUES:
@@ -105,7 +207,11 @@ class WordEmbeddingsModel(EmbeddingsModel):
             self.vsz = md['vsz']
             self.dsz = md['dsz']
         if 'weights_file' in kwargs:
-            self.weights = np.load(kwargs['weights_file']).get('arr_0')
+            if kwargs['weights_file'].endswith('.npy'):
+                # A raw matrix is mapped rather than read so every process using it shares the same pages
+                self.weights = np.load(kwargs['weights_file'], mmap_mode='c')
+            else:
+                self.weights = np.load(kwargs['weights_file']).get('arr_0')
 
         if self.weights is not None:
             if self.vsz is None:
@@ -119,6 +225,8 @@ class WordEmbeddingsModel(EmbeddingsModel):
 
         elif self.vsz is not None and self.dsz is not None:
             self.weights = np.zeros((self.vsz, self.dsz))
+        if self.dsz is not None:
+            self.nullv = np.zeros(self.dsz, dtype=np.float32)
 
     def get_dsz(self):
         return self.dsz
@@ -149,6 +257,60 @@ class WordEmbeddingsModel(EmbeddingsModel):
         return self.lookup(word, nullifabsent=False)
 
 
+@exporter
+def save_shared_embeddings(embeddings, basename):
+    """Save the vocab and weights of embeddings so other processes can map them with `load_shared_embeddings`
+
+    :param embeddings: (`EmbeddingsModel`) The embeddings
+    :param basename: (`str`) The base name of the files, a `-vocab.npz` and a `.npy`
+    """
+    # The matrix goes last since it is what readers look for
+    _save_atomic(basename + '-vocab.npz', CompiledVocab(embeddings.get_vocab()).save)
+    _save_atomic(basename + '.npy', lambda f: np.save(f, np.asarray(embeddings.weights, dtype=np.float32)))
+
+
+@exporter
+def load_shared_embeddings(basename):
+    """Load embeddings saved with `save_shared_embeddings`
+
+    The weights are memory mapped copy-on-write, so all of the processes that load the same embeddings share one copy
+    of them in memory (until one of them writes to its weights, which only changes its own copy).
+
+    :param basename: (`str`) The base name of the files
+    :return: (`WordEmbeddingsModel`) The embeddings
+    """
+    vocab = dict(CompiledVocab.load(basename + '-vocab.npz'))
+    return WordEmbeddingsModel(vocab=vocab, weights_file=basename + '.npy')
+
+
+@exporter
+def share_embeddings(build_fn, cache_dir, key):
+    """Build embeddings once and share them between every process that asks for the same ones
+
+    The first process to ask calls `build_fn` and saves the result to `cache_dir`, it and every later process then map
+    the saved weights instead of holding their own copy.
+
+    :param build_fn: A function that builds the `EmbeddingsModel`
+    :param cache_dir: (`str`) Where to keep the shared embeddings
+    :param key: (`dict`) Everything the embeddings are built from, embeddings with the same `key` are shared
+    :return: (`WordEmbeddingsModel`) The embeddings
+    """
+    basename = _shared_embeddings_file(cache_dir, key)
+    if not os.path.exists(basename + '.npy'):
+        embeddings = build_fn()
+        try:
+            os.makedirs(os.path.dirname(basename))
+        except OSError:
+            pass
+        try:
+            save_shared_embeddings(embeddings, basename)
+        except (IOError, OSError, ValueError) as e:
+            logger.warning('Could not share the embeddings at %s: %s', basename, e)
+            return embeddings
+        logger.info('Shared the embeddings at %s', basename)
+    return load_shared_embeddings(basename)
+
+
 @exporter
 class PretrainedEmbeddingsModel(WordEmbeddingsModel):
 
@@ -163,12 +325,11 @@ class PretrainedEmbeddingsModel(WordEmbeddingsModel):
         # Set the start offset to one past the last special token
         idx = Offsets.OFFSET
 
-        word_vectors, self.dsz, known_vocab, idx = self._read_vectors(filename, idx, known_vocab, keep_unused, **kwargs)
+        weights, self.dsz, known_vocab, idx = self._read_vectors(filename, idx, known_vocab, keep_unused, **kwargs)
         self.nullv = np.zeros(self.dsz, dtype=np.float32)
-        special_tokens = [self.nullv]
+        weights[0] = self.nullv
         for i in range(1, len(Offsets.VALUES)):
-            special_tokens.append(np.random.uniform(-uw, uw, self.dsz).astype(np.float32))
-        word_vectors = special_tokens + word_vectors
+            weights[i] = np.random.uniform(-uw, uw, self.dsz).astype(np.float32)
         # Add "well-known" values to the vocab
         for i, name in enumerate(Offsets.VALUES):
             self.vocab[name] = i
@@ -177,13 +338,16 @@ class PretrainedEmbeddingsModel(WordEmbeddingsModel):
             # Remove "well-known" values
             for name in Offsets.VALUES:
                 known_vocab.pop(name, 0)
-            unknown = {v: cnt for v, cnt in known_vocab.items() if cnt > 0}
+            unknown = [v for v, cnt in known_vocab.items() if cnt > 0]
+            _grow(weights, idx + len(unknown))
             for v in unknown:
-                word_vectors.append(np.random.uniform(-uw, uw, self.dsz).astype(np.float32))
+                weights[idx] = np.random.uniform(-uw, uw, self.dsz).astype(np.float32)
                 self.vocab[v] = idx
                 idx += 1
 
-        self.weights = np.array(word_vectors)
+        # The readers leave spare rows at the end, this gives them back without a copy
+        weights.resize((idx, self.dsz), refcheck=False)
+        self.weights = weights
         if normalize is True:
             self.weights = norm_weights(self.weights)
 
@@ -191,6 +355,15 @@ class PretrainedEmbeddingsModel(WordEmbeddingsModel):
         assert self.weights.dtype == np.float32
 
     def _read_vectors(self, filename, idx, known_vocab, keep_unused, **kwargs):
+        """Read the vectors for the words we want from an embeddings file
+
+        If there is a `cache_dir` the whole file is converted to a vocab and a raw matrix there the first time it is
+        read, and later reads pick the vectors out of a memory mapped copy of the matrix.
+
+        :return: A matrix with the vectors from `Offsets.OFFSET` up to `idx`, leaving room for the `Offsets` at the
+            front and possibly spare rows at the end, the `dsz`, the `known_vocab` with the counts for the words that
+            were found zeroed, and the `idx` after the last vector read
+        """
         use_mmap = bool(kwargs.get('use_mmap', False))
         read_fn = self._read_word2vec_file
         is_glove_file = mime_type(filename) == 'text/plain'
@@ -202,28 +375,88 @@ class PretrainedEmbeddingsModel(WordEmbeddingsModel):
         elif is_glove_file:
             read_fn = self._read_text_file
 
-        return read_fn(filename, idx, known_vocab, keep_unused)
+        cache_dir = kwargs.get('cache_dir')
+        if cache_dir is None:
+            return read_fn(filename, idx, known_vocab, keep_unused)
+
+        cache = _vectors_cache_file(filename, cache_dir)
+        if os.path.exists(cache + '.npy') and os.path.exists(cache + '-vocab.npz'):
+            logger.info('Reading vectors for %s from %s', filename, cache)
+            rows = CompiledVocab.load(cache + '-vocab.npz')
+            vectors = np.load(cache + '.npy', mmap_mode='r')
+        else:
+            rows, vectors = self._convert_vectors(filename, cache, read_fn)
+        return self._read_converted(rows, vectors, idx, known_vocab, keep_unused)
+
+    def _convert_vectors(self, filename, cache, read_fn):
+        """Read all of the vectors in an embeddings file and save them as a vocab (`.npz`) and a raw matrix (`.npy`)
+
+        :return: The vocab, from word to row, and the matrix of vectors
+        """
+        vocab, self.vocab = self.vocab, {}
+        try:
+            vectors, _, _, idx = read_fn(filename, Offsets.OFFSET, None, True)
+        finally:
+            rows, self.vocab = self.vocab, vocab
+        vectors.resize((idx, vectors.shape[1]), refcheck=False)
+        try:
+            os.makedirs(os.path.dirname(cache))
+        except OSError:
+            pass
+        try:
+            # Write the matrix last since it is what readers look for
+            _save_atomic(cache + '-vocab.npz', CompiledVocab(rows).save)
+            _save_atomic(cache + '.npy', lambda f: np.save(f, vectors))
+            logger.info('Converted %s to %s', filename, cache)
+        except (IOError, OSError, ValueError) as e:
+            logger.warning('Could not save the vectors from %s to %s: %s', filename, cache, e)
+        return rows, vectors
+
+    def _read_converted(self, rows, vectors, idx, known_vocab, keep_unused):
+        """Pick the vectors we want out of a converted embeddings file
+
+        :param rows: The vocab of the file, from word to row in `vectors`, ordered like the file
+        :param vectors: The matrix of vectors
+        :return: The same as `_read_vectors`
+        """
+        if keep_unused:
+            words = [None] * len(rows)
+            for word, row in rows.items():
+                words[row - Offsets.OFFSET] = word
+        else:
+            words = sorted((word for word in known_vocab if word in rows), key=rows.get)
+        words = [word for word in words if word not in self.vocab]
+        dsz = vectors.shape[1]
+        weights = np.zeros((max(_capacity(len(words), known_vocab, True), idx + len(words)), dsz), dtype=np.float32)
+        np.take(vectors, [rows[word] for word in words], axis=0, out=weights[idx:idx + len(words)])
+        for word in words:
+            if known_vocab and word in known_vocab:
+                known_vocab[word] = 0
+            self.vocab[word] = idx
+            idx += 1
+        return weights, dsz, known_vocab, idx
+
+    def _keep(self, word, known_vocab, keep_unused):
+        """Should we read the vector for `word`, the first vector for a word wins"""
+        if word in self.vocab:
+            return False
+        return keep_unused is not False or word in known_vocab
 
     def _read_word2vec_file(self, filename, idx, known_vocab, keep_unused):
-        word_vectors = []
         with io.open(filename, "rb") as f:
             header = f.readline()
             vsz, dsz = map(int, header.split())
-            width = 4 * dsz
-            for i in range(vsz):
-                word = self._readtospc(f)
-                raw = f.read(width)
-                if word in self.vocab:
-                    continue
-                if keep_unused is False and word not in known_vocab:
+            weights = np.zeros((max(_capacity(vsz, known_vocab, keep_unused), idx), dsz), dtype=np.float32)
+            for word, block, offset in _word2vec_rows(f, vsz, 4 * dsz):
+                if not self._keep(word, known_vocab, keep_unused):
                     continue
                 if known_vocab and word in known_vocab:
                     known_vocab[word] = 0
-                vec = np.fromstring(raw, dtype=np.float32)
-                word_vectors.append(vec)
+                _grow(weights, idx + 1)
+                weights[idx] = np.frombuffer(block, dtype=np.float32, count=dsz, offset=offset)
                 self.vocab[word] = idx
                 idx += 1
-        return word_vectors, dsz, known_vocab, idx
+        return weights, dsz, known_vocab, idx
 
     @staticmethod
     def _read_word2vec_line_mmap(m, width, start):
@@ -256,43 +489,37 @@ class PretrainedEmbeddingsModel(WordEmbeddingsModel):
                     word_vectors.append(vec)
                     self.vocab[word] = idx
                     idx += 1
-                return word_vectors, dsz, known_vocab, idx
-
-    @staticmethod
-    def _readtospc(f):
-
-        s = bytearray()
-        ch = f.read(1)
-
-        while ch != b' ':
-            s.extend(ch)
-            ch = f.read(1)
-        s = s.decode('utf-8')
-        # Only strip out normal space and \n not other spaces which are words.
-        return s.strip(' \n')
+                return _stack_vectors(word_vectors, dsz), dsz, known_vocab, idx
 
     def _read_text_file(self, filename, idx, known_vocab, keep_unused):
-        word_vectors = []
-
-        with io.open(filename, "r", encoding="utf-8") as f:
+        weights = None
+        vsz = 0
+        with io.open(filename, "r", encoding="utf-8", buffering=_BLOCK_SIZE) as f:
             for i, line in enumerate(f):
                 line = line.rstrip("\n ")
-                values = line.split(" ")
-                word = values[0]
-                if i == 0 and len(values) == 2:
-                    print('VSZ: {}, DSZ: {}'.format(word, values[1]))
+                word, _, values = line.partition(" ")
+                if i == 0 and values and " " not in values:
+                    logger.info('VSZ: %s, DSZ: %s', word, values)
+                    vsz = int(word)
                     continue
-                if word in self.vocab: continue
-                if keep_unused is False and word not in known_vocab or word in self.vocab:
+                if weights is None:
+                    dsz = values.count(" ") + 1
+                    weights = np.zeros((max(_capacity(vsz or 1 << 16, known_vocab, keep_unused), idx), dsz),
+                                       dtype=np.float32)
+                if not self._keep(word, known_vocab, keep_unused):
                     continue
                 if known_vocab and word in known_vocab:
                     known_vocab[word] = 0
-                vec = np.asarray(values[1:], dtype=np.float32)
-                word_vectors.append(vec)
+                vec = np.fromstring(values, dtype=np.float32, sep=" ")
+                if len(vec) != dsz:
+                    raise ValueError('Expected {} values for {} on line {} of {}, got {}'.format(
+                        dsz, word, i + 1, filename, len(vec)
+                    ))
+                _grow(weights, idx + 1)
+                weights[idx] = vec
                 self.vocab[word] = idx
                 idx += 1
-        dsz = vec.shape[0]
-        return word_vectors, dsz, known_vocab, idx
+        return weights, dsz, known_vocab, idx
 
     def _read_text_mmap(self, filename, idx, known_vocab, keep_unused):
         import mmap
@@ -319,7 +546,7 @@ class PretrainedEmbeddingsModel(WordEmbeddingsModel):
                     self.vocab[word] = idx
                     idx += 1
                 dsz = vec.shape[0]
-                return word_vectors, dsz, known_vocab, idx
+                return _stack_vectors(word_vectors, dsz), dsz, known_vocab, idx
 
 
 @exporter
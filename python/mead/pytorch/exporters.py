@@ -135,7 +135,7 @@ class PytorchExporter(Exporter):
             order, ['output'],
             self.sig_name,
             model_name, model.lengths_key,
-            exporter_type=self.preproc_type()
+            preproc=self.preproc_type(),
         )
 
         exportable = self.wrapper(model)
@@ -342,6 +342,22 @@ class Task(object):
         tbsz = train.get('test_batchsz', config.get('test_batchsz', 1))
         return bsz, vbsz, tbsz
 
+    @staticmethod
+    def _get_train_feed_params(config):
+        """Get the bucketing, prefetching and streaming options for the training data, `train` settings override `preproc` ones
+
+        :param config: The mead config
+        :return: A ``dict`` of keyword args for the training `DataFeed`
+        :raises ValueError: If streaming is asked for along with bucketing
+        """
+        train = config['train']
+        preproc = config.get('preproc', {})
+        keys = ('buckets', 'max_tokens', 'prefetch', 'prefetch_workers', 'streaming', 'shuffle_buffer', 'num_examples')
+        params = {k: train.get(k, preproc.get(k)) for k in keys if k in train or k in preproc}
+        if params.get('streaming') and (params.get('buckets') is not None or params.get('max_tokens') is not None):
+            raise ValueError("Streaming data can't be bucketed, remove `buckets` and `max_tokens` or `streaming`")
+        return params
+
 
 @exporter
 @register_task
@@ -425,6 +441,7 @@ class ClassifierTask(Task):
             bsz,
             shuffle=True,
             sort_key=sort_key,
+            **Task._get_train_feed_params(self.config_params)
         )
         self.valid_data = self.reader.load(
             self.dataset['valid_file'],
@@ -527,7 +544,8 @@ class TaggerTask(Task):
             self.feat2index,
             bsz,
             shuffle=True,
-            sort_key='{}_lengths'.format(self.primary_key)
+            sort_key='{}_lengths'.format(self.primary_key),
+            **Task._get_train_feed_params(self.config_params)
         )
         self.valid_data, _ = self.reader.load(
             self.dataset['valid_file'],
@@ -637,7 +655,8 @@ class EncoderDecoderTask(Task):
             self.feat2src, self.feat2tgt,
             bsz,
             shuffle=True,
-            sort_key='{}_lengths'.format(self.primary_key)
+            sort_key='{}_lengths'.format(self.primary_key),
+            **Task._get_train_feed_params(self.config_params)
         )
 
         self.valid_data = self.reader.load(
@@ -759,7 +778,8 @@ class LanguageModelingTask(Task):
             self.dataset['train_file'],
             self.feat2index,
             bsz,
-            tgt_key=tgt_key
+            tgt_key=tgt_key,
+            **Task._get_train_feed_params(self.config_params)
         )
         self.valid_data = self.reader.load(
             self.dataset['valid_file'],
@@ -381,7 +381,7 @@ def get_export_params(
     return output_dir, project, name, model_version, exporter_type, return_labels, is_remote
 
 
-def create_metadata(inputs, outputs, sig_name, model_name, lengths_key=None, beam=None, return_labels=False, preproc='client'):
+def create_metadata(inputs, outputs, sig_name, model_name, lengths_key=None, beam=None, return_labels=False, preproc='client', wire_formats=('json',)):
     meta = {
         'inputs': inputs,
         'outputs': outputs,
@@ -391,6 +391,8 @@ def create_metadata(inputs, outputs, sig_name, model_name, lengths_key=None, bea
             'exported_time': str(datetime.utcnow()),
             'return_labels': return_labels,
             'preproc': preproc,
+            # What the server accepts, a client that can speak one of these picks it over `json`
+            'wire_formats': list(wire_formats),
         }
     }
     if lengths_key:
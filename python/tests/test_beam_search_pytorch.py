@@ -0,0 +1,226 @@
+import pytest
+import numpy as np
+torch = pytest.importorskip('torch')
+from baseline.pytorch.embeddings import (
+    LookupTableEmbeddings,
+    PositionalLookupTableEmbeddings,
+    LearnedPositionalLookupTableEmbeddings,
+)
+from baseline.pytorch.seq2seq.encoders import TransformerEncoderOutput
+from baseline.pytorch.seq2seq.decoders import (
+    TransformerDecoderWrapper,
+    beam_search,
+    repeat_batch,
+    update_lengths,
+    no_length_penalty,
+    gnmt_length_penalty,
+)
+from baseline.utils import Offsets
+
+VSZ = 20
+
+
+def _decoder(embeddings_type):
+    torch.manual_seed(0)
+    embeddings = embeddings_type('tgt', vsz=VSZ, dsz=16)
+    decoder = TransformerDecoderWrapper(embeddings, dropout=0.1, layers=2, hsz=16, num_heads=2)
+    return decoder.eval()
+
+
+def _encoder_outputs(B=3, T=7):
+    torch.manual_seed(1)
+    lengths = torch.tensor([7, 4, 2])[:B]
+    src_mask = torch.arange(T).unsqueeze(0) < lengths.unsqueeze(1)
+    return TransformerEncoderOutput(torch.randn(B, T, 16), src_mask)
+
+
+def _full_prefix_search(decoder, encoder_outputs, **kwargs):
+    """Beam search that runs the decoder over the whole prefix every step"""
+
+    def init(encoder_outputs, K):
+        return TransformerEncoderOutput(
+            repeat_batch(encoder_outputs.output, K),
+            repeat_batch(encoder_outputs.src_mask, K)
+        )
+
+    def step(paths, extra):
+        B, K, T = paths.size()
+        return decoder(extra, paths.view(B * K, T))[:, -1], extra
+
+    return beam_search(encoder_outputs, init, step, lambda beams, extra: extra, **kwargs)
+
+
+@pytest.mark.parametrize('embeddings_type', [
+    LookupTableEmbeddings, PositionalLookupTableEmbeddings, LearnedPositionalLookupTableEmbeddings
+])
+@pytest.mark.parametrize('beam', [1, 4])
+def test_cached_beam_search_matches_full_prefix(embeddings_type, beam):
+    decoder = _decoder(embeddings_type)
+    encoder_outputs = _encoder_outputs()
+    gold_paths, gold_lengths, gold_scores = _full_prefix_search(decoder, encoder_outputs, beam=beam, mxlen=12)
+    paths, lengths, scores = decoder.beam_search(encoder_outputs, beam=beam, mxlen=12)
+    np.testing.assert_array_equal(paths.numpy(), gold_paths.numpy())
+    np.testing.assert_array_equal(lengths.numpy(), gold_lengths.numpy())
+    np.testing.assert_allclose(scores.numpy(), gold_scores.numpy(), atol=1e-4)
+
+
+def test_memory_projected_once():
+    decoder = _decoder(PositionalLookupTableEmbeddings)
+    calls = []
+    for layer in decoder.transformer_decoder.layers:
+        layer.src_attn.w_K.register_forward_hook(lambda *args: calls.append(1))
+    decoder.beam_search(_encoder_outputs(), beam=3, mxlen=10)
+    assert len(calls) == len(decoder.transformer_decoder.layers)
+
+
+def _reference_beam_search(encoder_outputs, init, step, update, length_penalty=no_length_penalty, beam=5, mxlen=100):
+    """The beam search before finished batch elements were dropped, growing the paths every step"""
+    K = beam
+    bsz = encoder_outputs.output.size(0)
+    with torch.no_grad():
+        extra = init(encoder_outputs, K)
+        paths = torch.full((bsz, K, 1), Offsets.GO, dtype=torch.long)
+        log_probs = torch.zeros((bsz, K))
+        lengths = torch.zeros((bsz, K), dtype=torch.long)
+        for i in range(mxlen - 1):
+            probs, extra = step(paths, extra)
+            V = probs.size(-1)
+            probs = probs.view((bsz, K, V))
+            if i > 0:
+                done_mask = (lengths != 0).unsqueeze(-1)
+                eos_mask = torch.zeros((1, 1, V), dtype=torch.bool)
+                eos_mask[:, :, Offsets.EOS] = 1
+                probs = probs.masked_fill(done_mask, -np.inf)
+                probs = probs.masked_fill(done_mask & eos_mask, 0)
+                probs = log_probs.unsqueeze(-1) + probs
+                path_scores = probs / length_penalty(lengths.masked_fill(lengths == 0, i + 1))
+            else:
+                path_scores = probs[:, 0, :]
+            best_scores, best_idx = path_scores.view(bsz, -1).topk(K, 1)
+            log_probs = probs.view(bsz, -1).gather(1, best_idx).view(bsz, K)
+            best_beams = best_idx // V
+            best_idx = best_idx % V
+            flat_beams = (best_beams + torch.arange(bsz).unsqueeze(-1) * K).view(bsz * K)
+            paths = torch.cat([paths.view(bsz * K, -1)[flat_beams, :].view(bsz, K, -1), best_idx.unsqueeze(-1)], dim=2)
+            lengths = lengths.view(-1)[flat_beams].view((bsz, K))
+            extra = update(flat_beams, extra)
+            lengths = update_lengths(lengths, paths[:, :, -1] == Offsets.EOS, i + 1)
+            if (lengths != 0).all():
+                break
+        else:
+            probs, extra = step(paths, extra)
+            probs = probs.view((bsz, K, -1))[:, :, Offsets.EOS]
+            log_probs = log_probs + probs.masked_fill((lengths != 0), 0)
+            paths = torch.cat([paths, torch.full((bsz, K, 1), Offsets.EOS, dtype=paths.dtype)], dim=2)
+            lengths = update_lengths(lengths, torch.ones_like(lengths) == 1, mxlen)
+            best_scores = log_probs / length_penalty(lengths).squeeze(-1)
+    return paths[:, :, 1:], lengths, best_scores
+
+
+class _Scripted(object):
+    """A decoder whose next token distribution depends on the batch element, the step and the last token
+
+    Batch elements with a high `eos_bias` finish early, the others run to `mxlen`.
+    """
+
+    def __init__(self, eos_bias, mxlen, vsz=12):
+        torch.manual_seed(2)
+        self.table = torch.randn(len(eos_bias), mxlen, vsz, vsz)
+        self.table[:, :, :, Offsets.EOS] += torch.tensor(eos_bias).view(-1, 1, 1)
+        self.rows_seen = []
+
+    def init(self, encoder_outputs, K):
+        return repeat_batch(torch.arange(encoder_outputs.output.size(0)), K)
+
+    def step(self, paths, example):
+        B, K, T = paths.size()
+        self.rows_seen.append(B * K)
+        logits = self.table[example, T - 1, paths[:, :, -1].view(-1)]
+        return torch.log_softmax(logits, -1), example
+
+    def update(self, beams, example):
+        return example[beams]
+
+    def compact(self, rows, example):
+        return example[rows]
+
+
+@pytest.mark.parametrize('beam', [1, 3, 5])
+@pytest.mark.parametrize('length_penalty', [no_length_penalty, gnmt_length_penalty])
+def test_beam_search_matches_reference(beam, length_penalty):
+    mxlen = 15
+    encoder_outputs = TransformerEncoderOutput(torch.zeros(4, 1), None)
+    decoder = _Scripted([8.0, 0.0, 3.0, -2.0], mxlen)
+    gold = _reference_beam_search(
+        encoder_outputs, decoder.init, decoder.step, decoder.update, length_penalty, beam=beam, mxlen=mxlen
+    )
+    for compact in (decoder.compact, None):
+        decoder.rows_seen = []
+        paths, lengths, scores = beam_search(
+            encoder_outputs, decoder.init, decoder.step, decoder.update,
+            length_penalty=length_penalty, compact=compact, beam=beam, mxlen=mxlen
+        )
+        np.testing.assert_array_equal(paths.numpy(), gold[0].numpy())
+        np.testing.assert_array_equal(lengths.numpy(), gold[1].numpy())
+        np.testing.assert_allclose(scores.numpy(), gold[2].numpy(), rtol=1e-6)
+        if compact is None:
+            assert set(decoder.rows_seen) == {4 * beam}
+        else:
+            assert decoder.rows_seen[-1] < 4 * beam
+
+
+def test_beam_search_all_finish_early():
+    encoder_outputs = TransformerEncoderOutput(torch.zeros(2, 1), None)
+    decoder = _Scripted([20.0, 20.0], 10)
+    paths, lengths, _ = beam_search(encoder_outputs, decoder.init, decoder.step, decoder.update, beam=2, mxlen=10)
+    gold = _reference_beam_search(encoder_outputs, decoder.init, decoder.step, decoder.update, beam=2, mxlen=10)
+    np.testing.assert_array_equal(paths.numpy(), gold[0].numpy())
+    np.testing.assert_array_equal(lengths.numpy(), gold[1].numpy())
+
+
+def _rnn_decoder():
+    from baseline.pytorch.seq2seq.decoders import RNNDecoderWithAttn
+    torch.manual_seed(0)
+    embeddings = LookupTableEmbeddings('tgt', vsz=VSZ, dsz=16)
+    return RNNDecoderWithAttn(embeddings, hsz=16, rnntype='lstm', layers=2, dropout=0.1).eval()
+
+
+def test_rnn_compacted_beam_search_matches_reference():
+    from baseline.pytorch.seq2seq.encoders import RNNEncoderOutput
+    decoder = _rnn_decoder()
+    # Make EOS likely so some batch elements finish before the others
+    decoder.preds.bias.data[Offsets.EOS] += 2.0
+    torch.manual_seed(1)
+    src_mask = torch.arange(7).unsqueeze(0) < torch.tensor([7, 4, 2, 5]).unsqueeze(1)
+    hidden = (torch.randn(2, 4, 16), torch.randn(2, 4, 16))
+    encoder_outputs = RNNEncoderOutput(torch.randn(4, 7, 16), hidden, src_mask)
+    gold = _reference_beam_search(
+        encoder_outputs, decoder.beam_init, decoder.beam_step, decoder.beam_update, beam=3, mxlen=20
+    )
+    paths, lengths, scores = decoder.beam_search(encoder_outputs, beam=3, mxlen=20)
+    np.testing.assert_array_equal(paths.numpy(), gold[0].numpy())
+    np.testing.assert_array_equal(lengths.numpy(), gold[1].numpy())
+    np.testing.assert_allclose(scores.numpy(), gold[2].numpy(), atol=1e-5)
+
+
+def test_transformer_compacted_beam_search_matches_reference():
+    decoder = _decoder(PositionalLookupTableEmbeddings)
+    decoder.preds.bias.data[Offsets.EOS] += 3.0
+    encoder_outputs = _encoder_outputs()
+
+    def init(encoder_outputs, K):
+        return TransformerEncoderOutput(
+            repeat_batch(encoder_outputs.output, K),
+            repeat_batch(encoder_outputs.src_mask, K)
+        )
+
+    def step(paths, extra):
+        B, K, T = paths.size()
+        return decoder(extra, paths.view(B * K, T))[:, -1], extra
+
+    gold = _reference_beam_search(encoder_outputs, init, step, lambda beams, extra: extra, beam=3, mxlen=20)
+    paths, lengths, scores = decoder.beam_search(encoder_outputs, beam=3, mxlen=20)
+    assert len(set(gold[1].max(1)[0].tolist())) > 1
+    np.testing.assert_array_equal(paths.numpy(), gold[0].numpy())
+    np.testing.assert_array_equal(lengths.numpy(), gold[1].numpy())
+    np.testing.assert_allclose(scores.numpy(), gold[2].numpy(), atol=1e-4)
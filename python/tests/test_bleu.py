@@ -14,6 +14,10 @@ from baseline.bleu import (
     count_possible,
     geometric_mean,
     brevity_penalty,
+    bleu,
+    bleu_counts,
+    bleu_counts_from_ids,
+    bleu_from_ids,
     _read_references,
     _read_lines,
 )
@@ -228,3 +232,73 @@ def test_read_references_group_references():
             read_patch.side_effect = (input1, input2)
             res = _read_references(['', ''], False)
             assert res == gold
+
+
+def _id_corpus(vocab, size=30, max_refs=3):
+    preds = [np.random.choice(vocab, size=np.random.randint(0, 12)) for _ in range(size)]
+    golds = []
+    for pred in preds:
+        refs = []
+        for _ in range(np.random.randint(1, max_refs + 1)):
+            # Copy some of the prediction into references so there are long matches
+            if len(pred) > 0 and np.random.rand() < 0.4:
+                refs.append(np.where(np.random.rand(len(pred)) < 0.7, pred, np.random.choice(vocab, size=len(pred))))
+            else:
+                refs.append(np.random.choice(vocab, size=np.random.randint(1, 12)))
+        golds.append(refs)
+    return preds, golds
+
+
+def _as_strings(preds, golds):
+    return [[str(t) for t in p] for p in preds], [[[str(t) for t in g] for g in gold] for gold in golds]
+
+
+@pytest.mark.parametrize('vocab', [np.arange(6), np.array([4, 9, 10 ** 6, 10 ** 12])])
+@pytest.mark.parametrize('n', [1, 2, 4])
+def test_bleu_from_ids_matches_bleu(vocab, n):
+    # Large ids mean the n-grams can't be keyed in base vsz without overflowing
+    for _ in range(20):
+        preds, golds = _id_corpus(vocab)
+        gold = bleu(*_as_strings(preds, golds), n=n)
+        result = bleu_from_ids(preds, golds, n=n)
+        assert result[0] == gold[0]
+        np.testing.assert_array_equal(result[1], gold[1])
+        assert result[2] == gold[2]
+        assert result[3] == gold[3] or (np.isnan(result[3]) and np.isnan(gold[3]))
+        assert result[4:] == gold[4:]
+
+
+def test_bleu_counts_from_ids_matches_bleu_counts():
+    preds, golds = _id_corpus(np.arange(5), size=100)
+    gold = bleu_counts(*_as_strings(preds, golds))
+    result = bleu_counts_from_ids(preds, golds)
+    for r, g in zip(result, gold):
+        np.testing.assert_array_equal(r, g)
+
+
+def test_bleu_from_ids_workers():
+    preds, golds = _id_corpus(np.arange(8), size=50)
+    result = bleu_from_ids(preds, golds, workers=3)
+    gold = bleu_from_ids(preds, golds)
+    assert result[0] == gold[0]
+    np.testing.assert_array_equal(result[1], gold[1])
+    assert result[2:] == gold[2:]
+
+
+def test_bleu_counts_from_ids_empty():
+    matches, total, pred_len, gold_len = bleu_counts_from_ids([], [])
+    assert matches.sum() == total.sum() == pred_len == gold_len == 0
+
+
+def test_trim_seq2seq_ids_matches_convert():
+    from baseline.utils import Offsets, trim_seq2seq_ids, convert_seq2seq_golds, convert_seq2seq_preds
+    rlut = {i: 'w{}'.format(i) for i in range(20)}
+    indices = np.random.randint(0, 20, size=(40, 15))
+    # Put the special tokens in at random places
+    specials = np.random.choice([Offsets.PAD, Offsets.GO, Offsets.EOS], size=indices.shape)
+    indices = np.where(np.random.rand(*indices.shape) < 0.1, specials, indices)
+    lengths = np.random.randint(0, 16, size=40)
+    words = lambda ids: [[rlut[i] for i in x] for x in ids]
+    assert words(trim_seq2seq_ids(indices)) == convert_seq2seq_preds(indices, rlut)
+    golds = convert_seq2seq_golds(indices, lengths, rlut)
+    assert [[w] for w in words(trim_seq2seq_ids(indices, lengths))] == golds
@@ -47,3 +47,67 @@ def test_mc_f1():
     np.testing.assert_allclose(f1, CLASS_F1, TOL)
     wf1 = cm.get_weighted_f()
     np.testing.assert_allclose(wf1, 0.5882784, TOL)
+
+
+def _loop_cm(labels, truth, guess):
+    cm = ConfusionMatrix(labels)
+    for y_t, y_p in zip(truth, guess):
+        cm.add(y_t, y_p)
+    return cm
+
+
+@pytest.mark.parametrize('nc,batchsz', [(5, 13), (5, 1000), (3000, 50)])
+def test_add_batch_matches_add(nc, batchsz):
+    labels = [str(i) for i in range(nc)]
+    truth = np.random.randint(nc, size=batchsz)
+    guess = np.random.randint(nc, size=batchsz)
+    cm = ConfusionMatrix(labels)
+    cm.add_batch(truth, guess)
+    cm.add_batch(list(truth), list(guess))
+    gold = _loop_cm(labels, np.concatenate([truth, truth]), np.concatenate([guess, guess]))
+    np.testing.assert_array_equal(cm._cm, gold._cm)
+
+
+def test_add_batch_empty():
+    cm = ConfusionMatrix(LABELS)
+    cm.add_batch([], [])
+    assert cm.get_total() == 0
+
+
+class _EagerTensor(object):
+    """Something like an eager `tf.Tensor`, only convertible with `.numpy()`"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def numpy(self):
+        return np.array(self.value)
+
+
+def test_add_batch_eager_tensor():
+    cm = ConfusionMatrix(LABELS)
+    cm.add_batch(_EagerTensor(Y_TRUE), _EagerTensor(Y_PRED))
+    np.testing.assert_array_equal(cm._cm, make_mc_cm()._cm)
+
+
+@pytest.mark.parametrize('on_device', [False, True])
+def test_add_batch_torch(on_device):
+    torch = pytest.importorskip('torch')
+    cm = ConfusionMatrix(LABELS, on_device=on_device)
+    for i in range(0, len(Y_TRUE), 4):
+        cm.add_batch(torch.tensor(Y_TRUE[i:i + 4]), torch.tensor(Y_PRED[i:i + 4]))
+    assert (cm._device_cm is not None) == on_device
+    np.testing.assert_array_equal(cm._cm, make_mc_cm()._cm)
+    assert cm._device_cm is None
+    # Counting can go on after a read
+    cm.add_batch(torch.tensor(Y_TRUE), torch.tensor(Y_PRED))
+    assert cm.get_total() == 2 * len(Y_TRUE)
+    assert cm.get_all_metrics() == make_mc_cm().get_all_metrics()
+
+
+def test_reset_on_device():
+    torch = pytest.importorskip('torch')
+    cm = ConfusionMatrix(LABELS, on_device=True)
+    cm.add_batch(torch.tensor(Y_TRUE), torch.tensor(Y_PRED))
+    cm.reset()
+    assert cm.get_total() == 0
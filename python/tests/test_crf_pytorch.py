@@ -6,8 +6,8 @@ import numpy as np
 from mock import patch, MagicMock
 torch = pytest.importorskip('torch')
 from baseline.utils import Offsets
-from baseline.pytorch.torchy import vec_log_sum_exp
-from baseline.pytorch.crf import CRF, viterbi, transition_mask
+from baseline.pytorch.torchy import vec_log_sum_exp, sequence_mask
+from baseline.pytorch.crf import CRF, viterbi, transition_mask, pack_order
 
 
 def explicit_log_sum_exp(xs):
@@ -474,3 +474,95 @@ def test_vec_log_sum_exp_batch_stable():
     one_x_one = torch.cat([lse1, lse2], dim=0)
     lse = vec_log_sum_exp(i, 2)
     np.testing.assert_allclose(one_x_one.numpy(), lse.numpy())
+
+
+def _loop_forward(unary, trans, lengths, start_idx, end_idx):
+    """The CRF forward before it was scripted, looping over every step with masks"""
+    batch_size, n_tags = unary.size(1), unary.size(2)
+    min_length = torch.min(lengths)
+    alphas = torch.Tensor(batch_size, 1, n_tags).fill_(-1e4)
+    alphas[:, 0, start_idx] = 0.
+    for i, unary_t in enumerate(unary):
+        scores = alphas + trans + unary_t.unsqueeze(2)
+        new_alphas = vec_log_sum_exp(scores, 2).transpose(1, 2)
+        if i >= min_length:
+            mask = (i < lengths).view(-1, 1, 1)
+            alphas = alphas.masked_fill(mask, 0) + new_alphas.masked_fill(mask == 0, 0)
+        else:
+            alphas = new_alphas
+    return vec_log_sum_exp(alphas + trans[:, end_idx], 2).view(batch_size)
+
+
+def _loop_viterbi(unary, trans, lengths, start_idx, end_idx):
+    """Viterbi before it was scripted, looping over every step with masks"""
+    seq_len, batch_size, tag_size = unary.size()
+    min_length = torch.min(lengths)
+    backpointers = []
+    alphas = torch.Tensor(batch_size, 1, tag_size).fill_(-1e4)
+    alphas[:, 0, start_idx] = 0
+    for i, unary_t in enumerate(unary):
+        viterbi, best_tag_ids = torch.max(alphas + trans, 2)
+        backpointers.append(best_tag_ids)
+        new_alphas = (viterbi + unary_t).unsqueeze(1)
+        if i >= min_length:
+            mask = (i < lengths).view(-1, 1, 1)
+            alphas = alphas.masked_fill(mask, 0) + new_alphas.masked_fill(mask == 0, 0)
+        else:
+            alphas = new_alphas
+    path_score, best_tag_id = torch.max(alphas.squeeze(1) + trans[:, end_idx, :], 1)
+    rev_len = seq_len - lengths - 1
+    best_path = [best_tag_id]
+    for i, backpointer_t in enumerate(reversed(backpointers)):
+        new_best_tag_id = backpointer_t.gather(1, best_tag_id.unsqueeze(1)).squeeze(1)
+        mask = (i > rev_len)
+        best_tag_id = best_tag_id.masked_fill(mask, 0) + new_best_tag_id.masked_fill(mask == 0, 0)
+        best_path.append(best_tag_id)
+    best_path.pop()
+    best_path.reverse()
+    best_path = torch.stack(best_path)
+    return best_path.masked_fill(sequence_mask(lengths, seq_len).transpose(0, 1) == 0, 0), path_score
+
+
+def _ragged_batch(T=12, B=7, H=9):
+    unary = torch.randn(T, B, H)
+    # Unsorted lengths, with padding steps that are all padding at the end
+    lengths = torch.tensor([5, 9, 1, 9, 3, 7, 2])[:B]
+    return unary, lengths
+
+
+def test_pack_order():
+    perm, inv, batch_sizes = pack_order(torch.tensor([2, 4, 1, 4]))
+    assert torch.tensor([2, 4, 1, 4])[perm].tolist() == [4, 4, 2, 1]
+    assert perm[inv].tolist() == [0, 1, 2, 3]
+    assert batch_sizes == [4, 3, 2, 2]
+
+
+def test_forward_matches_loop():
+    unary, lengths = _ragged_batch()
+    trans = torch.randn(1, unary.size(2), unary.size(2))
+    crf = CRF(unary.size(2))
+    crf.transitions_p.data = trans.clone()
+    gold = _loop_forward(unary, trans, lengths, Offsets.GO, Offsets.EOS)
+    np.testing.assert_allclose(crf(unary, lengths, unary.size(1)).detach().numpy(), gold.numpy(), rtol=1e-5)
+
+
+def test_forward_gradients_match_loop():
+    unary, lengths = _ragged_batch()
+    crf = CRF(unary.size(2))
+    crf.transitions_p.data = torch.randn(1, unary.size(2), unary.size(2))
+    trans = crf.transitions_p.detach().clone().requires_grad_()
+    unary_gold = unary.clone().requires_grad_()
+    unary.requires_grad_()
+    crf(unary, lengths, unary.size(1)).sum().backward()
+    _loop_forward(unary_gold, trans, lengths, Offsets.GO, Offsets.EOS).sum().backward()
+    np.testing.assert_allclose(unary.grad.numpy(), unary_gold.grad.numpy(), atol=1e-5)
+    np.testing.assert_allclose(crf.transitions_p.grad.numpy(), trans.grad.numpy(), atol=1e-5)
+
+
+def test_viterbi_matches_loop():
+    unary, lengths = _ragged_batch()
+    trans = torch.randn(1, unary.size(2), unary.size(2))
+    paths, scores = viterbi(unary, trans, lengths, Offsets.GO, Offsets.EOS)
+    gold_paths, gold_scores = _loop_viterbi(unary, trans, lengths, Offsets.GO, Offsets.EOS)
+    np.testing.assert_array_equal(paths.numpy(), gold_paths.numpy())
+    np.testing.assert_allclose(scores.numpy(), gold_scores.numpy(), rtol=1e-6)
@@ -0,0 +1,202 @@
+import pytest
+import numpy as np
+from baseline.data import DictExamples, Seq2SeqExamples, ColumnarExamples, MMapExamples, ExampleDataFeed
+
+
+def random_examples(num_examples, mxlen=10, mxwlen=5):
+    examples = []
+    for i in range(num_examples):
+        length = np.random.randint(1, mxlen)
+        tgt_length = np.random.randint(1, mxlen)
+        x = np.zeros(mxlen, dtype=int)
+        x[:length] = np.random.randint(1, 100, size=length)
+        xch = np.zeros((mxlen, mxwlen), dtype=int)
+        xch[:length] = np.random.randint(1, 100, size=(length, mxwlen))
+        tgt = np.zeros(mxlen, dtype=int)
+        tgt[:tgt_length] = np.random.randint(1, 100, size=tgt_length)
+        examples.append({
+            'x': x, 'x_lengths': length, 'xch': xch,
+            'tgt': tgt, 'tgt_lengths': tgt_length, 'y': np.random.randint(0, 5)
+        })
+    return examples
+
+
+def assert_batches_equal(batch, gold):
+    assert set(batch.keys()) == set(gold.keys())
+    for k in gold:
+        np.testing.assert_equal(batch[k], gold[k])
+
+
+@pytest.mark.parametrize('trim', [True, False])
+def test_columnar_matches_dict_examples(trim):
+    examples = random_examples(np.random.randint(20, 50))
+    gold = DictExamples(examples, do_shuffle=False, sort_key='x_lengths')
+    # Don't mess with tgt, DictExamples trims it with the sort_key
+    for ex in examples:
+        ex.pop('tgt'); ex.pop('tgt_lengths')
+    cols = ColumnarExamples.from_examples(examples, do_shuffle=False, sort_key='x_lengths')
+    batchsz = np.random.randint(2, 8)
+    for i in range(ExampleDataFeed(cols, batchsz).steps):
+        assert_batches_equal(cols.batch(i, batchsz, trim=trim), gold.batch(i, batchsz, trim=trim))
+
+
+@pytest.mark.parametrize('trim', [True, False])
+def test_columnar_matches_seq2seq_examples(trim):
+    examples = random_examples(np.random.randint(20, 50))
+    gold = Seq2SeqExamples(examples, do_shuffle=False, src_sort_key='x_lengths')
+    cols = ColumnarExamples.from_examples(examples, do_shuffle=False, sort_key='x_lengths')
+    batchsz = np.random.randint(2, 8)
+    for i in range(ExampleDataFeed(cols, batchsz).steps):
+        assert_batches_equal(cols.batch(i, batchsz, trim=trim), gold.batch(i, batchsz, trim=trim))
+
+
+def test_columnar_shuffle_keeps_examples_together():
+    examples = random_examples(30)
+    for i, ex in enumerate(examples):
+        ex['y'] = i
+    cols = ColumnarExamples.from_examples(examples, do_shuffle=True)
+    batch = cols.batch(0, len(examples))
+    assert sorted(batch['y'].tolist()) == list(range(len(examples)))
+    for i, y in enumerate(batch['y']):
+        np.testing.assert_equal(batch['x'][i], examples[y]['x'])
+        np.testing.assert_equal(batch['xch'][i], examples[y]['xch'])
+
+
+def test_columnar_last_batch_is_short():
+    cols = ColumnarExamples.from_examples(random_examples(10), do_shuffle=False)
+    assert len(cols.batch(3, 3)['y']) == 1
+
+
+def test_mmap_matches_columnar(tmpdir):
+    examples = random_examples(30)
+    cols = ColumnarExamples.from_examples(examples, do_shuffle=False, sort_key='x_lengths')
+    MMapExamples.save(str(tmpdir.join('cache')), ColumnarExamples.from_examples(examples, do_shuffle=False).arrays)
+    mmap = MMapExamples(str(tmpdir.join('cache')), do_shuffle=False, sort_key='x_lengths')
+    assert len(mmap) == len(cols)
+    for i in range(6):
+        assert_batches_equal(mmap.batch(i, 5, trim=True), cols.batch(i, 5, trim=True))
+
+
+def test_buckets_cover_every_example_once():
+    examples = random_examples(np.random.randint(50, 100))
+    for i, ex in enumerate(examples):
+        ex['y'] = i
+    cols = ColumnarExamples.from_examples(examples, do_shuffle=True, sort_key='x_lengths')
+    feed = ExampleDataFeed(cols, 4, shuffle=True, trim=True, buckets=3)
+    seen = []
+    for batch in feed:
+        seen.extend(batch['y'].tolist())
+    assert sorted(seen) == list(range(len(examples)))
+    assert len(seen) == len(examples)
+
+
+def test_buckets_limit_padding():
+    examples = random_examples(100)
+    cols = ColumnarExamples.from_examples(examples, do_shuffle=False, sort_key='x_lengths')
+    bounds = [3, 6]
+    feed = ExampleDataFeed(cols, 8, shuffle=True, trim=True, buckets=bounds)
+    for batch in feed:
+        lengths = batch['x_lengths']
+        # Every example in the batch falls in the same bucket
+        assert len(set(np.searchsorted(bounds, lengths, side='left').tolist())) == 1
+        assert batch['x'].shape[1] == lengths.max()
+
+
+def test_buckets_max_tokens():
+    examples = random_examples(100)
+    cols = ColumnarExamples.from_examples(examples, do_shuffle=False, sort_key='x_lengths')
+    max_tokens = 20
+    feed = ExampleDataFeed(cols, 8, shuffle=True, trim=True, buckets=4, max_tokens=max_tokens)
+    steps = 0
+    for batch in feed:
+        assert batch['x'].shape[0] * batch['x'].shape[1] <= max_tokens
+        steps += 1
+    assert steps == len(feed)
+
+
+def test_buckets_truncate_makes_full_batches():
+    cols = ColumnarExamples.from_examples(random_examples(50), do_shuffle=False, sort_key='x_lengths')
+    feed = ExampleDataFeed(cols, 4, truncate=True, buckets=3)
+    for batch in feed:
+        assert len(batch['y']) == 4
+
+
+def _epoch(feed, seed):
+    np.random.seed(seed)
+    return [b for b in feed]
+
+
+@pytest.mark.parametrize('buckets', [None, 3])
+def test_prefetch_matches_synchronous(buckets):
+    cols = ColumnarExamples.from_examples(random_examples(60), do_shuffle=False, sort_key='x_lengths')
+    gold = ExampleDataFeed(cols, 4, shuffle=True, trim=True, buckets=buckets)
+    feed = ExampleDataFeed(cols, 4, shuffle=True, trim=True, buckets=buckets, prefetch=3, prefetch_workers=2)
+    gold_batches = _epoch(gold, 1337)
+    batches = _epoch(feed, 1337)
+    assert len(batches) == len(gold_batches)
+    for batch, gold_batch in zip(batches, gold_batches):
+        assert_batches_equal(batch, gold_batch)
+
+
+def test_prefetch_stats():
+    cols = ColumnarExamples.from_examples(random_examples(20), do_shuffle=False)
+    feed = ExampleDataFeed(cols, 4, prefetch=2)
+    _ = [b for b in feed]
+    assert feed.prefetch_stats['batches'] == len(feed)
+    assert 0 <= feed.prefetch_stats['starved'] <= len(feed)
+
+
+def test_prefetch_lm_feed():
+    from baseline.data import SeqWordCharDataFeed
+    x = {'x': np.arange(1013), 'x_dims': (1013,)}
+    gold = [b for b in SeqWordCharDataFeed(x, 5, 4, tgt_key='x')]
+    batches = [b for b in SeqWordCharDataFeed(x, 5, 4, tgt_key='x', prefetch=4)]
+    assert len(batches) == len(gold)
+    for batch, gold_batch in zip(batches, gold):
+        assert_batches_equal(batch, gold_batch)
+
+
+def _stream_feed(examples, batchsz, **kwargs):
+    from baseline.data import StreamingDataFeed
+    def vectorize_fn(idx):
+        return {k: np.stack([examples[i][k] for i in idx]) for k in examples[0].keys()}
+    return StreamingDataFeed(lambda shuffle: iter(range(len(examples))), vectorize_fn, batchsz, **kwargs)
+
+
+@pytest.mark.parametrize('trim', [True, False])
+def test_streaming_matches_columnar(trim):
+    examples = ColumnarExamples.from_examples(random_examples(103), do_shuffle=False, sort_key='x_lengths')
+    gold = ExampleDataFeed(examples, 8, trim=trim)
+    feed = _stream_feed(examples, 8, trim=trim, sort_key='x_lengths', prefetch=2)
+    assert len(feed) == len(gold)
+    for batch, gold_batch in zip(feed, gold):
+        assert_batches_equal(batch, gold_batch)
+    assert_batches_equal(feed[3], gold[3])
+
+
+def test_streaming_shuffle_covers_every_example_once():
+    examples = random_examples(103)
+    for i, example in enumerate(examples):
+        example['ids'] = i
+    feed = _stream_feed(examples, 8, shuffle=True, shuffle_buffer=10)
+    ids = np.concatenate([batch['ids'] for batch in feed])
+    assert sorted(ids) == list(range(103))
+    assert list(ids) != list(range(103))
+
+
+def test_streaming_truncate_makes_full_batches():
+    feed = _stream_feed(random_examples(103), 8, truncate=True)
+    assert len(feed) == 12
+    assert all(len(batch['y']) == 8 for batch in feed)
+
+
+def test_streaming_lm_feed_matches():
+    from baseline.data import SeqWordCharDataFeed, StreamingSeqWordCharDataFeed
+    tokens = np.arange(1013)
+    gold = SeqWordCharDataFeed({'x': tokens, 'x_dims': (1013,)}, 5, 4, tgt_key='x')
+    feed = StreamingSeqWordCharDataFeed(lambda offset: iter(tokens[offset:]), lambda rows: {'x': np.array(rows)},
+                                        len(tokens), 5, 4, tgt_key='x')
+    assert len(feed) == len(gold)
+    for batch, gold_batch in zip(feed, gold):
+        assert_batches_equal(batch, gold_batch)
+    assert_batches_equal(feed[7], gold[7])
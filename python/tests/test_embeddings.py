@@ -4,6 +4,7 @@ import random
 import string
 from functools import partial
 import pytest
+from mock import patch
 import numpy as np
 from baseline.w2v import *
 from baseline.w2v import norm_weights
@@ -225,3 +226,131 @@ def test_rand_counts():
     gold = {"C", "D"}
     for g in gold:
         assert g in wv.vocab
+
+
+def _known_vocab(filename, extra=("AAAAAAAAAAAA",)):
+    words = [w for w in PretrainedEmbeddingsModel(filename, keep_unused=True).vocab if w not in Offsets.VALUES]
+    vocab = {w: 1 for w in random.sample(words, len(words) // 2)}
+    for w in extra:
+        vocab[w] = 1
+    return vocab
+
+
+def _assert_same_embeddings(wv, gold):
+    assert wv.vocab == gold.vocab
+    assert wv.get_vsz() == gold.get_vsz()
+    assert wv.get_dsz() == gold.get_dsz()
+    np.testing.assert_equal(wv.weights, gold.weights)
+
+
+@pytest.mark.parametrize('filename', [GLOVE_FILE, W2V_FILE])
+@pytest.mark.parametrize('keep_unused', [True, False])
+def test_cached_vectors(filename, keep_unused, tmpdir):
+    known_vocab = _known_vocab(filename)
+    gold = PretrainedEmbeddingsModel(filename, known_vocab=dict(known_vocab), keep_unused=keep_unused)
+    cache_dir = str(tmpdir.join('cache'))
+    wv = PretrainedEmbeddingsModel(filename, known_vocab=dict(known_vocab), keep_unused=keep_unused, cache_dir=cache_dir)
+    _assert_same_embeddings(wv, gold)
+    assert len(os.listdir(cache_dir)) == 2
+    # The second time the vectors come from the cache
+    with patch.object(PretrainedEmbeddingsModel, '_convert_vectors') as convert_patch:
+        wv = PretrainedEmbeddingsModel(filename, known_vocab=dict(known_vocab), keep_unused=keep_unused, cache_dir=cache_dir)
+        convert_patch.assert_not_called()
+    _assert_same_embeddings(wv, gold)
+
+
+@pytest.mark.parametrize('filename', [GLOVE_FILE, W2V_FILE])
+def test_mmap_matches(filename):
+    known_vocab = _known_vocab(filename)
+    gold = PretrainedEmbeddingsModel(filename, known_vocab=dict(known_vocab))
+    _assert_same_embeddings(PretrainedEmbeddingsModel(filename, known_vocab=dict(known_vocab), use_mmap=True), gold)
+
+
+def test_word2vec_rows_small_blocks():
+    from baseline.w2v import _word2vec_rows
+    with open(W2V_FILE, 'rb') as f:
+        vsz, dsz = map(int, f.readline().split())
+        gold = [(w, np.frombuffer(b, dtype=np.float32, count=dsz, offset=o)) for w, b, o in _word2vec_rows(f, vsz, 4 * dsz)]
+    with open(W2V_FILE, 'rb') as f:
+        f.readline()
+        rows = [(w, np.frombuffer(b, dtype=np.float32, count=dsz, offset=o)) for w, b, o in _word2vec_rows(f, vsz, 4 * dsz, 7)]
+    assert [w for w, _ in rows] == [w for w, _ in gold]
+    for (_, vec), (_, gold_vec) in zip(rows, gold):
+        np.testing.assert_equal(vec, gold_vec)
+
+
+def test_share_embeddings(tmpdir):
+    from mock import MagicMock
+    known_vocab = _known_vocab(GLOVE_FILE)
+    gold = PretrainedEmbeddingsModel(GLOVE_FILE, known_vocab=dict(known_vocab))
+    build_fn = MagicMock(return_value=gold)
+    key = {'file': GLOVE_FILE}
+    cache_dir = str(tmpdir)
+    first = share_embeddings(build_fn, cache_dir, key)
+    second = share_embeddings(build_fn, cache_dir, key)
+    assert build_fn.call_count == 1
+    for wv in (first, second):
+        assert isinstance(wv.weights, np.memmap)
+        _assert_same_embeddings(wv, gold)
+        np.testing.assert_equal(wv.lookup('not a word', False), gold.nullv)
+    share_embeddings(build_fn, cache_dir, {'file': W2V_FILE})
+    assert build_fn.call_count == 2
+
+
+def test_share_embeddings_writes_are_private(tmpdir):
+    gold = RandomInitVecModel(10, {'a': 1, 'b': 2}, unif_weight=0.1)
+    first = share_embeddings(lambda: gold, str(tmpdir), {})
+    second = share_embeddings(lambda: gold, str(tmpdir), {})
+    first.weights[Offsets.OFFSET] = 100
+    np.testing.assert_equal(second.weights, gold.weights)
+
+
+def _save_shared(basename):
+    from baseline.w2v import save_shared_embeddings
+    save_shared_embeddings(RandomInitVecModel(64, {str(i): 1 for i in range(2000)}, unif_weight=0.1), basename)
+
+
+def test_save_shared_embeddings_concurrently(tmpdir):
+    import multiprocessing
+    from baseline.w2v import load_shared_embeddings
+    basename = str(tmpdir.join('shared'))
+    pool = multiprocessing.Pool(4)
+    try:
+        pool.map(_save_shared, [basename] * 8)
+    finally:
+        pool.terminate()
+    wv = load_shared_embeddings(basename)
+    assert wv.weights.shape == (2000 + Offsets.OFFSET, 64)
+    assert sorted(os.listdir(str(tmpdir))) == ['shared-vocab.npz', 'shared.npy']
+
+
+def test_save_atomic_cleans_up(tmpdir):
+    from baseline.w2v import _save_atomic
+    file_name = str(tmpdir.join('out.npy'))
+
+    def fail(f):
+        f.write(b'partial')
+        raise IOError('disk full')
+
+    with pytest.raises(IOError):
+        _save_atomic(file_name, fail)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_random_init_embeddings_are_not_shared(tmpdir):
+    from baseline.embeddings import load_embeddings, BASELINE_EMBEDDINGS
+
+    class Embeddings(object):
+        @classmethod
+        def create(cls, model, name, **kwargs):
+            return model
+
+    BASELINE_EMBEDDINGS['test-random-shared'] = Embeddings
+    try:
+        with patch('baseline.embeddings.share_embeddings') as share_patch:
+            models = [load_embeddings('word', embed_type='test-random-shared', dsz=8, known_vocab={'a': 1, 'b': 1},
+                                      shared=True, cache_dir=str(tmpdir))['embeddings'] for _ in range(2)]
+            share_patch.assert_not_called()
+    finally:
+        del BASELINE_EMBEDDINGS['test-random-shared']
+    assert not np.allclose(models[0].weights, models[1].weights)
@@ -73,3 +73,25 @@ def test_get_min_f_each_feat_preset():
         assert name in names
 
 
+
+
+def test_get_train_feed_params_train_overrides_preproc():
+    c = {
+        'train': {'buckets': 5, 'prefetch': 4},
+        'preproc': {'buckets': 10, 'max_tokens': 1000},
+    }
+    assert Task._get_train_feed_params(c) == {'buckets': 5, 'max_tokens': 1000, 'prefetch': 4}
+
+
+def test_get_train_feed_params_off_by_default():
+    c = {'train': {}, 'preproc': {'mxlen': 100}}
+    assert Task._get_train_feed_params(c) == {}
+
+
+def test_get_train_feed_params_streaming_with_buckets():
+    c = {'train': {'streaming': True}, 'preproc': {'buckets': 10}}
+    with pytest.raises(ValueError):
+        Task._get_train_feed_params(c)
+    c = {'train': {'streaming': True, 'max_tokens': 1000}}
+    with pytest.raises(ValueError):
+        Task._get_train_feed_params(c)
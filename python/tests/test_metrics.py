@@ -0,0 +1,157 @@
+import numpy as np
+import pytest
+from baseline.bleu import bleu
+from baseline.confusion import ConfusionMatrix
+from baseline.utils import to_spans, span_f1, per_entity_f1
+from baseline.metrics import (
+    merge_metrics,
+    BleuAccumulator,
+    SpanF1Accumulator,
+    PerplexityAccumulator,
+)
+
+LABELS = ['<PAD>', 'O', 'B-PER', 'I-PER', 'B-LOC', 'I-LOC', 'B-MISC', 'I-MISC']
+WORDS = ['w{}'.format(i) for i in range(8)]
+
+
+def _shards(n, nshards=3):
+    """Split `range(n)` into uneven contiguous batches"""
+    cuts = np.sort(np.random.choice(np.arange(1, n), size=nshards - 1, replace=False))
+    return np.split(np.arange(n), cuts)
+
+
+def _sentence(mn=0, mx=12):
+    return [WORDS[i] for i in np.random.randint(len(WORDS), size=np.random.randint(mn, mx))]
+
+
+@pytest.mark.parametrize('nc', [2, 5])
+def test_confusion_matrix_merge(nc):
+    labels = [str(i) for i in range(nc)]
+    truth = np.random.randint(nc, size=200)
+    guess = np.where(np.random.rand(200) < 0.6, truth, np.random.randint(nc, size=200))
+    gold = ConfusionMatrix(labels)
+    gold.add_batch(truth, guess)
+    shards = []
+    for idx in _shards(200):
+        cm = ConfusionMatrix(labels)
+        cm.update(truth[idx], guess[idx])
+        shards.append(cm)
+    assert merge_metrics(shards).get_all_metrics() == gold.get_all_metrics()
+
+
+def test_span_f1_merge():
+    lut = {i: l for i, l in enumerate(LABELS)}
+    golds = np.random.randint(len(LABELS), size=(60, 10))
+    preds = np.where(np.random.rand(60, 10) < 0.8, golds, np.random.randint(len(LABELS), size=(60, 10)))
+    lengths = np.random.randint(0, 11, size=60)
+    shards = []
+    for idx in _shards(60):
+        acc = SpanF1Accumulator(lut, 'iob')
+        acc.update(golds[idx], preds[idx], lengths[idx])
+        shards.append(acc)
+    merged = merge_metrics(shards)
+    gold_spans = [set(to_spans(g[:l], lut, 'iob')) for g, l in zip(golds, lengths)]
+    pred_spans = [set(to_spans(p[:l], lut, 'iob')) for p, l in zip(preds, lengths)]
+    gold = per_entity_f1(gold_spans, pred_spans)
+    assert merged.get_per_entity_metrics() == gold
+    assert merged.get_all_metrics() == {'f1': span_f1(gold_spans, pred_spans)}
+
+
+def test_bleu_merge():
+    preds = [_sentence() for _ in range(50)]
+    # Some predictions copy a reference so the higher order n-grams match too
+    golds = [[p if np.random.rand() < 0.3 else _sentence(1) for _ in range(np.random.randint(1, 4))] for p in preds]
+    shards = []
+    for idx in _shards(50):
+        acc = BleuAccumulator()
+        acc.update([preds[i] for i in idx], [golds[i] for i in idx])
+        shards.append(acc)
+    merged = merge_metrics(shards)
+    gold = bleu(preds, golds)
+    result = merged.bleu()
+    assert gold[0] > 0
+    assert result[0] == gold[0]
+    np.testing.assert_array_equal(result[1], gold[1])
+    assert result[2:] == gold[2:]
+    assert merged.get_all_metrics() == {'bleu': gold[0]}
+
+
+def test_bleu_empty_predictions():
+    acc = BleuAccumulator()
+    acc.update([[]], [[['a', 'b']]])
+    result = acc.bleu()
+    gold = bleu([[]], [[['a', 'b']]])
+    assert result[0] == gold[0] == 0
+    assert np.isnan(result[3]) and np.isnan(gold[3])
+
+
+def test_perplexity_merge():
+    losses = np.random.rand(20) * 5
+    toks = np.random.randint(1, 100, size=20)
+    total_loss = total_toks = 0
+    for loss, tok in zip(losses, toks):
+        total_loss += loss * tok
+        total_toks += tok
+    avg_loss = total_loss / float(total_toks)
+    single = PerplexityAccumulator()
+    shards = []
+    for idx in _shards(20):
+        acc = PerplexityAccumulator()
+        for i in idx:
+            acc.update(losses[i], toks[i])
+            single.update(losses[i], toks[i])
+        shards.append(acc)
+    assert single.get_all_metrics() == {'avg_loss': avg_loss, 'perplexity': np.exp(avg_loss)}
+    metrics = merge_metrics(shards).get_all_metrics()
+    np.testing.assert_allclose(metrics['avg_loss'], avg_loss)
+    np.testing.assert_allclose(metrics['perplexity'], np.exp(avg_loss))
+
+
+def test_merge_stats_arrays():
+    # What an all-reduce across workers would do
+    shards = []
+    for _ in range(3):
+        acc = BleuAccumulator()
+        acc.update([_sentence(1)], [[_sentence(1)]])
+        shards.append(acc)
+    reduced = BleuAccumulator().merge(np.sum([acc.stats for acc in shards], axis=0))
+    np.testing.assert_array_equal(reduced.stats, merge_metrics(shards).stats)
+
+
+def test_merge_does_not_change_inputs():
+    a = ConfusionMatrix(['0', '1'])
+    a.add(0, 1)
+    b = ConfusionMatrix(['0', '1'])
+    b.add(1, 1)
+    c = a + b
+    assert a.get_total() == b.get_total() == 1
+    assert c.get_total() == 2
+    merged = merge_metrics([a, b, c])
+    assert merged.get_total() == 4
+    assert a.get_total() == 1
+    a += b
+    assert a.get_total() == 2
+
+
+def test_merge_mismatched():
+    with pytest.raises(ValueError):
+        ConfusionMatrix(['0', '1']).merge(ConfusionMatrix(['0', '1', '2']))
+    with pytest.raises(ValueError):
+        BleuAccumulator(4).merge(BleuAccumulator(3))
+
+
+def test_reset():
+    acc = PerplexityAccumulator()
+    acc.update(2.0, 10)
+    acc.reset()
+    np.testing.assert_array_equal(acc.stats, [0, 0])
+
+
+def test_bleu_update_ids():
+    ids = [np.random.randint(len(WORDS), size=np.random.randint(1, 12)) for _ in range(40)]
+    golds = [[np.random.randint(len(WORDS), size=np.random.randint(1, 12)), i] for i in ids]
+    acc = BleuAccumulator()
+    for start in range(0, 40, 7):
+        acc.update_ids(ids[start:start + 7], golds[start:start + 7])
+    words = lambda x: [WORDS[t] for t in x]
+    assert acc.bleu()[0] == bleu([words(i) for i in ids], [[words(g) for g in gold] for gold in golds])[0]
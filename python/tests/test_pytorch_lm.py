@@ -0,0 +1,123 @@
+import pytest
+import numpy as np
+torch = pytest.importorskip('torch')
+from baseline.pytorch.embeddings import (
+    LookupTableEmbeddings,
+    PositionalLookupTableEmbeddings,
+    LearnedPositionalLookupTableEmbeddings,
+)
+from baseline.pytorch.lm.model import RNNLanguageModel, TransformerLanguageModel
+from baseline.services import LanguageModelService
+from baseline.vectorizers import Token1DVectorizer
+
+WORDS = ['<PAD>', '<UNK>', '<EOS>'] + ['w{}'.format(i) for i in range(17)]
+VOCAB = {w: i for i, w in enumerate(WORDS)}
+
+
+def _lm(model_type, embeddings_type=LookupTableEmbeddings):
+    torch.manual_seed(0)
+    embeddings = {'word': embeddings_type('word', vsz=len(VOCAB), dsz=16)}
+    return model_type.create(embeddings, hsz=16, layers=2, num_heads=2, tgt_key='word', gpu=False, dropout=0.1)
+
+
+MODELS = [
+    (RNNLanguageModel, LookupTableEmbeddings),
+    (TransformerLanguageModel, PositionalLookupTableEmbeddings),
+    (TransformerLanguageModel, LearnedPositionalLookupTableEmbeddings),
+]
+
+
+@pytest.mark.parametrize('model_type,embeddings_type', MODELS)
+def test_predict_next_matches_predict(model_type, embeddings_type):
+    lm = _lm(model_type, embeddings_type)
+    words = np.random.randint(3, len(VOCAB), size=(3, 9))
+    full = lm.predict({'word': words})
+    state = lm.init_decode_state(3)
+    np.testing.assert_allclose(lm.predict_next({'word': words[:, :4]}, state), full[:, 3], atol=1e-5)
+    for t in range(4, 9):
+        np.testing.assert_allclose(lm.predict_next({'word': words[:, t:t + 1]}, state), full[:, t], atol=1e-5)
+    assert state['length'] == 9
+
+
+class _FullSequenceOnly(object):
+    """Hide `predict_next` so the service has to give the model the whole sequence each step"""
+
+    def __init__(self, lm):
+        self.lm = lm
+        self.tgt_key = lm.tgt_key
+        self.lengths = []
+
+    def predict(self, batch_dict):
+        self.lengths.append(batch_dict['word'].shape[1])
+        return self.lm.predict(batch_dict)
+
+
+def _service(model):
+    return LanguageModelService({'word': VOCAB}, {'word': Token1DVectorizer(mxlen=-1)}, model)
+
+
+@pytest.mark.parametrize('model_type,embeddings_type', MODELS)
+def test_service_incremental_matches_full_sequence(model_type, embeddings_type):
+    lm = _lm(model_type, embeddings_type)
+    prompts = [['w1', 'w2', 'w3'], ['w4'], ['w5', 'w6']]
+    full_model = _FullSequenceOnly(lm)
+    gold = _service(full_model).predict(prompts, mxlen=6, stop=[])
+    assert full_model.lengths == list(range(1, 9))
+    assert _service(lm).predict(prompts, mxlen=6, stop=[]) == gold
+    assert [g[:len(p)] for g, p in zip(gold, prompts)] == prompts
+
+
+def test_service_batch_matches_one_at_a_time():
+    service = _service(_lm(TransformerLanguageModel, PositionalLookupTableEmbeddings))
+    prompts = [['w1', 'w2', 'w3'], ['w4'], ['w5', 'w6']]
+    batch = service.predict(prompts, mxlen=5)
+    assert batch == [service.predict(p, mxlen=5) for p in prompts]
+
+
+def test_service_does_not_change_input():
+    service = _service(_lm(RNNLanguageModel))
+    prompt = ['w1', 'w2']
+    assert service.predict(prompt, mxlen=3)[:2] == prompt
+    assert prompt == ['w1', 'w2']
+
+
+def test_service_top_1_sample_is_greedy():
+    service = _service(_lm(RNNLanguageModel))
+    prompts = [['w1', 'w2', 'w3'], ['w4']]
+    assert service.predict(prompts, mxlen=5, sample=True, k=1) == service.predict(prompts, mxlen=5)
+
+
+class _Scripted(object):
+    """Predict a fixed token at each step"""
+
+    tgt_key = 'word'
+
+    def __init__(self, script):
+        self.script = script
+
+    def init_decode_state(self, batchsz):
+        return {'length': 0}
+
+    def predict_next(self, batch_dict, state):
+        state['length'] += batch_dict['word'].shape[1]
+        probs = np.zeros((len(batch_dict['word']), len(VOCAB)))
+        probs[:, VOCAB[self.script[min(state['length'], len(self.script)) - 1]]] = 1.0
+        return probs
+
+
+def test_service_stops():
+    service = _service(_Scripted(['w1', 'w2', 'w3', '<EOS>', 'w4', 'w5']))
+    assert service.predict(['w0'], mxlen=10) == ['w0', 'w1', 'w2', 'w3']
+    assert service.predict(['w0'], mxlen=1) == ['w0', 'w1']
+    assert service.predict(['w0'], mxlen=10, stop=['w3']) == ['w0', 'w1', 'w2']
+
+
+def test_batch_multinomial():
+    from baseline.utils import batch_multinomial
+    probs = np.array([[0.1, 0.2, 0.3, 0.4], [0.7, 0.1, 0.1, 0.1]])
+    assert batch_multinomial(probs, k=1).tolist() == [3, 0]
+    assert batch_multinomial(probs, temperature=1e-3).tolist() == [3, 0]
+    draws = np.stack([batch_multinomial(probs, k=2) for _ in range(200)])
+    assert set(draws[:, 0]) <= {2, 3}
+    assert len(set(draws[:, 1])) <= 2
+    assert 0 in set(draws[:, 1])
@@ -12,6 +12,8 @@ from baseline.reader import (
     _build_vocab_for_col,
     _check_lens,
     TSVSeqLabelReader,
+    CONLLSeqReader,
+    SeqPredictReader,
     TSVParallelCorpusReader,
     MultiFileParallelCorpusReader,
 )
@@ -195,3 +197,317 @@ def test_check_for_neg_one():
         vects[i] = vect
     fails = _check_lens(vects)
     assert fails == gold
+
+
+def _tsv_feed(cache_dir=None, vect=None):
+    from baseline.vectorizers import Token1DVectorizer
+    vect = Token1DVectorizer(mxlen=-1) if vect is None else vect
+    reader = TSVSeqLabelReader({'word': vect}, cache_dir=cache_dir)
+    file_name = os.path.join(TEST_LOC, 'tsv_unstruct_file.tsv')
+    vocab, _ = reader.build_vocab(file_name)
+    vocab = {'word': {k: i for i, k in enumerate(vocab['word'], 1)}}
+    return reader.load(file_name, vocab, 2), vect
+
+
+def test_cached_examples_match(tmpdir):
+    gold, _ = _tsv_feed()
+    for _ in range(2):
+        ts, _ = _tsv_feed(str(tmpdir))
+        assert len(ts) == len(gold)
+        for batch, gold_batch in zip(ts, gold):
+            assert batch.keys() == gold_batch.keys()
+            for k in gold_batch:
+                np.testing.assert_equal(batch[k], gold_batch[k])
+
+
+def test_cache_hit_restores_mxlen(tmpdir):
+    _, vect = _tsv_feed(str(tmpdir))
+    gold = vect.mxlen
+    with patch('baseline.reader.TSVSeqLabelReader.label_and_sentence', wraps=TSVSeqLabelReader.label_and_sentence) as read_patch:
+        from baseline.vectorizers import Token1DVectorizer
+        vect = Token1DVectorizer(mxlen=-1)
+        _, vect = _tsv_feed(str(tmpdir), vect)
+        # Both the vocab counts and the load are served from the cache
+        assert read_patch.call_count == 0
+    assert vect.mxlen == gold
+
+
+def test_cache_dir_changes_with_vocab(tmpdir):
+    from baseline.reader import _examples_cache_dir
+    from baseline.vectorizers import Token1DVectorizer
+    file_name = os.path.join(TEST_LOC, 'tsv_unstruct_file.tsv')
+    vects = {'word': Token1DVectorizer(mxlen=10)}
+    cache1 = _examples_cache_dir(str(tmpdir), [file_name], vects, {'word': {'a': 1}})
+    cache2 = _examples_cache_dir(str(tmpdir), [file_name], vects, {'word': {'a': 2}})
+    assert cache1 != cache2
+    assert _examples_cache_dir(None, [file_name], vects, {'word': {'a': 1}}) is None
+
+
+def test_tsv_streaming_matches_load():
+    from baseline.vectorizers import Token1DVectorizer
+    gold, _ = _tsv_feed()
+    reader = TSVSeqLabelReader({'word': Token1DVectorizer(mxlen=-1)})
+    file_name = os.path.join(TEST_LOC, 'tsv_unstruct_file.tsv')
+    vocab, _ = reader.build_vocab(file_name)
+    vocab = {'word': {k: i for i, k in enumerate(vocab['word'], 1)}}
+    ts = reader.load(file_name, vocab, 2, streaming=True)
+    assert len(ts) == len(gold)
+    for batch, gold_batch in zip(ts, gold):
+        for k in gold_batch:
+            np.testing.assert_equal(batch[k], gold_batch[k])
+
+
+def test_conll_streaming_matches_load():
+    from baseline.reader import CONLLSeqReader
+    from baseline.vectorizers import Dict1DVectorizer
+    reader = CONLLSeqReader({'word': Dict1DVectorizer(fields='text', mxlen=20)}, named_fields={'0': 'text', '-1': 'y'})
+    file_name = os.path.join(TEST_LOC, 'eng.testb.small.conll')
+    vocab = reader.build_vocab([file_name])
+    vocab = {'word': {k: i for i, k in enumerate(vocab['word'], 1)}}
+    gold, _ = reader.load(file_name, vocab, 2)
+    ts, texts = reader.load(file_name, vocab, 2, streaming=True)
+    assert texts is None
+    assert len(ts) == len(gold)
+    for batch, gold_batch in zip(ts, gold):
+        for k in gold_batch:
+            np.testing.assert_equal(batch[k], gold_batch[k])
+
+
+def _write_corpus(file_name, num_lines, seed=1234):
+    rng = random.Random(seed)
+    words = ['the', 'cat', 'sat', 'on', 'a', 'mat']
+    with open(file_name, 'w') as f:
+        for _ in range(num_lines):
+            f.write(' '.join(rng.choice(words) for _ in range(rng.randint(0, 12))) + '\n')
+
+
+def test_token_index_seeks_to_any_offset(tmpdir):
+    from baseline.reader import _TokenIndex
+    files = [str(tmpdir.join('corpus.{}'.format(i))) for i in range(2)]
+    tokens = []
+    for file_name in files:
+        _write_corpus(file_name, 50, seed=len(tokens))
+        with open(file_name) as f:
+            for line in f:
+                tokens += line.split() + ['<EOS>']
+    index = _TokenIndex(files, every=7)
+    assert index.num_tokens == len(tokens)
+    for offset in [0, 1, 13, len(tokens) // 2, len(tokens) - 1]:
+        assert list(index(offset)) == tokens[offset:]
+
+
+def test_lm_streaming_matches_load(tmpdir):
+    from baseline.reader import LineSeqReader
+    from baseline.vectorizers import Token1DVectorizer
+    file_name = str(tmpdir.join('corpus.txt'))
+    _write_corpus(file_name, 200)
+    reader = LineSeqReader({'x': Token1DVectorizer(mxlen=-1)}, trim=False, nctx=7)
+    vocab = reader.build_vocab([file_name])
+    vocab = {'x': {k: i for i, k in enumerate(vocab['x'], 1)}}
+    gold = reader.load(file_name, vocab, 3)
+    ts = reader.load(file_name, vocab, 3, streaming=True)
+    assert len(ts) == len(gold)
+    for batch, gold_batch in zip(ts, gold):
+        for k in gold_batch:
+            np.testing.assert_equal(batch[k], gold_batch[k])
+
+
+def _write_tsv(file_name, num_lines, seed=1234):
+    rng = random.Random(seed)
+    words = ['the', 'cat', 'sat', 'on', 'a', 'mat', 'dog', 'ran']
+    with open(file_name, 'w') as f:
+        for _ in range(num_lines):
+            text = ' '.join(rng.choice(words) for _ in range(rng.randint(0, 15)))
+            f.write('{}\t{}\n'.format(rng.choice(['pos', 'neg', 'neutral']), text))
+
+
+def test_file_shards_cover_file(tmpdir):
+    from baseline.reader import _file_shards, _read_lines
+    file_name = str(tmpdir.join('data.tsv'))
+    _write_tsv(file_name, 200)
+    shards = _file_shards([file_name, None], 4)
+    assert len(shards) == 4
+    lines = [l for shard in shards for l in _read_lines(*shard)]
+    with open(file_name) as f:
+        assert lines == f.readlines()
+
+
+def test_tsv_parallel_vocab_matches_serial(tmpdir):
+    from baseline.vectorizers import Token1DVectorizer, Char2DVectorizer
+    file_name = str(tmpdir.join('data.tsv'))
+    _write_tsv(file_name, 500)
+    results = []
+    for workers in (1, 3):
+        vects = {'word': Token1DVectorizer(mxlen=-1), 'char': Char2DVectorizer(mxlen=-1, mxwlen=-1)}
+        reader = TSVSeqLabelReader(vects, vocab_workers=workers)
+        vocab, labels = reader.build_vocab([file_name])
+        results.append((vocab, labels, vects['word'].max_seen, vects['char'].max_seen_tok, vects['char'].max_seen_char))
+    assert results[0] == results[1]
+
+
+def test_conll_parallel_vocab_matches_serial():
+    from baseline.reader import CONLLSeqReader
+    from baseline.vectorizers import Dict1DVectorizer
+    file_name = os.path.join(TEST_LOC, 'eng.testb.small.conll')
+    results = []
+    for workers in (1, 4):
+        vect = Dict1DVectorizer(fields='text')
+        reader = CONLLSeqReader({'word': vect}, named_fields={'0': 'text', '-1': 'y'}, vocab_workers=workers)
+        vocab = reader.build_vocab([file_name])
+        results.append((vocab, reader.label2index, vect.max_seen, reader.label_vectorizer.max_seen))
+    assert results[0] == results[1]
+
+
+def test_parallel_vocab_falls_back_to_serial(tmpdir):
+    from baseline.vectorizers import Token1DVectorizer
+    file_name = str(tmpdir.join('data.tsv'))
+    _write_tsv(file_name, 100)
+    gold, _ = TSVSeqLabelReader({'word': Token1DVectorizer()}).build_vocab([file_name])
+    # A lambda can't be sent to another process
+    vect = Token1DVectorizer(transform_fn=lambda x: x)
+    vocab, _ = TSVSeqLabelReader({'word': vect}, vocab_workers=2).build_vocab([file_name])
+    assert vocab == gold
+
+
+def test_vocab_counts_are_cached(tmpdir):
+    from baseline.vectorizers import Token1DVectorizer
+    file_name = str(tmpdir.join('data.tsv'))
+    _write_tsv(file_name, 100)
+    vect = Token1DVectorizer(mxlen=-1)
+    gold, gold_labels = TSVSeqLabelReader({'word': vect}, cache_dir=str(tmpdir)).build_vocab([file_name])
+    cached_vect = Token1DVectorizer(mxlen=-1)
+    with patch('baseline.reader.TSVSeqLabelReader._count_shard') as count_patch:
+        vocab, labels = TSVSeqLabelReader({'word': cached_vect}, cache_dir=str(tmpdir)).build_vocab([file_name])
+        count_patch.assert_not_called()
+    assert vocab == gold
+    assert labels == gold_labels
+    assert cached_vect.max_seen == vect.max_seen
+
+
+def test_tsv_vocab_and_streaming_from_glob(tmpdir):
+    from baseline.vectorizers import Token1DVectorizer
+    for i in range(3):
+        _write_tsv(str(tmpdir.join('data-{}.tsv'.format(i))), 40, seed=i)
+    files = [str(tmpdir.join('data-{}.tsv'.format(i))) for i in range(3)]
+    gold_vocab, gold_labels = TSVSeqLabelReader({'word': Token1DVectorizer()}).build_vocab(files)
+    reader = TSVSeqLabelReader({'word': Token1DVectorizer()}, vocab_workers=2, cache_dir=str(tmpdir))
+    pattern = str(tmpdir.join('data-*.tsv'))
+    vocab, labels = reader.build_vocab([pattern])
+    assert vocab == gold_vocab
+    assert labels == gold_labels
+    vocab = {'word': {k: i for i, k in enumerate(vocab['word'], 1)}}
+    gold = np.concatenate([batch['y'] for f in files for batch in reader.load(f, vocab, 4)])
+    ts = reader.load(pattern, vocab, 4, streaming=True)
+    np.testing.assert_equal(np.concatenate([batch['y'] for batch in ts]), gold)
+
+
+def test_conll_vocab_from_glob(tmpdir):
+    from baseline.reader import CONLLSeqReader
+    from baseline.vectorizers import Dict1DVectorizer
+    with open(os.path.join(TEST_LOC, 'eng.testb.small.conll')) as f:
+        data = f.read()
+    for i in range(2):
+        tmpdir.join('shard-{}.conll'.format(i)).write(data)
+    reader = CONLLSeqReader({'word': Dict1DVectorizer(fields='text')}, named_fields={'0': 'text', '-1': 'y'})
+    gold = reader.build_vocab([str(tmpdir.join('shard-{}.conll'.format(i))) for i in range(2)])
+    reader = CONLLSeqReader({'word': Dict1DVectorizer(fields='text')}, named_fields={'0': 'text', '-1': 'y'})
+    assert reader.build_vocab([str(tmpdir.join('shard-*.conll'))]) == gold
+
+
+def test_streaming_unsupported_raises():
+    from baseline.reader import ParallelSeqReader
+    from baseline.vectorizers import Token1DVectorizer
+    reader = ParallelSeqReader({'word': Token1DVectorizer()})
+    with pytest.raises(ValueError):
+        reader.load(os.path.join(TEST_LOC, 'test'), {'word': {}}, 2, streaming=True)
+    reader = TSVParallelCorpusReader({'src': Token1DVectorizer(), 'tgt': Token1DVectorizer()})
+    with pytest.raises(ValueError):
+        reader.load(os.path.join(TEST_LOC, 'test'), {'src': {}}, {}, 2, streaming=True)
+
+
+
+class _WholeFileReader(CONLLSeqReader):
+    """Says where its examples end but, unlike `CONLLSeqReader`, can only read whole files"""
+    def read_examples(self, tsfile):
+        return list(CONLLSeqReader.iter_examples(self, tsfile))
+
+    def iter_examples(self, tsfile, start=0, end=None):
+        return SeqPredictReader.iter_examples(self, tsfile, start, end)
+
+
+def test_base_iter_examples_reads_whole_files():
+    from baseline.vectorizers import Dict1DVectorizer
+    file_name = os.path.join(TEST_LOC, 'eng.testb.small.conll')
+    reader = _WholeFileReader({'word': Dict1DVectorizer(fields='text')}, named_fields={'0': 'text', '-1': 'y'})
+    assert list(reader.iter_examples(file_name)) == reader.read_examples(file_name)
+
+
+def test_parallel_vocab_worker_errors_propagate():
+    from baseline.vectorizers import Dict1DVectorizer
+    file_name = os.path.join(TEST_LOC, 'eng.testb.small.conll')
+    reader = _WholeFileReader({'word': Dict1DVectorizer(fields='text')}, named_fields={'0': 'text', '-1': 'y'},
+                              vocab_workers=2)
+    with pytest.raises(NotImplementedError):
+        reader.build_vocab([file_name])
+
+
+def test_conll_cache_hit_reads_texts_lazily(tmpdir):
+    from baseline.vectorizers import Dict1DVectorizer
+    file_name = os.path.join(TEST_LOC, 'eng.testb.small.conll')
+
+    def load():
+        reader = CONLLSeqReader({'word': Dict1DVectorizer(fields='text', mxlen=20)},
+                                named_fields={'0': 'text', '-1': 'y'}, cache_dir=str(tmpdir))
+        vocab = reader.build_vocab([file_name])
+        vocab = {'word': {k: i for i, k in enumerate(vocab['word'], 1)}}
+        return reader.load(file_name, vocab, 2)
+
+    gold, gold_texts = load()
+    with patch.object(CONLLSeqReader, 'read_examples', autospec=True,
+                      side_effect=CONLLSeqReader.read_examples) as read_patch:
+        ts, texts = load()
+        assert read_patch.call_count == 0
+        assert texts[3] == gold_texts[3]
+        assert len(texts) == len(gold_texts)
+        assert read_patch.call_count == 1
+    for batch, gold_batch in zip(ts, gold):
+        for k in gold_batch:
+            np.testing.assert_equal(batch[k], gold_batch[k])
+
+
+def test_streaming_counts_examples_once(tmpdir):
+    from baseline.vectorizers import Token1DVectorizer
+    files = [str(tmpdir.join('data-{}.tsv'.format(i))) for i in range(2)]
+    for i, file_name in enumerate(files):
+        _write_tsv(file_name, 30, seed=i)
+    reader = TSVSeqLabelReader({'word': Token1DVectorizer()}, cache_dir=str(tmpdir.join('cache')))
+    vocab, _ = reader.build_vocab(files)
+    vocab = {'word': {k: i for i, k in enumerate(vocab['word'], 1)}}
+    pattern = str(tmpdir.join('data-*.tsv'))
+    gold = len(reader.load(pattern, vocab, 4, streaming=True))
+    with patch.object(TSVSeqLabelReader, '_iter_labels_and_sentences', autospec=True,
+                      side_effect=TSVSeqLabelReader._iter_labels_and_sentences) as read_patch:
+        assert len(reader.load(pattern, vocab, 4, streaming=True)) == gold
+        read_patch.assert_not_called()
+        assert len(reader.load(pattern, vocab, 4, streaming=True, num_examples=10)) == 3
+        read_patch.assert_not_called()
+
+
+@pytest.mark.parametrize('bucketing', [{'buckets': 4}, {'max_tokens': 100}])
+def test_streaming_with_buckets_raises(tmpdir, bucketing):
+    from baseline.reader import CONLLSeqReader, LineSeqReader
+    from baseline.vectorizers import Token1DVectorizer, Dict1DVectorizer
+    with pytest.raises(ValueError):
+        TSVSeqLabelReader({'word': Token1DVectorizer()}).load(
+            os.path.join(TEST_LOC, 'tsv_unstruct_file.tsv'), {'word': {}}, 2, streaming=True, **bucketing
+        )
+    with pytest.raises(ValueError):
+        CONLLSeqReader({'word': Dict1DVectorizer(fields='text')}).load(
+            os.path.join(TEST_LOC, 'eng.testb.small.conll'), {'word': {}}, 2, streaming=True, **bucketing
+        )
+    file_name = str(tmpdir.join('corpus.txt'))
+    _write_corpus(file_name, 10)
+    with pytest.raises(ValueError):
+        LineSeqReader({'x': Token1DVectorizer()}, trim=False, nctx=7).load(
+            file_name, {'x': {}}, 2, streaming=True, **bucketing
+        )
@@ -0,0 +1,329 @@
+import json
+import asyncio
+import time
+import threading
+import pytest
+import numpy as np
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.socketserver import ThreadingMixIn
+torch = pytest.importorskip('torch')
+from baseline.remote import RemoteModelREST, TENSORS_CONTENT_TYPE, encode_tensors, decode_tensors
+from baseline.pytorch.remote import RemoteModelRESTPytorch
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        tensors = self.headers['Content-Type'] == TENSORS_CONTENT_TYPE
+        with server.lock:
+            server.content_types.add(self.headers['Content-Type'])
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        # Echo the first input back as the class so the order of the results can be checked
+        if tensors:
+            inputs, _ = decode_tensors(body)
+            first = inputs['word'].ravel()[0]
+            body = encode_tensors({'classes': np.array([[first]]), 'scores': np.array([[1.0]], dtype=np.float32)})
+        else:
+            first = json.loads(body.decode('utf-8'))['inputs']['data'][0][0]
+            body = json.dumps({'outputs': {'classes': [[first]], 'scores': [[1.0]]}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', TENSORS_CONTENT_TYPE if tensors else 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Close without saying so, like a server timing out an idle connection
+        self.close_connection = server.drop_connections
+
+    def log_message(self, *args):
+        pass
+
+
+class _StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    server = _StubServer(('localhost', 0), _Handler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.delay = 0
+    server.drop_connections = False
+    server.content_types = set()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _remote(server, **kwargs):
+    return RemoteModelRESTPytorch(
+        'http://localhost:{}'.format(server.server_address[1]), 'model', 'predict_text',
+        inputs=['word'], lengths_key='word_lengths', return_labels=False, **kwargs
+    )
+
+
+def _examples(batchsz):
+    return {'word': np.arange(batchsz * 3).reshape(batchsz, 3), 'word_lengths': np.full(batchsz, 3)}
+
+
+def _classes(results):
+    return [r[0][0] for r in results]
+
+
+def test_rest_reuses_connections(server):
+    remote = _remote(server, concurrency=1)
+    for _ in range(5):
+        assert _classes(remote.predict(_examples(2))) == [0, 3]
+    assert server.connections == 1
+
+
+def test_rest_reconnects_when_server_closes(server):
+    server.drop_connections = True
+    remote = _remote(server, concurrency=1)
+    for _ in range(3):
+        assert _classes(remote.predict(_examples(2))) == [0, 3]
+    assert server.connections == 6
+
+
+def test_rest_fan_out_in_order(server):
+    server.delay = 0.01
+    remote = _remote(server, pool_size=4)
+    assert _classes(remote.predict(_examples(16))) == list(range(0, 48, 3))
+    assert 1 < server.max_in_flight <= 4
+    assert server.connections <= 4
+
+
+def test_rest_fan_out_faster(server):
+    server.delay = 0.05
+    examples = _examples(12)
+    start = time.time()
+    serial = _remote(server, concurrency=1).predict(examples)
+    serial_time = time.time() - start
+    start = time.time()
+    concurrent = _remote(server, pool_size=12).predict(examples)
+    concurrent_time = time.time() - start
+    assert _classes(concurrent) == _classes(serial)
+    assert concurrent_time < serial_time / 2
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_rest_apredict_matches_predict(server):
+    remote = _remote(server)
+    examples = _examples(6)
+    assert _classes(_run(remote.apredict(examples))) == _classes(remote.predict(examples))
+
+
+def test_rest_apredict_shares_pool(server):
+    server.delay = 0.02
+    remote = _remote(server, pool_size=3)
+
+    async def many():
+        return await asyncio.gather(*[remote.apredict(_examples(4)) for _ in range(5)])
+
+    results = _run(many())
+    assert [_classes(r) for r in results] == [[0, 3, 6, 9]] * 5
+    assert 1 < server.max_in_flight <= 3
+    assert server.connections <= 3
+
+
+def test_rest_apredict_deadline(server):
+    server.delay = 0.5
+    remote = _remote(server)
+
+    async def late_then_ok():
+        with pytest.raises(asyncio.TimeoutError):
+            await remote.apredict(_examples(1), timeout=0.05)
+        server.delay = 0
+        return await remote.apredict(_examples(2))
+
+    assert _classes(_run(late_then_ok())) == [0, 3]
+
+
+def test_rest_apredict_reconnects_when_server_closes(server):
+    server.drop_connections = True
+    remote = _remote(server, pool_size=1)
+
+    async def sequential():
+        return [_classes(await remote.apredict(_examples(1))) for _ in range(3)]
+
+    assert _run(sequential()) == [[0]] * 3
+
+
+def test_service_apredict(server):
+    from baseline.services import ClassifierService
+    from baseline.vectorizers import Token1DVectorizer
+    vocab = {w: i for i, w in enumerate(['<PAD>', '<UNK>', 'a', 'b', 'c'])}
+    remote = _remote(server, labels=['label-{}'.format(i) for i in range(5)])
+    service = ClassifierService({'word': vocab}, {'word': Token1DVectorizer(mxlen=-1)}, remote)
+    tokens = [['a', 'b'], ['c', 'a']]
+    gold = service.predict(tokens)
+    assert gold == [[('label-2', 1.0)], [('label-4', 1.0)]]
+    assert _run(service.apredict(tokens)) == gold
+
+
+def test_service_apredict_local_model():
+    from baseline.services import ClassifierService
+    from baseline.vectorizers import Token1DVectorizer
+
+    class Model(object):
+        def predict(self, examples):
+            return [[('label-{}'.format(x[0]), np.float32(1.0))] for x in examples['word']]
+
+        def get_labels(self):
+            return []
+
+    vocab = {w: i for i, w in enumerate(['<PAD>', '<UNK>', 'a', 'b', 'c'])}
+    service = ClassifierService({'word': vocab}, {'word': Token1DVectorizer(mxlen=-1)}, Model())
+    tokens = [['a', 'b'], ['c', 'a']]
+    assert _run(service.apredict(tokens)) == service.predict(tokens) == [[('label-2', 1.0)], [('label-4', 1.0)]]
+
+
+def test_apredict_remote_without_apredict():
+    from baseline.remote import RemoteModel
+    from baseline.aio import apredict_model
+
+    class Remote(RemoteModel):
+        """A remote that only knows how to predict synchronously"""
+        def predict(self, examples, **kwargs):
+            return [[('label-{}'.format(x[0]), np.float32(1.0))] for x in examples['word']]
+
+    remote = Remote('localhost:0', 'model', 'sig')
+    examples = {'word': np.array([[2, 3], [4, 2]])}
+    assert _run(apredict_model(remote, examples)) == remote.predict(examples)
+
+
+def test_micro_batching_remote(server):
+    from baseline.services import ClassifierService, MicroBatchingService
+    from baseline.vectorizers import Token1DVectorizer
+    vocab = {w: i for i, w in enumerate(['<PAD>', '<UNK>', 'a', 'b', 'c'])}
+    remote = _remote(server, labels=['label-{}'.format(i) for i in range(5)])
+    service = ClassifierService({'word': vocab}, {'word': Token1DVectorizer(mxlen=-1)}, remote)
+    batcher = MicroBatchingService(service, max_batch_size=8, max_wait_ms=50, num_workers=2)
+    words = ['a', 'b', 'c'] * 4
+    futures = [batcher.submit([w]) for w in words]
+    results = [f.result() for f in futures]
+    batcher.close()
+    assert results == [[[('label-{}'.format(vocab[w]), 1.0)]] for w in words]
+    assert batcher.metrics()['batches'] < len(words)
+
+
+def test_tensors_round_trip():
+    tensors = {
+        'ints': np.arange(12, dtype=np.int64).reshape(3, 4),
+        'floats': np.random.rand(2, 3).astype(np.float32),
+        'big_endian': np.arange(5, dtype='>i4'),
+        'strided': np.arange(20).reshape(4, 5)[:, ::2],
+        'labels': np.array(['O', 'B-PER', 'I-PER']),
+        'objects': np.array(['a', 'bc'], dtype=object),
+        'bools': np.array([True, False, True]),
+        'empty': np.zeros((0, 3)),
+        'scalar': np.float64(3.5),
+    }
+    data = encode_tensors(tensors, signature_name='tag_text')
+    decoded, meta = decode_tensors(data)
+    assert meta == {'signature_name': 'tag_text'}
+    assert list(decoded.keys()) == list(tensors.keys())
+    for name, tensor in tensors.items():
+        np.testing.assert_array_equal(decoded[name], tensor)
+        assert decoded[name].shape == np.shape(tensor)
+    assert decoded['objects'].dtype.kind == 'U'
+    assert decoded['big_endian'].dtype == np.dtype('<i4')
+    # Arrays are aligned views of the payload
+    for tensor in decoded.values():
+        assert not tensor.flags.owndata
+        assert tensor.flags.aligned
+
+
+def test_tensors_not_a_payload():
+    with pytest.raises(ValueError):
+        decode_tensors(b'{"outputs": []}')
+
+
+def _rest(signature, **kwargs):
+    return RemoteModelREST('http://localhost:1234', 'model', signature, inputs=['word'], lengths_key='word_lengths', **kwargs)
+
+
+def test_tensors_deserialize_like_json():
+    outputs = {'classes': np.array([[3, 1, 2], [0, 2, 1]]), 'scores': np.array([[0.5, 0.3, 0.2], [0.9, 0.05, 0.05]])}
+    examples = {'word': np.ones((2, 3), dtype=np.int64), 'word_lengths': np.array([3, 2])}
+    json_outputs = json.dumps({'outputs': {k: v.tolist() for k, v in outputs.items()}}).encode('utf-8')
+    tensor_outputs = encode_tensors(outputs)
+    for signature in ('predict_text', 'tag_text', 'embed_text'):
+        remote = _rest(signature, wire_format='tensors')
+        from_json = remote.deserialize_response(examples, remote.parse_response(json_outputs))
+        from_tensors = remote.deserialize_response(examples, remote.parse_response(tensor_outputs))
+        if signature == 'predict_text':
+            assert from_json == from_tensors
+            assert isinstance(from_tensors[0][0][0], np.int32)
+            assert isinstance(from_tensors[0][0][1], np.float32)
+        else:
+            assert len(from_json) == len(from_tensors)
+            for a, b in zip(from_json, from_tensors):
+                np.testing.assert_array_equal(a, b)
+    tagged = _rest('tag_text').deserialize_response(examples, outputs)
+    assert [t.tolist() for t in tagged] == [[3, 1, 2], [0, 2]]
+
+
+def test_tensors_error():
+    remote = _rest('predict_text', wire_format='tensors')
+    with pytest.raises(ValueError):
+        remote.parse_response(encode_tensors({}, error='bad input'))
+    with pytest.raises(ValueError):
+        remote.parse_response(b'{"error": "bad input"}')
+
+
+def test_unknown_wire_format():
+    with pytest.raises(ValueError):
+        _rest('predict_text', wire_format='msgpack')
+
+
+def test_rest_tensors(server):
+    examples = _examples(5)
+    json_results = _remote(server).predict(examples)
+    remote = _remote(server, wire_format='tensors')
+    assert _classes(remote.predict(examples)) == _classes(json_results) == list(range(0, 15, 3))
+    assert _classes(_run(remote.apredict(examples))) == _classes(json_results)
+    assert server.content_types == {'application/json', TENSORS_CONTENT_TYPE}
+
+
+@pytest.mark.parametrize('wire_formats,gold', [(None, 'json'), (['json'], 'json'), (['json', 'tensors'], 'tensors')])
+def test_wire_format_comes_from_assets(tmpdir, wire_formats, gold):
+    from baseline.services import Service
+    from baseline.utils import write_json
+    from mead.utils import create_metadata
+    meta = create_metadata(['word'], ['output'], 'predict_text', 'model', 'word_lengths')
+    if wire_formats is None:
+        meta['metadata'].pop('wire_formats')
+    else:
+        meta['metadata']['wire_formats'] = wire_formats
+    write_json(meta, str(tmpdir.join('model.assets')))
+    write_json(['a', 'b'], str(tmpdir.join('model.labels')))
+    remote, _ = Service._create_remote_model(str(tmpdir), 'pytorch', 'http://localhost:1234', 'model',
+                                             'predict_text', 1)
+    assert remote.wire_format == gold
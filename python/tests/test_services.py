@@ -0,0 +1,308 @@
+import time
+import asyncio
+import threading
+import pytest
+import numpy as np
+pytest.importorskip('concurrent.futures')
+from mock import patch
+from baseline.services import Service, ClassifierService, EmbeddingsService, MicroBatchingService, PredictionCache
+from baseline.vectorizers import Token1DVectorizer, Char2DVectorizer
+
+VOCAB = {w: i for i, w in enumerate(['<PAD>', '<UNK>', 'a', 'b', 'c', 'd'])}
+
+
+class _Classifier(object):
+    """Labels each example with its first word and remembers the size of each batch"""
+
+    def __init__(self, delay=0, error=None):
+        self.delay = delay
+        self.error = error
+        self.batch_sizes = []
+
+    def predict(self, examples):
+        self.batch_sizes.append(len(examples['word']))
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [[('label-{}'.format(x[0]), np.float32(1.0))] for x in examples['word']]
+
+    def get_labels(self):
+        return []
+
+
+class _PrefixService(Service):
+    """Labels each example with a prefix passed to `predict` and its first word"""
+
+    def prepare(self, tokens, prefix=''):
+        tokens_seq, mxlen, mxwlen = self.batch_input(tokens)
+        return self.vectorize(tokens_seq, mxlen, mxwlen), None
+
+    def format_output(self, outcomes, inputs, prefix=''):
+        return [prefix + label for ((label, _),) in outcomes]
+
+
+def _classifier_service(model):
+    return ClassifierService({'word': VOCAB}, {'word': Token1DVectorizer(mxlen=-1)}, model)
+
+
+def _in_threads(fn, inputs):
+    results = [None] * len(inputs)
+
+    def run(i):
+        results[i] = fn(inputs[i])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_batches_concurrent_requests():
+    model = _Classifier()
+    batcher = MicroBatchingService(_classifier_service(model), max_batch_size=64, max_wait_ms=200)
+    words = ['a', 'b', 'c', 'd'] * 4
+    # Utterances of different lengths get padded together
+    inputs = [[w] * (i % 3 + 1) for i, w in enumerate(words)]
+    results = _in_threads(batcher.predict, inputs)
+    batcher.close()
+    assert results == [[[('label-{}'.format(VOCAB[w]), 1.0)]] for w in words]
+    assert len(model.batch_sizes) < len(inputs)
+    metrics = batcher.metrics()
+    assert metrics['requests'] == metrics['examples'] == len(inputs)
+    assert metrics['batches'] == len(model.batch_sizes)
+    assert metrics['max_batch_size'] == max(model.batch_sizes)
+    assert metrics['avg_batch_size'] > 1
+    assert 0 <= metrics['avg_queue_delay_ms'] <= metrics['max_queue_delay_ms']
+
+
+def test_batch_matches_predict():
+    model = _Classifier()
+    service = _classifier_service(model)
+    batcher = MicroBatchingService(service)
+    tokens = [['a', 'b'], ['c'], ['d', 'a', 'a']]
+    assert batcher.predict(tokens) == service.predict(tokens)
+    assert batcher.predict(['b', 'c']) == service.predict(['b', 'c'])
+    batcher.close()
+
+
+def test_max_batch_size():
+    model = _Classifier(delay=0.01)
+    batcher = MicroBatchingService(_classifier_service(model), max_batch_size=4, max_wait_ms=100)
+    futures = [batcher.submit([['a'], ['b']]) for _ in range(6)] + [batcher.submit(['c']) for _ in range(6)]
+    results = [f.result() for f in futures]
+    batcher.close()
+    assert results[:6] == [[[('label-2', 1.0)], [('label-3', 1.0)]]] * 6
+    assert max(model.batch_sizes) <= 4
+    assert batcher.metrics()['max_batch_size'] <= 4
+
+
+def test_request_bigger_than_max_batch_size():
+    model = _Classifier()
+    batcher = MicroBatchingService(_classifier_service(model), max_batch_size=2)
+    assert len(batcher.predict([['a']] * 5)) == 5
+    batcher.close()
+    assert model.batch_sizes == [5]
+
+
+def test_max_wait():
+    model = _Classifier()
+    batcher = MicroBatchingService(_classifier_service(model), max_batch_size=64, max_wait_ms=50)
+    start = time.time()
+    batcher.predict(['a'])
+    elapsed = time.time() - start
+    batcher.close()
+    assert 0.04 < elapsed < 1
+    assert model.batch_sizes == [1]
+
+
+def test_only_batches_same_kwargs():
+    model = _Classifier()
+    service = _PrefixService({'word': VOCAB}, {'word': Token1DVectorizer(mxlen=-1)}, model)
+    batcher = MicroBatchingService(service, max_wait_ms=100)
+    futures = [batcher.submit([['a'], ['b']], prefix='x-'), batcher.submit(['c'], prefix='y-'), batcher.submit(['d'], prefix='x-')]
+    results = [f.result() for f in futures]
+    batcher.close()
+    assert results == [['x-label-2', 'x-label-3'], ['y-label-4'], ['x-label-5']]
+    assert sorted(model.batch_sizes) == [1, 3]
+
+
+def test_errors_go_to_every_caller():
+    model = _Classifier(error=ValueError('bad batch'))
+    batcher = MicroBatchingService(_classifier_service(model), max_wait_ms=100)
+    futures = [batcher.submit(['a']) for _ in range(3)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result()
+    batcher.close()
+    assert model.batch_sizes == [3]
+
+
+def test_closed():
+    batcher = MicroBatchingService(_classifier_service(_Classifier()))
+    batcher.close()
+    with pytest.raises(ValueError):
+        batcher.submit(['a'])
+
+
+def test_needs_prepare():
+    with pytest.raises(ValueError):
+        MicroBatchingService(Service())
+
+
+def test_apredict():
+    model = _Classifier()
+    batcher = MicroBatchingService(_classifier_service(model), max_wait_ms=100)
+
+    async def many():
+        return await asyncio.gather(*[batcher.apredict([w]) for w in ['a', 'b', 'c']])
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(many())
+    finally:
+        loop.close()
+    batcher.close()
+    assert results == [[[('label-{}'.format(i), 1.0)]] for i in (2, 3, 4)]
+    assert model.batch_sizes == [3]
+
+
+def test_cache_sends_only_misses():
+    model = _Classifier()
+    service = _classifier_service(model)
+    cache = service.enable_cache(max_size=16)
+    first = service.predict([['a', 'b'], ['c', 'd']])
+    assert service.predict([['a', 'b'], ['c', 'd']]) == first
+    assert model.batch_sizes == [2]
+    # Same padding, one new example
+    assert service.predict([['c', 'd'], ['b', 'c']]) == [first[1], [('label-3', 1.0)]]
+    assert model.batch_sizes == [2, 1]
+    assert cache.stats() == {'hits': 3, 'misses': 3, 'hit_rate': 0.5, 'size': 3}
+
+
+def test_cache_key_changes_with_vectorized_input():
+    model = _Classifier()
+    service = _classifier_service(model)
+    service.enable_cache()
+    service.predict(['a'])
+    # Padded to a different length when batched with a longer example, so it is a different key
+    service.predict([['a'], ['b', 'c']])
+    assert model.batch_sizes == [1, 2]
+    examples = {'word': np.array([[2, 3]]), 'word_lengths': np.array([2])}
+    assert PredictionCache.keys(examples) == PredictionCache.keys(dict(examples))
+    assert PredictionCache.keys(examples) != PredictionCache.keys(examples, [('beam', 5)])
+    assert PredictionCache.keys(examples) != PredictionCache.keys({'word': np.array([[2, 3, 0]]), 'word_lengths': np.array([2])})
+
+
+def test_cache_lru():
+    cache = PredictionCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_cache_ttl():
+    cache = PredictionCache(ttl=10)
+    with patch('baseline.services.time.time', return_value=100.0):
+        cache.put('a', 1)
+    with patch('baseline.services.time.time', return_value=109.0):
+        assert cache.get('a') == 1
+    with patch('baseline.services.time.time', return_value=111.0):
+        assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+class _Embedder(object):
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, examples):
+        self.batch_sizes.append(len(examples['word']))
+        return examples['word'][:, :, np.newaxis] * np.array([1.0, 0.5, 0.25])
+
+
+def test_cache_embeddings_as_arrays():
+    model = _Embedder()
+    service = EmbeddingsService({'word': VOCAB}, {'word': Token1DVectorizer(mxlen=-1)}, model)
+    service.enable_cache()
+    first = service.predict([['a', 'b'], ['c', 'd']])
+    second = service.predict([['c', 'd'], ['a', 'b']])
+    assert model.batch_sizes == [2]
+    gold = model.predict(service.vectorize([['a', 'b'], ['c', 'd']], 2, 1))
+    assert isinstance(second, np.ndarray) and second.dtype == np.float32
+    np.testing.assert_allclose(first, gold)
+    np.testing.assert_allclose(second, gold[::-1])
+    assert all(isinstance(value, np.ndarray) for value, _ in service.cache._entries.values())
+
+    service.enable_cache(dtype=np.float16)
+    service.predict([['a', 'b']])
+    assert service.predict([['a', 'b']]).dtype == np.float16
+
+
+def test_cache_apredict():
+    model = _Classifier()
+    service = _classifier_service(model)
+    service.enable_cache()
+    gold = service.predict([['a'], ['b']])
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(service.apredict([['a'], ['b']])) == gold
+        assert loop.run_until_complete(service.apredict([['a'], ['c']])) == [gold[0], [('label-4', 1.0)]]
+    finally:
+        loop.close()
+    assert model.batch_sizes == [2, 1]
+
+
+class _Shapes(object):
+    """Reports the shape and lengths of each example it sees"""
+
+    def __init__(self):
+        self.shapes = []
+
+    def predict(self, examples):
+        self.shapes.append({k: v.shape for k, v in examples.items()})
+        time.sleep(0.001)
+        return [[('{}'.format(l), np.float32(1.0))] for l in examples['word_lengths']]
+
+    def get_labels(self):
+        return []
+
+
+def test_predict_does_not_change_vectorizers():
+    vectorizers = {'word': Token1DVectorizer(mxlen=-1), 'char': Char2DVectorizer(mxlen=-1, mxwlen=-1)}
+    service = ClassifierService({'word': VOCAB, 'char': VOCAB}, vectorizers, _Shapes())
+    service.predict([['a', 'b', 'c'], ['d']])
+    assert vectorizers['word'].mxlen == -1
+    assert vectorizers['char'].mxlen == -1 and vectorizers['char'].mxwlen == -1
+    assert service.model.shapes == [{'word': (2, 3), 'word_lengths': (2,), 'char': (2, 3, 1), 'char_lengths': (2,)}]
+
+
+def test_predict_from_many_threads():
+    service = ClassifierService({'word': VOCAB}, {'word': Token1DVectorizer(mxlen=-1)}, _Shapes())
+    inputs = [['a'] * (i % 7 + 1) for i in range(64)]
+    results = _in_threads(service.predict, inputs)
+    assert results == [[[('{}'.format(len(tokens)), 1.0)]] for tokens in inputs]
+
+
+def test_length_buckets():
+    model = _Shapes()
+    service = ClassifierService({'word': VOCAB}, {'word': Token1DVectorizer(mxlen=12)}, model)
+    service.set_length_buckets()
+    for n in (1, 2, 3, 5, 9, 15):
+        assert service.predict(['a'] * n) == [[('{}'.format(n), 1.0)]]
+    # Powers of two up to the exported length, past it the batch is its own length
+    assert [shape['word'][1] for shape in model.shapes] == [1, 2, 4, 8, 12, 15]
+    assert service.vectorizers['word'].mxlen == 12
+
+    model.shapes = []
+    service.set_length_buckets(mxlen=[4, 10])
+    for n in (1, 4, 7, 11):
+        service.predict(['a'] * n)
+    assert [shape['word'][1] for shape in model.shapes] == [4, 4, 10, 11]
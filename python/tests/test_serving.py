@@ -0,0 +1,101 @@
+import pytest
+import numpy as np
+from mock import patch, MagicMock
+pytest.importorskip('google.protobuf')
+from baseline import serving
+from baseline.serving import make_tensor_proto, make_ndarray, PredictRequest, PredictResponse, TensorProto
+from baseline.remote import RemoteModelGRPC
+
+
+def test_tensor_proto_wire_format():
+    # The bytes tensorflow writes for tf.make_tensor_proto(np.array([1, 2], dtype=np.int32))
+    gold = b'\x08\x03\x12\x04\x12\x02\x08\x02\x22\x08\x01\x00\x00\x00\x02\x00\x00\x00'
+    assert make_tensor_proto(np.array([1, 2])).SerializeToString() == gold
+    np.testing.assert_array_equal(make_ndarray(TensorProto.FromString(gold)), [1, 2])
+
+
+def test_round_trip():
+    for values in (np.arange(12).reshape(3, 4), np.random.rand(2, 5).astype(np.float32)):
+        tensor = make_tensor_proto(values)
+        assert len(tensor.tensor_content) == values.size * 4
+        np.testing.assert_allclose(make_ndarray(TensorProto.FromString(tensor.SerializeToString())), values)
+    strings = make_ndarray(make_tensor_proto(np.array(['the dog', 'a cat'])))
+    assert strings.tolist() == [b'the dog', b'a cat']
+
+
+def test_shape():
+    tensor = make_tensor_proto(np.array(['a', 'b', 'c']), shape=[3, 1])
+    assert make_ndarray(tensor).shape == (3, 1)
+
+
+def test_repeated_fields():
+    tensor = TensorProto(dtype=serving.DT_FLOAT, float_val=[1.0, 2.0, 3.0, 4.0])
+    tensor.tensor_shape.dim.add(size=2)
+    tensor.tensor_shape.dim.add(size=2)
+    result = make_ndarray(tensor)
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, [[1, 2], [3, 4]])
+
+    tensor = TensorProto(dtype=serving.DT_INT64, int64_val=[7])
+    tensor.tensor_shape.dim.add(size=3)
+    np.testing.assert_array_equal(make_ndarray(tensor), [7, 7, 7])
+
+    tensor = TensorProto(dtype=serving.DT_HALF, half_val=np.array([1.5, -2], dtype=np.float16).view(np.uint16).tolist())
+    tensor.tensor_shape.dim.add(size=2)
+    np.testing.assert_array_equal(make_ndarray(tensor), np.array([1.5, -2], dtype=np.float16))
+
+
+def test_bad_shape():
+    tensor = TensorProto(dtype=serving.DT_INT32, int_val=[1, 2])
+    tensor.tensor_shape.dim.add(size=3)
+    with pytest.raises(ValueError):
+        make_ndarray(tensor)
+
+
+def _grpc_remote(signature, **kwargs):
+    def import_module(name):
+        return serving if name == 'baseline.serving' else MagicMock()
+
+    with patch('baseline.remote.import_user_module', side_effect=import_module):
+        return RemoteModelGRPC(
+            'localhost:9000', 'model', signature, inputs=['word'], lengths_key='word_lengths', version=2, **kwargs
+        )
+
+
+def test_grpc_create_request():
+    remote = _grpc_remote('tag_text')
+    word = np.arange(6).reshape(2, 3)
+    request = PredictRequest.FromString(remote.create_request({'word': word}).SerializeToString())
+    assert request.model_spec.name == 'model'
+    assert request.model_spec.signature_name == 'tag_text'
+    assert request.model_spec.version.value == 2
+    np.testing.assert_array_equal(make_ndarray(request.inputs['word']), word)
+
+
+def _response(**outputs):
+    response = PredictResponse()
+    for name, values in outputs.items():
+        make_tensor_proto(values, response.outputs[name])
+    return PredictResponse.FromString(response.SerializeToString())
+
+
+def test_grpc_deserialize():
+    examples = {'word_lengths': np.array([3, 1])}
+    response = _response(classes=np.array([[2, 0, 1], [1, 1, 1]]))
+    tagged = _grpc_remote('tag_text').deserialize_response(examples, response)
+    assert [t.tolist() for t in tagged] == [[2, 0, 1], [1]]
+    assert tagged[0].dtype == np.int32
+
+    response = _response(classes=np.array([['B-PER', 'O', 'O'], ['O', 'O', 'O']]))
+    tagged = _grpc_remote('tag_text', return_labels=True).deserialize_response(examples, response)
+    assert [t.tolist() for t in tagged] == [['B-PER', 'O', 'O'], ['O']]
+
+    response = _response(classes=np.array([[1, 0], [0, 1]]), scores=np.array([[0.75, 0.25], [0.5, 0.5]]))
+    classified = _grpc_remote('predict_text', labels=['neg', 'pos']).deserialize_response(examples, response)
+    assert classified == [[(1, 0.75), (0, 0.25)], [(0, 0.5), (1, 0.5)]]
+    assert isinstance(classified[0][0][0], np.int32)
+    assert isinstance(classified[0][0][1], np.float32)
+
+    scores = np.random.rand(2, 4).astype(np.float32)
+    embedded = _grpc_remote('embed_text').deserialize_response(examples, _response(scores=scores))
+    np.testing.assert_array_equal(embedded, scores)
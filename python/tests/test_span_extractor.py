@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from baseline.utils import (
+    to_spans,
+    span_f1,
+    per_entity_f1,
+    SpanExtractor,
+    span_f1_from_counts,
+    per_entity_f1_from_counts,
+)
+
+IOB_LABELS = ['<PAD>', 'O', 'B-PER', 'I-PER', 'B-LOC', 'I-LOC', 'I-MISC', 'B-ORG-B-X', '<GO>']
+IOBES_LABELS = ['<PAD>', 'O', 'B-PER', 'I-PER', 'E-PER', 'S-PER', 'B-LOC', 'I-LOC', 'E-LOC', 'S-LOC', 'S-MISC', '<EOS>']
+
+
+def _lut(labels):
+    return {i: l for i, l in enumerate(labels)}
+
+
+def _as_strings(extractor, rows, types, starts, ends, batchsz):
+    chunks = [[] for _ in range(batchsz)]
+    for b, t, s, e in zip(rows, types, starts, ends):
+        chunks[b].append('@'.join([extractor.types[t]] + ['%d' % i for i in range(s, e)]))
+    return chunks
+
+
+def _random_batch(labels, batchsz=40, mxlen=12, o_weight=3):
+    # Mostly legal looking sequences with plenty of illegal transitions mixed in
+    weights = np.ones(len(labels))
+    weights[labels.index('O')] = o_weight
+    lengths = np.random.randint(0, mxlen + 1, size=batchsz)
+    batch = np.random.choice(len(labels), size=(batchsz, mxlen), p=weights / weights.sum())
+    return batch, lengths
+
+
+@pytest.mark.parametrize('span_type,labels', [
+    ('iob', IOB_LABELS), ('iob2', IOB_LABELS), ('bio', IOB_LABELS), ('iobes', IOBES_LABELS)
+])
+def test_extract_matches_to_spans(span_type, labels):
+    lut = _lut(labels)
+    extractor = SpanExtractor(lut, span_type)
+    for _ in range(20):
+        batch, lengths = _random_batch(labels)
+        found = _as_strings(extractor, *extractor.extract(batch, lengths), batchsz=len(batch))
+        gold = [to_spans(row[:l], lut, span_type) for row, l in zip(batch, lengths)]
+        assert found == gold
+
+
+def test_extract_ragged():
+    lut = _lut(IOB_LABELS)
+    extractor = SpanExtractor(lut, 'iob')
+    batch, lengths = _random_batch(IOB_LABELS)
+    ragged = [row[:l] for row, l in zip(batch, lengths)]
+    for a, b in zip(extractor.extract(ragged, lengths), extractor.extract(batch, lengths)):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_extract_empty():
+    extractor = SpanExtractor(_lut(IOB_LABELS), 'iob')
+    rows, types, starts, ends = extractor.extract(np.zeros((3, 5), dtype=int), [0, 0, 0])
+    assert len(rows) == len(types) == len(starts) == len(ends) == 0
+    assert extractor.count(np.zeros((0, 5), dtype=int), np.zeros((0, 5), dtype=int), []).sum() == 0
+
+
+@pytest.mark.parametrize('span_type,labels', [('iob', IOB_LABELS), ('bio', IOB_LABELS), ('iobes', IOBES_LABELS)])
+def test_metrics_identical(span_type, labels):
+    lut = _lut(labels)
+    extractor = SpanExtractor(lut, span_type)
+    counts = 0
+    golds, preds = [], []
+    for _ in range(10):
+        gold, lengths = _random_batch(labels)
+        # Start from the gold so a good number of chunks match
+        pred = np.where(np.random.rand(*gold.shape) < 0.2, np.random.randint(len(labels), size=gold.shape), gold)
+        counts = counts + extractor.count(gold, pred, lengths)
+        golds.extend(set(to_spans(g[:l], lut, span_type)) for g, l in zip(gold, lengths))
+        preds.extend(set(to_spans(p[:l], lut, span_type)) for p, l in zip(pred, lengths))
+    assert counts[0].sum() > 0
+    assert span_f1_from_counts(*counts) == span_f1(golds, preds)
+    assert per_entity_f1_from_counts(*counts, types=extractor.types) == per_entity_f1(golds, preds)
+
+
+def test_no_entity_labels():
+    extractor = SpanExtractor(_lut(['O']), 'iob')
+    counts = extractor.count(np.zeros((2, 3), dtype=int), np.zeros((2, 3), dtype=int), [3, 2])
+    assert counts.shape == (3, 0)
+    assert span_f1_from_counts(*counts) == span_f1([set(), set()], [set(), set()])
+
+
+def test_pytorch_process_output():
+    torch = pytest.importorskip('torch')
+    from baseline.pytorch.tagger.train import TaggerTrainerPyTorch
+    lut = _lut(IOB_LABELS)
+    trainer = TaggerTrainerPyTorch.__new__(TaggerTrainerPyTorch)
+    trainer.idx2label = lut
+    trainer.spans = SpanExtractor(lut, 'iob')
+    truth, lengths = _random_batch(IOB_LABELS)
+    pred = np.random.randint(len(IOB_LABELS), size=truth.shape)
+    guess = [torch.from_numpy(p[:l]) for p, l in zip(pred, lengths)]
+    correct, total, counts = trainer.process_output(guess, torch.from_numpy(truth), torch.from_numpy(lengths), None)
+    assert correct == sum(np.sum(p[:l] == t[:l]) for p, t, l in zip(pred, truth, lengths))
+    assert total == lengths.sum()
+    golds = [set(to_spans(t[:l], lut, 'iob')) for t, l in zip(truth, lengths)]
+    preds = [set(to_spans(p[:l], lut, 'iob')) for p, l in zip(pred, lengths)]
+    assert per_entity_f1_from_counts(*counts, types=trainer.spans.types) == per_entity_f1(golds, preds)
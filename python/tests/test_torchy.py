@@ -55,3 +55,17 @@ def test_token_sequence_loss(logits, labels, lengths):
     crit = SequenceCriterion(LossFn=loss, avg='token')
     res = crit(logits, labels)
     np.testing.assert_allclose(res.numpy(), gold.numpy(), rtol=1e-6)
+
+
+def test_embedding_shares_mapped_weights(tmpdir):
+    from baseline.pytorch.torchy import pytorch_embedding
+    weights = np.random.rand(20, 5).astype(np.float32)
+    np.save(str(tmpdir.join('weights.npy')), weights)
+    mapped = np.load(str(tmpdir.join('weights.npy')), mmap_mode='c')
+    lut = pytorch_embedding(mapped, finetune=False)
+    assert lut.weight.data_ptr() == mapped.ctypes.data
+    assert not lut.weight.requires_grad
+    lut = pytorch_embedding(mapped, finetune=True)
+    assert lut.weight.data_ptr() != mapped.ctypes.data
+    assert lut.weight.requires_grad
+    np.testing.assert_equal(lut.weight.detach().numpy(), weights)
@@ -149,3 +149,84 @@ def test_parse_module_as_path_absolute():
             real_patch.assert_called_once_with(path)
     assert n == file_base
     assert d == path
+
+
+def _random_vocab(size=100):
+    words = set(rand_str() for _ in range(size)) | set(string.ascii_letters) | {u'é', u'\U0001f600', u''}
+    return {w: i for i, w in enumerate(['<PAD>', '<GO>', '<EOS>', '<UNK>'] + sorted(words - {'<UNK>'}))}
+
+
+def test_compiled_vocab_round_trip(tmpdir):
+    from baseline.utils import CompiledVocab
+    vocab = _random_vocab()
+    file_name = str(tmpdir.join('vocab.npz'))
+    CompiledVocab(vocab).save(file_name)
+    loaded = CompiledVocab.load(file_name)
+    assert isinstance(loaded, CompiledVocab)
+    assert loaded == vocab
+
+
+def test_compiled_vocab_round_trip_empty(tmpdir):
+    from baseline.utils import CompiledVocab
+    file_name = str(tmpdir.join('vocab.npz'))
+    CompiledVocab().save(file_name)
+    assert CompiledVocab.load(file_name) == {}
+
+
+def test_compiled_vocab_null_char(tmpdir):
+    from baseline.utils import CompiledVocab
+    with pytest.raises(ValueError):
+        CompiledVocab({'a\x00b': 0, 'c': 1}).save(str(tmpdir.join('vocab.npz')))
+
+
+def test_compiled_vocab_read_only():
+    from baseline.utils import CompiledVocab
+    vocab = CompiledVocab({'a': 0})
+    with pytest.raises(TypeError):
+        vocab['b'] = 1
+    with pytest.raises(TypeError):
+        vocab.update({'b': 1})
+    with pytest.raises(TypeError):
+        del vocab['a']
+    assert vocab == {'a': 0}
+
+
+def test_compiled_vocab_pickles():
+    import pickle
+    from baseline.utils import CompiledVocab
+    vocab = CompiledVocab(_random_vocab())
+    loaded = pickle.loads(pickle.dumps(vocab))
+    assert isinstance(loaded, CompiledVocab)
+    assert loaded == vocab
+
+
+def test_compiled_vocab_char_table():
+    from baseline.utils import CompiledVocab
+    vocab = CompiledVocab(_random_vocab())
+    table = vocab.char_table
+    for k, v in vocab.items():
+        if len(k) == 1:
+            assert table[ord(k)] == v
+    chars = set(k for k in vocab if len(k) == 1)
+    unk = [c for c in range(len(table)) if chr(c) not in chars]
+    assert (table[unk] == vocab['<UNK>']).all()
+
+
+def test_load_vocabs_prefers_compiled(tmpdir):
+    import json
+    from baseline.utils import CompiledVocab, load_vocabs
+    json_vocab = {'a': 0, 'b': 1}
+    compiled_vocab = {'c': 0, 'd': 1}
+    with open(str(tmpdir.join('vocabs-word-12.json')), 'w') as f:
+        json.dump(json_vocab, f)
+    with open(str(tmpdir.join('vocabs-char-12.json')), 'w') as f:
+        json.dump(json_vocab, f)
+    CompiledVocab(compiled_vocab).save(str(tmpdir.join('vocabs-char-12.npz')))
+    vocabs = load_vocabs(str(tmpdir))
+    assert vocabs == {'word': json_vocab, 'char': compiled_vocab}
+    assert all(type(v) is dict for v in vocabs.values())
+    # Loaded vocabs can still be extended
+    vocabs['word']['e'] = 2
+    vocabs = load_vocabs(str(tmpdir), compiled=True)
+    assert vocabs == {'word': json_vocab, 'char': compiled_vocab}
+    assert all(isinstance(v, CompiledVocab) for v in vocabs.values())
@@ -125,3 +125,85 @@ def test_text_ngrams():
 
     a, length = v.run(tokens, vocab)
     assert np.allclose(a[:length], np.arange(0, len(tokens)))
+
+
+def _random_batch(words, size=20, mxlen=12):
+    return [[np.random.choice(words) for _ in range(np.random.randint(0, mxlen))] for _ in range(size)]
+
+
+def _assert_run_batch_matches_run(vect, batch, vocab):
+    gold = [vect.run(tokens, vocab) for tokens in batch]
+    vec, lengths = vect.run_batch(batch, vocab)
+    np.testing.assert_equal(vec, np.stack([g[0] for g in gold]))
+    if gold[0][1] is None:
+        assert lengths is None
+    else:
+        np.testing.assert_equal(lengths, [g[1] for g in gold])
+
+
+WORDS = ['a', 'bb', 'abc', 'zzzzzzz', 'dog', 'cat', 'Q', '', 'a b', 'x?y']
+
+
+@pytest.mark.parametrize('kwargs', [{'mxlen': 5}, {'mxlen': 10, 'rev': True}, {'mxlen': 3}])
+def test_token_1d_run_batch(vocab, kwargs):
+    from baseline.vectorizers import Token1DVectorizer
+    word_vocab = {w: i for i, w in enumerate(['<PAD>', '<UNK>'] + WORDS[:5])}
+    batch = _random_batch(WORDS)
+    _assert_run_batch_matches_run(Token1DVectorizer(**kwargs), batch, word_vocab)
+
+
+def test_token_1d_run_batch_no_unk():
+    from baseline.vectorizers import Token1DVectorizer
+    word_vocab = {w: i for i, w in enumerate(['<PAD>'] + WORDS[:5])}
+    _assert_run_batch_matches_run(Token1DVectorizer(mxlen=8), _random_batch(WORDS), word_vocab)
+
+
+def test_go_run_batch():
+    from baseline.vectorizers import Token1DVectorizer, GOVectorizer
+    word_vocab = {w: i for i, w in enumerate(Offsets.VALUES + WORDS)}
+    _assert_run_batch_matches_run(GOVectorizer(Token1DVectorizer(mxlen=8)), _random_batch(WORDS), word_vocab)
+
+
+@pytest.mark.parametrize('mxwlen', [1, 2, 4, 10])
+def test_char_2d_run_batch(vocab, mxwlen):
+    vocab[' '] = vocab['<EOW>']
+    _assert_run_batch_matches_run(Char2DVectorizer(mxlen=6, mxwlen=mxwlen), _random_batch(WORDS), vocab)
+
+
+@pytest.mark.parametrize('rev', [True, False])
+def test_char_1d_run_batch(vocab, rev):
+    # `run` fails on an empty example
+    batch = [tokens + ['a'] for tokens in _random_batch(WORDS)]
+    _assert_run_batch_matches_run(Char1DVectorizer(mxlen=15, rev=rev), batch, vocab)
+
+
+def test_ngram_run_batch():
+    words = ['The', 'brown', 'dog', 'walked']
+    v = TextNGramVectorizer(filtsz=3, mxlen=6)
+    batch = [tokens + ['dog'] for tokens in _random_batch(words)]
+    cnt = v.count(['<PAD>'] + words * 2 + ['<PAD>'])
+    ngram_vocab = {'<UNK>': 0}
+    for word in cnt:
+        ngram_vocab[word] = len(ngram_vocab)
+    _assert_run_batch_matches_run(v, batch, ngram_vocab)
+
+
+def test_dict_1d_run_batch():
+    from baseline.vectorizers import Dict1DVectorizer
+    word_vocab = {w: i for i, w in enumerate(['<PAD>', '<UNK>'] + WORDS)}
+    batch = [[{'text': w, 'y': 'O'} for w in tokens] for tokens in _random_batch(WORDS)]
+    _assert_run_batch_matches_run(Dict1DVectorizer(fields='text', mxlen=7), batch, word_vocab)
+
+
+def test_run_batch_empty_batch(vocab):
+    vec, lengths = Char2DVectorizer(mxlen=4, mxwlen=3).run_batch([], vocab)
+    assert vec.shape == (0, 4, 3)
+    assert lengths.shape == (0,)
+
+
+@pytest.mark.parametrize('vect', [Char2DVectorizer(mxlen=6, mxwlen=3), Char1DVectorizer(mxlen=15)])
+def test_char_run_batch_compiled_vocab(vocab, vect):
+    from baseline.utils import CompiledVocab
+    batch = [tokens + [u'été'] for tokens in _random_batch(WORDS)]
+    np.testing.assert_equal(vect.run_batch(batch, CompiledVocab(vocab)), vect.run_batch(batch, vocab))
+    _assert_run_batch_matches_run(vect, batch, CompiledVocab(vocab))
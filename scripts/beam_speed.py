@@ -0,0 +1,82 @@
+"""Time the pytorch seq2seq beam search for RNN and transformer decoders at several beam sizes.
+
+The decoders have random weights and decode random encoder outputs.  The EOS logit gets a bias (`--eos_bias`) so the
+hypotheses finish at different steps, like real outputs do, rather than all running to `--mxlen`.  Each setting is
+timed with and without dropping the batch elements that have finished.  Throughput counts the tokens of every
+hypothesis.
+"""
+import time
+import argparse
+import torch
+from baseline.utils import Offsets
+from baseline.pytorch.embeddings import LookupTableEmbeddings, PositionalLookupTableEmbeddings
+from baseline.pytorch.seq2seq.encoders import RNNEncoderOutput, TransformerEncoderOutput
+from baseline.pytorch.seq2seq.decoders import RNNDecoderWithAttn, TransformerDecoderWrapper, beam_search
+
+
+def create_decoder(decoder_type, args):
+    if decoder_type == 'rnn':
+        embeddings = LookupTableEmbeddings('tgt', vsz=args.vsz, dsz=args.hsz)
+        decoder = RNNDecoderWithAttn(embeddings, hsz=args.hsz, rnntype='lstm', layers=args.layers, dropout=0.1)
+    else:
+        embeddings = PositionalLookupTableEmbeddings('tgt', vsz=args.vsz, dsz=args.hsz)
+        decoder = TransformerDecoderWrapper(embeddings, dropout=0.1, layers=args.layers, hsz=args.hsz, num_heads=4)
+    return decoder.eval()
+
+
+def create_encoder_outputs(decoder_type, args, device):
+    output = torch.randn(args.batchsz, args.srclen, args.hsz, device=device)
+    src_mask = torch.ones(args.batchsz, args.srclen, dtype=torch.bool, device=device)
+    if decoder_type == 'rnn':
+        hidden = tuple(torch.randn(args.layers, args.batchsz, args.hsz, device=device) for _ in range(2))
+        return RNNEncoderOutput(output, hidden, src_mask)
+    return TransformerEncoderOutput(output, src_mask)
+
+
+def time_search(decoder, encoder_outputs, beam, compact, args):
+    best = None
+    for _ in range(args.trials):
+        start = time.time()
+        _, lengths, _ = beam_search(
+            encoder_outputs, decoder.beam_init, decoder.beam_step, decoder.beam_update,
+            compact=decoder.beam_compact if compact else None, beam=beam, mxlen=args.mxlen
+        )
+        if encoder_outputs.output.is_cuda:
+            torch.cuda.synchronize()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return lengths.sum().item() / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the pytorch seq2seq beam search')
+    parser.add_argument('--decoders', nargs='+', default=['rnn', 'transformer'], choices=['rnn', 'transformer'])
+    parser.add_argument('--beams', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--batchsz', type=int, default=16)
+    parser.add_argument('--srclen', type=int, default=30)
+    parser.add_argument('--mxlen', type=int, default=60)
+    parser.add_argument('--hsz', type=int, default=256)
+    parser.add_argument('--layers', type=int, default=2)
+    parser.add_argument('--vsz', type=int, default=8000)
+    parser.add_argument('--eos_bias', type=float, default=1.0)
+    parser.add_argument('--trials', type=int, default=3)
+    parser.add_argument('--gpu', action='store_true')
+    args = parser.parse_args()
+
+    device = 'cuda' if args.gpu else 'cpu'
+    print('{:<12} {:>4} {:>16} {:>16} {:>8}'.format('decoder', 'beam', 'tokens/s (all)', 'tokens/s (drop)', 'speedup'))
+    for decoder_type in args.decoders:
+        torch.manual_seed(0)
+        decoder = create_decoder(decoder_type, args).to(device)
+        decoder.preds.bias.data[Offsets.EOS] += args.eos_bias
+        encoder_outputs = create_encoder_outputs(decoder_type, args, device)
+        for beam in args.beams:
+            everything = time_search(decoder, encoder_outputs, beam, False, args)
+            compacted = time_search(decoder, encoder_outputs, beam, True, args)
+            print('{:<12} {:>4} {:>16.1f} {:>16.1f} {:>7.2f}x'.format(
+                decoder_type, beam, everything, compacted, compacted / everything
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Time the pytorch CRF forward (with its backward pass) and Viterbi decode against the loops they replaced.
+
+The batches have random lengths between `--minlen` and `--seqlen` so part of every batch is padding.  The loop
+versions are copies of the implementations from before the recurrences were scripted and packed.
+"""
+import time
+import argparse
+import torch
+from baseline.utils import Offsets
+from baseline.pytorch.torchy import vec_log_sum_exp, sequence_mask
+from baseline.pytorch.crf import CRF, viterbi
+
+
+def loop_forward(unary, trans, lengths, start_idx, end_idx):
+    batch_size, n_tags = unary.size(1), unary.size(2)
+    min_length = torch.min(lengths)
+    alphas = torch.full((batch_size, 1, n_tags), -1e4, device=unary.device)
+    alphas[:, 0, start_idx] = 0.
+    for i, unary_t in enumerate(unary):
+        scores = alphas + trans + unary_t.unsqueeze(2)
+        new_alphas = vec_log_sum_exp(scores, 2).transpose(1, 2)
+        if i >= min_length:
+            mask = (i < lengths).view(-1, 1, 1)
+            alphas = alphas.masked_fill(mask, 0) + new_alphas.masked_fill(mask == 0, 0)
+        else:
+            alphas = new_alphas
+    return vec_log_sum_exp(alphas + trans[:, end_idx], 2).view(batch_size)
+
+
+def loop_viterbi(unary, trans, lengths, start_idx, end_idx):
+    seq_len, batch_size, tag_size = unary.size()
+    min_length = torch.min(lengths)
+    backpointers = []
+    alphas = torch.full((batch_size, 1, tag_size), -1e4, device=unary.device)
+    alphas[:, 0, start_idx] = 0
+    for i, unary_t in enumerate(unary):
+        viterbi, best_tag_ids = torch.max(alphas + trans, 2)
+        backpointers.append(best_tag_ids)
+        new_alphas = (viterbi + unary_t).unsqueeze(1)
+        if i >= min_length:
+            mask = (i < lengths).view(-1, 1, 1)
+            alphas = alphas.masked_fill(mask, 0) + new_alphas.masked_fill(mask == 0, 0)
+        else:
+            alphas = new_alphas
+    path_score, best_tag_id = torch.max(alphas.squeeze(1) + trans[:, end_idx, :], 1)
+    rev_len = seq_len - lengths - 1
+    best_path = [best_tag_id]
+    for i, backpointer_t in enumerate(reversed(backpointers)):
+        new_best_tag_id = backpointer_t.gather(1, best_tag_id.unsqueeze(1)).squeeze(1)
+        mask = (i > rev_len)
+        best_tag_id = best_tag_id.masked_fill(mask, 0) + new_best_tag_id.masked_fill(mask == 0, 0)
+        best_path.append(best_tag_id)
+    best_path.pop()
+    best_path.reverse()
+    best_path = torch.stack(best_path)
+    return best_path.masked_fill(sequence_mask(lengths, seq_len).to(best_path.device).transpose(0, 1) == 0, 0), path_score
+
+
+def best_time(fn, trials, cuda):
+    best = None
+    for _ in range(trials):
+        start = time.time()
+        fn()
+        if cuda:
+            torch.cuda.synchronize()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the pytorch CRF')
+    parser.add_argument('--tags', nargs='+', type=int, default=[10, 50, 200])
+    parser.add_argument('--batchsz', type=int, default=32)
+    parser.add_argument('--seqlen', type=int, default=100)
+    parser.add_argument('--minlen', type=int, default=10)
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--gpu', action='store_true')
+    args = parser.parse_args()
+
+    device = 'cuda' if args.gpu else 'cpu'
+    print('{:>5} {:<8} {:>10} {:>10} {:>8}'.format('tags', 'op', 'loop (ms)', 'new (ms)', 'speedup'))
+    for n_tags in args.tags:
+        torch.manual_seed(0)
+        unary = torch.randn(args.seqlen, args.batchsz, n_tags, device=device, requires_grad=True)
+        lengths = torch.randint(args.minlen, args.seqlen + 1, (args.batchsz,), device=device)
+        crf = CRF(n_tags).to(device)
+        crf.transitions_p.data.normal_()
+        trans = crf.transitions_p
+
+        def old_forward():
+            loop_forward(unary, trans, lengths, Offsets.GO, Offsets.EOS).sum().backward()
+
+        def new_forward():
+            crf(unary, lengths, args.batchsz).sum().backward()
+
+        def old_viterbi():
+            with torch.no_grad():
+                loop_viterbi(unary, trans, lengths, Offsets.GO, Offsets.EOS)
+
+        def new_viterbi():
+            with torch.no_grad():
+                viterbi(unary, trans, lengths, Offsets.GO, Offsets.EOS)
+
+        for op, old, new in (('forward', old_forward, new_forward), ('viterbi', old_viterbi, new_viterbi)):
+            # Warm up, the scripted functions are optimized on their first few calls
+            for _ in range(3):
+                old()
+                new()
+            old_time = best_time(old, args.trials, args.gpu)
+            new_time = best_time(new, args.trials, args.gpu)
+            print('{:>5} {:<8} {:>10.1f} {:>10.1f} {:>7.2f}x'.format(
+                n_tags, op, old_time * 1000, new_time * 1000, old_time / new_time
+            ))
+
+
+if __name__ == '__main__':
+    main()